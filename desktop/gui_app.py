@@ -795,13 +795,13 @@ class BubbleCleanerGUI:
         self.batch_processor.add_images(images_to_process)
         
         # Démarrer le traitement
-        # Utiliser 1 thread pour une seule image, 4 threads pour un dossier
+        # Un seul processus pour une image, sinon nombre choisi d'après la mémoire et les cœurs
         if len(images_to_process) == 1:
             num_workers = 1
-            self.log_message("🎯 Utilisation d'un seul thread (image unique)")
+            self.log_message("🎯 Utilisation d'un seul processus (image unique)")
         else:
-            num_workers = 4
-            self.log_message("🔄 Utilisation de 4 threads (traitement par lots)")
+            num_workers = None
+            self.log_message("🔄 Nombre de processus automatique (mémoire et cœurs disponibles)")
         
         self.batch_processor.start_processing(
             output_dir=str(self.output_dir),
@@ -1339,6 +1339,9 @@ def main():
                 # Arrêter le thread de log si il existe
                 if hasattr(app, 'log_thread') and app.log_thread.is_alive():
                     app.log_thread.join(timeout=1)
+                # Arrêter les processus du traitement par lots
+                if getattr(app, 'batch_processor', None):
+                    app.batch_processor.shutdown()
                 root.destroy()
         root.protocol("WM_DELETE_WINDOW", on_closing)
         # Centrer la fenêtre
@@ -11,14 +11,24 @@ from pathlib import Path
 from typing import List, Dict, Optional, Callable
 import logging
 import concurrent.futures
+from collections import deque
 
 # Import du patch PIL pour compatibilité
 import pil_patch
 
 from scripts.main_pipeline import run_pipeline
+from scripts.worker_pool import WorkerPool, auto_workers
+from scripts.model_loader import PROFILES, prepare_weights
 
 logger = logging.getLogger(__name__)
 
+def worker_profile(clean_only: bool, translate_only: bool) -> str:
+    """
+    Profil de modèles des workers (scripts/model_loader.py) : un lot de nettoyage seul ne charge
+    que Detectron2, sans EasyOCR ni OpenAI. La traduction seule d'une page détecte aussi les bulles (full).
+    """
+    return "clean" if clean_only else "full"
+
 def process_one(image_path, output_dir, clean_only, translate_only, verbose):
     from scripts.main_pipeline import run_pipeline
     import os
@@ -48,7 +58,7 @@ def process_one(image_path, output_dir, clean_only, translate_only, verbose):
             translate_only=translate_only,
             verbose=verbose
         )
-        return (image_path, True)
+        return (image_path, bool(result))
     except Exception as e:
         logger.error(f"Erreur dans le process: {e}")
         return (image_path, False)
@@ -79,6 +89,7 @@ class BatchProcessor:
         self.is_paused = False
         self.should_stop = False
         self.num_workers = 1  # Valeur par défaut
+        self.pool = None  # Pool de processus persistants (scripts/worker_pool.py), gardé entre les lots
         
         # Callbacks pour l'interface
         self.progress_callback = progress_callback
@@ -115,13 +126,21 @@ class BatchProcessor:
         self._update_status(f"{len(valid_paths)} images en attente")
     
     def start_processing(self, output_dir: str, clean_only: bool = False, 
-                        translate_only: bool = False, verbose: bool = False, num_workers: int = 1) -> None:
+                        translate_only: bool = False, verbose: bool = False, num_workers: Optional[int] = None,
+                        profile: Optional[str] = None) -> None:
         """
         Lance le traitement par lots en parallèle
+        
+        Args:
+            num_workers: Nombre de processus ; choisi d'après la mémoire et les cœurs si None
+            profile: Profil de modèles des workers ("clean", "translate", "full") ; déduit du mode par défaut
         """
         if self.is_running:
             logger.warning("Traitement deja en cours")
             return
+        profile = profile or worker_profile(clean_only, translate_only)
+        if not clean_only and profile == "clean":
+            raise ValueError("Le profil clean ne permet que le nettoyage (clean_only=True)")
         if self.queue.empty():
             logger.warning("Aucune image dans la file d'attente")
             return
@@ -129,15 +148,18 @@ class BatchProcessor:
         self.is_paused = False
         self.should_stop = False
         self.start_time = time.time()
+        if not num_workers:
+            num_workers, details = auto_workers(profile)
+            logger.info(f"Nombre de processus automatique: {details}")
         self.num_workers = num_workers
         # Lance le thread de gestion du pool
         self.worker_thread = threading.Thread(
             target=self._process_pool_worker,
-            args=(output_dir, clean_only, translate_only, verbose, num_workers),
+            args=(output_dir, clean_only, translate_only, verbose, num_workers, profile),
             daemon=True
         )
         self.worker_thread.start()
-        logger.info(f"Traitement par lots lance avec {num_workers} threads")
+        logger.info(f"Traitement par lots lance avec {num_workers} processus (profil {profile})")
         self._update_status("Traitement en cours...")
     
     def pause_processing(self) -> None:
@@ -204,7 +226,8 @@ class BatchProcessor:
             'failed': self.failed_images,
             'current_image': self.current_image,
             'elapsed_time': elapsed_time,
-            'estimated_remaining': estimated_remaining
+            'estimated_remaining': estimated_remaining,
+            'workers': self.pool.worker_stats() if self.pool else []
         }
     
     def get_results(self) -> Dict:
@@ -221,7 +244,8 @@ class BatchProcessor:
             'total_images': self.total_images
         }
     
-    def _process_pool_worker(self, output_dir: str, clean_only: bool, translate_only: bool, verbose: bool, num_workers: int) -> None:
+    def _process_pool_worker(self, output_dir: str, clean_only: bool, translate_only: bool, verbose: bool, num_workers: int,
+                             profile: str = "full") -> None:
         """Traitement parallèle des images avec ProcessPoolExecutor"""
         try:
             images = []
@@ -232,20 +256,43 @@ class BatchProcessor:
             self.failed_images = 0
             self._update_progress()
             self._update_status(f"{self.total_images} images à traiter")
-            # Utilisation de ProcessPoolExecutor avec la fonction process_one du module
-            with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
-                futures = [executor.submit(process_one, img, output_dir, clean_only, translate_only, verbose) for img in images]
-                for future in concurrent.futures.as_completed(futures):
+            pool = self._get_pool(profile, num_workers)
+            pool.reset_stats()
+            # Pages soumises au fil de l'eau (deux par processus au plus) : pause et arrêt pris en compte
+            # entre deux pages, sans arrêter le pool
+            pending = deque(images)
+            in_flight = {}
+            while True:
+                while pending and len(in_flight) < 2 * pool.num_workers and not (self.should_stop or self.is_paused):
+                    img = pending.popleft()
+                    in_flight[pool.submit(process_one, img, output_dir, clean_only, translate_only, verbose)] = img
+                if not in_flight:
+                    if pending and self.is_paused and not self.should_stop:
+                        time.sleep(0.2)
+                        continue
+                    break
+                done, _ = concurrent.futures.wait(in_flight, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self.current_image = in_flight.pop(future)
                     try:
-                        img_path, success = future.result()
-                        self.processed_images += 1
-                        if not success:
-                            self.failed_images += 1
+                        (img_path, success), info = future.result()
+                        pool.record(info, success)
                     except Exception as e:
-                        self.processed_images += 1
-                        self.failed_images += 1
+                        success = False
                         logger.error(f"Erreur dans le process: {e}")
+                        if isinstance(e, concurrent.futures.BrokenExecutor):
+                            # Processus mort : pages restantes en échec, pool recréé au prochain lot
+                            self.pool = None
+                            self.processed_images += len(pending)
+                            self.failed_images += len(pending)
+                            pending.clear()
+                    self.processed_images += 1
+                    if not success:
+                        self.failed_images += 1
                     self._update_progress()
+                if done and not self.is_paused:
+                    self._update_status(self._throughput_status())
+            pool.save_footprints()
             self.is_running = False
             self.current_image = None
             if self.should_stop:
@@ -260,6 +307,11 @@ class BatchProcessor:
                 logger.info(f"   - Images traitees: {self.processed_images}/{self.total_images}")
                 logger.info(f"   - Taux de reussite: {success_rate:.1f}%")
                 logger.info(f"   - Temps total: {total_time:.1f}s")
+                for stats in pool.worker_stats():
+                    startup = stats["startup_seconds"]
+                    logger.info(f"   - Processus {stats['pid']}: {stats['images']} images, "
+                                f"{stats['pages_per_minute']:.1f} pages/min"
+                                + (f", pret en {startup:.1f}s" if startup is not None else ""))
         except Exception as e:
             logger.error(f"Erreur fatale dans le traitement par lots: {e}")
             self.is_running = False
@@ -267,6 +319,31 @@ class BatchProcessor:
             if self.error_callback:
                 self.error_callback(None, f"Erreur fatale: {e}")
     
+    def _get_pool(self, profile: str, num_workers: int) -> WorkerPool:
+        """Pool du lot : celui du lot précédent s'il a le même profil et assez de processus (modèles déjà chargés)"""
+        if self.pool is not None and not self.pool.matches(profile, num_workers):
+            self.pool.shutdown()
+            self.pool = None
+        if self.pool is None:
+            if "detectron2" in PROFILES[profile]:
+                # Cache de poids préparé ici une fois, pas par chaque worker en parallèle
+                prepare_weights()
+            self.pool = WorkerPool(profile, num_workers)
+        return self.pool
+    
+    def _throughput_status(self) -> str:
+        """Statut avec le débit total et par processus"""
+        workers = self.pool.worker_stats() if self.pool else []
+        total = sum(stats["pages_per_minute"] for stats in workers)
+        per_worker = ", ".join(f"{stats['pages_per_minute']:.1f}" for stats in workers)
+        return f"Traitement en cours - {len(workers)} processus, {total:.1f} pages/min ({per_worker})"
+    
+    def shutdown(self) -> None:
+        """Arrête les processus du pool (fermeture de l'application)"""
+        if self.pool is not None:
+            self.pool.shutdown(cancel=True)
+            self.pool = None
+    
     def _update_progress(self) -> None:
         """Met à jour la progression"""
         if self.progress_callback:
@@ -1,11 +1,8 @@
 import os
+import sys
 import cv2
-import torch
 import numpy as np
 import logging
-from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
-from detectron2 import model_zoo
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
@@ -14,14 +11,10 @@ logger = logging.getLogger(__name__)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 
-cfg = get_cfg()
-cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-cfg.MODEL.WEIGHTS = os.path.join(PROJECT_DIR, "models", "model_final.pth")
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
-cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3  # bubble, floating_text, narration_box
-cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-
-predictor = DefaultPredictor(cfg)
+# Détecteur Detectron2 chargé au premier appel (seul modèle du profil "clean")
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+from model_loader import predictor
 
 # === PARAMÈTRES DE NETTOYAGE ===
 FILL_COLOR = (255, 255, 255)  # Blanc
@@ -53,7 +46,6 @@ def clean_bubbles(image, outputs):
     return result
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) != 2:
         logger.error("Usage : python clean_bubbles.py chemin/image.jpg")
         sys.exit(1)
@@ -34,6 +34,13 @@ if not logging.getLogger().handlers:
     )
 logger = logging.getLogger(__name__)
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+import memory_profile
+from memory_profile import memory_stage, profiled
+
+@profiled
 def run_pipeline(image_path, output_dir="output", clean_only=False, translate_only=False, verbose=False):
     """
     Exécute le pipeline complet de traitement des bulles
@@ -73,40 +80,38 @@ def run_pipeline(image_path, output_dir="output", clean_only=False, translate_on
         logger.info(f"DOSSIERS: Dossiers de sortie crees: {output_dir}")
     
     try:
+        import cv2
+        import json
+        from clean_bubbles import clean_bubbles, predictor
+        
+        # Page gardée en mémoire d'une étape à l'autre : image décodée une fois, une seule détection ;
+        # seuls les résultats finaux sont écrits sur disque
+        with memory_stage("decode"):
+            image = cv2.imread(str(image_path))
+        if image is None:
+            logger.error(f"ERREUR: Impossible de charger l'image: {image_path}")
+            return False
+        basename = image_path.stem
+        with memory_stage("detect"):
+            outputs = predictor(image)
+        cleaned_image = None
+        
         # Étape 1: Nettoyage des bulles
         if not translate_only:
             logger.info("Etape 1: Nettoyage des bulles...")
-            
-            if clean_only:
-                # Nettoyage seulement : sauvegarder directement dans le dossier principal
-                cleaned_path = cleaned_dir / f"cleaned_{image_path.name}"
-            else:
-                # Pipeline complet : sauvegarder dans le sous-dossier cleaned
-                cleaned_path = cleaned_dir / f"cleaned_{image_path.name}"
-            
-            # Import et exécution du nettoyage
-            from clean_bubbles import clean_bubbles, predictor
-            import cv2
-            
-            image = cv2.imread(str(image_path))
-            outputs = predictor(image)
-            cleaned_image = clean_bubbles(image, outputs)
+            cleaned_path = cleaned_dir / f"cleaned_{image_path.name}"
+            with memory_stage("clean"):
+                cleaned_image = clean_bubbles(image, outputs)
             cv2.imwrite(str(cleaned_path), cleaned_image)
             logger.info(f"Image nettoyee: {cleaned_path}")
         
-        # Étape 2: Extraction et traduction
+        # Étape 2: Extraction et traduction (mêmes détections que le nettoyage)
         if not clean_only:
             logger.info("Etape 2: Extraction et traduction du texte...")
-            basename = image_path.stem
+            from translate_bubbles import extract_and_translate
             
-            # Import et exécution de la traduction
-            from translate_bubbles import extract_and_translate, predictor
-            import cv2
-            import json
-            
-            image = cv2.imread(str(image_path))
-            outputs = predictor(image)
-            results = extract_and_translate(image, outputs)
+            with memory_stage("ocr_translate"):
+                results = extract_and_translate(image, outputs)
             
             # Sauvegarde des résultats
             txt_path = translations_dir / f"{basename}.txt"
@@ -123,13 +128,15 @@ def run_pipeline(image_path, output_dir="output", clean_only=False, translate_on
             
             logger.info(f"OK: Traductions sauvegardees: {txt_path}, {json_path}")
             
-            # Étape 3: Réinsertion du texte traduit (seulement pour le pipeline complet)
-            if not clean_only and not translate_only and results:
+            # Étape 3: Réinsertion du texte traduit dans l'image nettoyée en mémoire (pipeline complet)
+            if cleaned_image is not None and results:
                 logger.info("Etape 3: Reinsertion du texte traduit...")
-                from reinsert_translations import draw_translated_text
+                from reinsert_translations import draw_translations
                 
                 final_path = final_dir / f"{basename}_translated.png"
-                draw_translated_text(str(cleaned_path), str(json_path), str(final_path))
+                with memory_stage("reinsert"):
+                    final_image = draw_translations(cleaned_image, results)
+                cv2.imwrite(str(final_path), final_image)
                 logger.info(f"Image finale: {final_path}")
         
         logger.info("Pipeline termine avec succes!")
@@ -146,11 +153,15 @@ def main():
     parser.add_argument("--clean-only", action="store_true", help="Nettoyer seulement")
     parser.add_argument("--translate-only", action="store_true", help="Traduire seulement")
     parser.add_argument("--verbose", "-v", action="store_true", help="Mode verbeux")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="Profil mémoire par étape (comme MEMORY_PROFILE=1), ajouté à MEMORY_PROFILE_FILE")
     
     args = parser.parse_args()
     
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
+    if args.memory_profile:
+        memory_profile.MEMORY_PROFILE = True
     
     success = run_pipeline(
         args.image_path,
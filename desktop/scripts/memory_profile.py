@@ -0,0 +1,247 @@
+"""
+Profil mémoire par page et par étape de run_pipeline (décodage, détection, nettoyage, OCR/traduction,
+réinsertion), pour trouver l'étape qui fait exploser la mémoire d'un processus du lot.
+
+- Activé par MEMORY_PROFILE=1 (hérité par les processus du lot) ou par l'option --memory-profile de
+  main_pipeline.py : chaque étape relève son pic de RSS (échantillonné), son pic de mémoire Python
+  (tracemalloc : allocations numpy comprises, pas celles de PyTorch) et les lignes qui ont le plus alloué.
+- Un rapport par page (une ligne JSON) est ajouté à MEMORY_PROFILE_FILE, au même format que le profil
+  mémoire du backend web (web/backend/processing/memory_profile.py).
+
+Résumé des rapports (étapes triées par hausse de mémoire) :
+    python scripts/memory_profile.py memory_profile.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import statistics
+import threading
+import tracemalloc
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "0").lower() in ("1", "true", "yes")
+MEMORY_PROFILE_FILE = os.getenv("MEMORY_PROFILE_FILE", "memory_profile.jsonl")
+# Lignes d'allocation retenues par étape (0 : pas d'instantané tracemalloc, bien plus rapide)
+MEMORY_PROFILE_TOP = int(os.getenv("MEMORY_PROFILE_TOP", "5"))
+MEMORY_PROFILE_SAMPLE_MS = float(os.getenv("MEMORY_PROFILE_SAMPLE_MS", "2"))
+
+MB = 1024 * 1024
+
+# Profil de la page en cours dans ce processus (run_pipeline traite une page à la fois)
+_current = None
+_write_lock = threading.Lock()
+
+def current_rss():
+    """Mémoire résidente du processus (octets) : /proc sous Linux, psutil ailleurs ; None si inconnue"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+def _mb(value):
+    return None if value is None else round(value / MB, 1)
+
+class _RssSampler:
+    """Relève la RSS toutes les MEMORY_PROFILE_SAMPLE_MS ms dans un thread ; `reset()` démarre une fenêtre"""
+
+    def __init__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(MEMORY_PROFILE_SAMPLE_MS / 1000):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def reset(self):
+        self.peak = current_rss()
+        return self.peak
+
+    def read(self):
+        rss = current_rss()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+        return self.peak
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+def _snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+
+def _top_allocations(before, after, limit):
+    if before is None or after is None:
+        return []
+    return [
+        {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+         "size_kb": round(stat.size_diff / 1024, 1), "count": stat.count_diff}
+        for stat in after.compare_to(before, "lineno")[:limit] if stat.size_diff > 0
+    ]
+
+class PageProfile:
+    """Mesures mémoire des étapes d'une page"""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.sampler = _RssSampler()
+        self.rss_start = self.rss_peak = self.sampler.peak
+        self.traced_start, self.traced_peak = tracemalloc.get_traced_memory()
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = self.sampler.reset()
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        snapshot_before = _snapshot() if MEMORY_PROFILE_TOP else None
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            rss_peak = self.sampler.read()
+            rss_after = current_rss()
+            top = _top_allocations(snapshot_before, _snapshot() if MEMORY_PROFILE_TOP else None, MEMORY_PROFILE_TOP)
+            self.rss_peak = max(filter(None, (self.rss_peak, rss_peak)), default=None)
+            self.traced_peak = max(self.traced_peak, traced_peak)
+            self.stages.append({
+                "name": name,
+                "thread": threading.current_thread().name,
+                "duration_ms": round(duration_ms, 1),
+                "rss_before_mb": _mb(rss_before),
+                "rss_after_mb": _mb(rss_after),
+                "rss_peak_mb": _mb(rss_peak),
+                "rss_peak_delta_mb": _mb(rss_peak - rss_before) if None not in (rss_peak, rss_before) else None,
+                "traced_before_mb": _mb(traced_before),
+                "traced_after_mb": _mb(traced_after),
+                "traced_peak_mb": _mb(traced_peak),
+                "traced_peak_delta_mb": _mb(traced_peak - traced_before),
+                "top_allocations": top,
+            })
+
+    def peak_stage(self):
+        """Étape qui a le plus fait monter la RSS (la mémoire Python si la RSS est inconnue)"""
+        key = "rss_peak_delta_mb" if self.rss_start is not None else "traced_peak_delta_mb"
+        return max(self.stages, key=lambda stage: stage[key] or 0, default=None)
+
+    def finish(self):
+        self.rss_peak = max(filter(None, (self.rss_peak, self.sampler.read())), default=None)
+        self.sampler.stop()
+        peak = self.peak_stage()
+        return {
+            "name": self.name,
+            "trace_id": None,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "attributes": dict(self.attributes, pid=os.getpid()),
+            "rss_start_mb": _mb(self.rss_start),
+            "rss_end_mb": _mb(current_rss()),
+            "rss_peak_mb": _mb(self.rss_peak),
+            "traced_start_mb": _mb(self.traced_start),
+            "traced_peak_mb": _mb(self.traced_peak),
+            "peak_stage": peak["name"] if peak else None,
+            "stages": self.stages,
+        }
+
+def _write(report):
+    # Une ligne par rapport, en ajout : les processus du lot peuvent partager le fichier
+    try:
+        with _write_lock, open(MEMORY_PROFILE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"Rapport memoire non ecrit ({MEMORY_PROFILE_FILE}): {e}")
+
+@contextmanager
+def memory_stage(name):
+    """Mesure mémoire d'une étape dans le profil de la page en cours (sans effet hors profilage)"""
+    if _current is None:
+        yield
+        return
+    with _current.stage(name):
+        yield
+
+def profiled(func):
+    """run_pipeline(image_path, ...) exécutée dans un profil de page si MEMORY_PROFILE est activé"""
+
+    @functools.wraps(func)
+    def wrapper(image_path, *args, **kwargs):
+        global _current
+        if not MEMORY_PROFILE or _current is not None:
+            return func(image_path, *args, **kwargs)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _current = PageProfile(os.path.basename(str(image_path)), function=func.__name__)
+        try:
+            return func(image_path, *args, **kwargs)
+        finally:
+            profile, _current = _current, None
+            report = profile.finish()
+            logger.info(f"Memoire {report['name']}: pic RSS {report['rss_peak_mb']} Mo, "
+                        f"pic Python {report['traced_peak_mb']} Mo (etape {report['peak_stage']})")
+            _write(report)
+    return wrapper
+
+# === ANALYSE ===
+def summarize(reports):
+    """{étape: (nombre, médiane et max des hausses de RSS, médiane et max des hausses de mémoire Python)}"""
+    by_stage = {}
+    for report in reports:
+        for stage in report["stages"]:
+            by_stage.setdefault(stage["name"], []).append(stage)
+    summary = {}
+    for name, stages in by_stage.items():
+        rss = [s["rss_peak_delta_mb"] for s in stages if s["rss_peak_delta_mb"] is not None]
+        traced = [s["traced_peak_delta_mb"] for s in stages]
+        summary[name] = (len(stages), round(statistics.median(rss), 1) if rss else None, max(rss, default=None),
+                         round(statistics.median(traced), 1), max(traced))
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Résumé des rapports mémoire de run_pipeline")
+    parser.add_argument("paths", nargs="+", help="Fichiers JSONL (MEMORY_PROFILE_FILE)")
+    args = parser.parse_args()
+
+    reports = []
+    for path in args.paths:
+        with open(path, encoding="utf-8") as f:
+            reports.extend(json.loads(line) for line in f if line.strip())
+    if not reports:
+        print("❌ Aucun rapport")
+        sys.exit(1)
+    print(f"📊 {len(reports)} page(s) profilee(s) - pics en Mo au-dessus du debut de l'etape")
+    print(f"{'etape':<16}{'n':>6}{'RSS med.':>10}{'RSS max':>10}{'Python med.':>13}{'Python max':>12}")
+    summary = summarize(reports)
+    for name, (count, rss_median, rss_max, traced_median, traced_max) in sorted(
+            summary.items(), key=lambda item: -max(item[1][2] or 0, item[1][4])):
+        print(f"{name:<16}{count:>6}{'-' if rss_median is None else rss_median:>10}{'-' if rss_max is None else rss_max:>10}"
+              f"{traced_median:>13}{traced_max:>12}")
+    worst = max(reports, key=lambda r: r["rss_peak_mb"] or r["traced_peak_mb"] or 0)
+    print(f"🔝 Plus fort pic : {worst['name']} ({worst['rss_peak_mb']} Mo RSS, etape {worst['peak_stage']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Chargement des modèles au premier usage et profils de worker
+(détecteur Detectron2, lecteur EasyOCR, client OpenAI)
+
+Importer clean_bubbles ou translate_bubbles ne charge aucun modèle : chaque ressource est créée
+au premier usage, une seule fois par processus. Le profil borne les modèles qu'un processus peut
+charger, pour lancer plus de workers dans la même mémoire :
+- clean : Detectron2 seulement (détection et nettoyage)
+- translate : EasyOCR et OpenAI (OCR et traduction de bulles déjà détectées ou éditées)
+- full : les trois (pipeline complet, traduction seule d'une page)
+Le profil vient de WORKER_PROFILE (défaut full) ou de set_profile() (workers du BatchProcessor).
+Les poids Detectron2 sont projetés en mémoire depuis le cache safetensors (weights_cache.py), préparé au
+premier chargement ou, pour le BatchProcessor, une seule fois par le processus parent (prepare_weights).
+"""
+
+import os
+import sys
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Un seul chargeur (donc un seul exemplaire de chaque modèle) par processus, que le module soit
+# importé comme `model_loader` (scripts/ dans sys.path) ou comme `scripts.model_loader`
+for _alias in ("model_loader", "scripts.model_loader"):
+    sys.modules.setdefault(_alias, sys.modules[__name__])
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+WEIGHTS_PATH = os.path.join(PROJECT_DIR, "models", "model_final.pth")
+
+PROFILES = {
+    "clean": ("detectron2",),
+    "translate": ("easyocr", "openai"),
+    "full": ("detectron2", "easyocr", "openai"),
+}
+
+# Temps de chargement des modèles (secondes)
+model_load_seconds = {}
+
+class ModelUnavailable(RuntimeError):
+    """Modèle exclu par le profil du worker"""
+
+_profile = {"name": "full", "models": frozenset(PROFILES["full"])}
+
+def set_profile(name):
+    """Choisit le profil du processus (avant le premier usage des modèles)"""
+    if name not in PROFILES:
+        raise ValueError(f"Profil de worker inconnu: {name} (attendu: {', '.join(PROFILES)})")
+    _profile.update(name=name, models=frozenset(PROFILES[name]))
+    logger.info(f"Profil de worker: {name} ({', '.join(PROFILES[name])})")
+
+def get_profile():
+    return _profile["name"]
+
+# Les workers du lot ne (ré)écrivent jamais le cache de poids : le processus parent l'a préparé
+_weights = {"prepare": True}
+
+def use_prepared_weights():
+    """Worker du lot : le cache de poids est seulement lu, la préparation revient au processus parent"""
+    _weights["prepare"] = False
+
+def prepare_weights():
+    """Écrit le cache safetensors des poids Detectron2 s'il est absent ou périmé (avant de lancer les workers)"""
+    if not os.path.exists(WEIGHTS_PATH):
+        return None
+    if SCRIPT_DIR not in sys.path:
+        sys.path.append(SCRIPT_DIR)
+    import weights_cache
+
+    try:
+        return weights_cache.prepare(WEIGHTS_PATH)
+    except Exception as e:
+        logger.warning(f"Cache de poids non prepare ({e}), les workers chargeront {WEIGHTS_PATH}")
+        return None
+
+def allows(*names):
+    return _profile["models"].issuperset(names)
+
+class LazyResource:
+    """Ressource créée au premier accès ; les attributs et appels sont délégués à la ressource"""
+
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            if not allows(self._name):
+                raise ModelUnavailable(f"Modèle {self._name} indisponible dans le profil {get_profile()}")
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    value = self._loader()
+                    model_load_seconds[self._name] = time.perf_counter() - started
+                    logger.info(f"{self._name} charge en {model_load_seconds[self._name]:.1f}s")
+                    self._value = value
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+def _load_predictor():
+    import torch
+    from detectron2.config import get_cfg
+    from detectron2.engine import DefaultPredictor
+    from detectron2 import model_zoo
+
+    if SCRIPT_DIR not in sys.path:
+        sys.path.append(SCRIPT_DIR)
+    import weights_cache
+
+    weights = WEIGHTS_PATH
+    # Cache safetensors écrit au premier chargement (hors workers du lot), puis projeté en mémoire
+    # (partagé entre processus)
+    state = None
+    if os.path.exists(weights):
+        try:
+            if _weights["prepare"] and weights_cache.check(weights) is not None:
+                weights_cache.prepare(weights, force=True)
+            state = weights_cache.load_state_dict(weights)
+        except Exception as e:
+            logger.warning(f"Cache de poids indisponible ({e}), chargement depuis {weights}")
+
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
+    cfg.MODEL.WEIGHTS = "" if state is not None else weights
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3  # bubble, floating_text, narration_box
+    cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = DefaultPredictor(cfg)
+    if state is not None:
+        weights_cache.assign(predictor.model, state)
+    return predictor
+
+def _load_reader():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=True)
+
+def _load_client():
+    import openai
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    try:
+        # Essai standard
+        return openai.OpenAI(api_key=api_key)
+    except TypeError as e:
+        if "proxies" in str(e):
+            # Fallback 1: sans http_client
+            try:
+                return openai.OpenAI(api_key=api_key, http_client=None)
+            except:
+                pass
+        # Fallback 2: avec paramètres minimaux
+        try:
+            return openai.OpenAI(api_key=api_key, base_url="https://api.openai.com/v1")
+        except:
+            pass
+        # Fallback 3: approche alternative
+        try:
+            import httpx
+            return openai.OpenAI(api_key=api_key, http_client=httpx.Client())
+        except:
+            pass
+        # Si rien ne marche, on lève l'erreur originale
+        raise e
+
+predictor = LazyResource("detectron2", _load_predictor)
+reader = LazyResource("easyocr", _load_reader)
+client = LazyResource("openai", _load_client)
+
+RESOURCES = {"detectron2": predictor, "easyocr": reader, "openai": client}
+
+set_profile(os.getenv("WORKER_PROFILE", "full"))
+
+def preload(names=None):
+    """Charge les modèles demandés (ceux du profil par défaut)"""
+    for name in names or PROFILES[get_profile()]:
+        RESOURCES[name].get()
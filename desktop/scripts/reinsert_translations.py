@@ -65,8 +65,8 @@ def wrap_text(text, font, max_width):
     
     return lines
 
-def draw_text_on_image(image, bubble_data, text):
-    """Dessine le texte sur l'image à la position de la bulle"""
+def draw_text_on_image(image, bubble_data, text, font_path=None):
+    """Dessine le texte sur l'image à la position de la bulle (police cherchée si font_path n'est pas fourni)"""
     try:
         # Convertir l'image OpenCV en PIL
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -90,11 +90,12 @@ def draw_text_on_image(image, bubble_data, text):
         available_height = box_height - (2 * margin_y)
         
         # Charger la police
-        font_path = find_font()
-        if font_path:
-            logger.info(f"OK: Police chargee: {os.path.basename(font_path)}")
-        else:
-            logger.warning("ATTENTION: Police non trouvee, utilisation de la police par defaut")
+        if font_path is None:
+            font_path = find_font()
+            if font_path:
+                logger.info(f"OK: Police chargee: {os.path.basename(font_path)}")
+            else:
+                logger.warning("ATTENTION: Police non trouvee, utilisation de la police par defaut")
         
         # Taille de police par défaut
         font_size = bubble_data.get('font_size', 16)
@@ -136,6 +137,23 @@ def draw_text_on_image(image, bubble_data, text):
         logger.error(f"ERREUR lors du dessin du texte: {e}")
         return image
 
+def draw_translations(image, translations):
+    """Dessine les textes traduits sur l'image nettoyée (en mémoire) et renvoie l'image finale"""
+    # Police cherchée une fois pour toute la page ("" : police par défaut, sans nouvelle recherche)
+    font_path = find_font() or ""
+    if font_path:
+        logger.info(f"OK: Police chargee: {os.path.basename(font_path)}")
+    else:
+        logger.warning("ATTENTION: Police non trouvee, utilisation de la police par defaut")
+    
+    # Dessiner chaque texte traduit
+    for bubble_data in translations:
+        translated_text = bubble_data.get('translated_text', '')
+        if translated_text:
+            image = draw_text_on_image(image, bubble_data, translated_text, font_path=font_path)
+    
+    return image
+
 def draw_translated_text(image_path, json_path, output_path):
     """Dessine le texte traduit sur l'image nettoyée"""
     try:
@@ -153,33 +171,7 @@ def draw_translated_text(image_path, json_path, output_path):
         
         logger.info(f"OK: {len(translations)} bulles chargees")
         
-        # Dessiner chaque texte traduit
-        for i, bubble_data in enumerate(translations):
-            translated_text = bubble_data.get('translated_text', '')
-            if not translated_text:
-                continue
-            
-            # Obtenir les coordonnées de la bulle
-            x_min = int(bubble_data.get('x_min', 0))
-            y_min = int(bubble_data.get('y_min', 0))
-            x_max = int(bubble_data.get('x_max', 0))
-            y_max = int(bubble_data.get('y_max', 0))
-            
-            # Calculer la taille de police basée sur la taille de la bulle
-            bubble_width = x_max - x_min
-            bubble_height = y_max - y_min
-            font_size = min(bubble_width // 10, bubble_height // 2, 72)  # Limiter à 72pt max
-            font_size = max(font_size, 8)  # Minimum 8pt
-            
-            # Charger la police
-            font_path = find_font()
-            if font_path:
-                logger.info(f"OK: Police chargee: {os.path.basename(font_path)}")
-            else:
-                logger.warning("ATTENTION: Police non trouvee, utilisation de la police par defaut")
-            
-            # Dessiner le texte
-            image = draw_text_on_image(image, bubble_data, translated_text)
+        image = draw_translations(image, translations)
         
         # Sauvegarder l'image finale
         cv2.imwrite(output_path, image)
@@ -1,11 +1,8 @@
 import os
 import sys
 import cv2
-import torch
 import json
 import numpy as np
-import easyocr
-import openai
 import logging
 from pathlib import Path
 
@@ -21,26 +18,17 @@ try:
 except ImportError:
     pass
 
-from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
-from detectron2 import model_zoo
-
 # Configuration du logging
 logger = logging.getLogger(__name__)
 
-# === CONFIGURATION DETECTRON2 ===
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 
-cfg = get_cfg()
-cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-cfg.MODEL.WEIGHTS = os.path.join(PROJECT_DIR, "models", "model_final.pth")
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
-cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3
-cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-
-predictor = DefaultPredictor(cfg)
-reader = easyocr.Reader(['en'], gpu=True)
+# Modèles chargés au premier usage : importer ce module ne charge ni EasyOCR ni OpenAI
+# (profil "clean" des workers de nettoyage) et n'exige pas OPENAI_API_KEY
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+from model_loader import client, predictor, reader
 
 CLASS_NAMES = {0: "bubble", 1: "floating_text", 2: "narration_box"}
 # Import de la configuration hybride
@@ -51,43 +39,10 @@ from config import OCR_CONFIG, OPENAI_CONFIG
 # Utilise la configuration centralisée
 CONFIDENCE_THRESHOLD = OCR_CONFIG["confidence_threshold"]
 
-# === OPENAI (nouvelle API) ===
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is required")
-
-# Initialisation du client OpenAI avec gestion d'erreur robuste
-def create_openai_client():
-    """Crée un client OpenAI avec gestion d'erreur pour compatibilité"""
-    try:
-        # Essai standard
-        return openai.OpenAI(api_key=api_key)
-    except TypeError as e:
-        if "proxies" in str(e):
-            # Fallback 1: sans http_client
-            try:
-                return openai.OpenAI(api_key=api_key, http_client=None)
-            except:
-                pass
-        # Fallback 2: avec paramètres minimaux
-        try:
-            return openai.OpenAI(api_key=api_key, base_url="https://api.openai.com/v1")
-        except:
-            pass
-        # Fallback 3: approche alternative
-        try:
-            import httpx
-            return openai.OpenAI(api_key=api_key, http_client=httpx.Client())
-        except:
-            pass
-        # Si rien ne marche, on lève l'erreur originale
-        raise e
-
-client = create_openai_client()
-
 def translate(text):
     if not text.strip():
         return ""
+    from openai import AuthenticationError, RateLimitError
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -99,10 +54,10 @@ def translate(text):
             temperature=0.3
         )
         return response.choices[0].message.content.strip()
-    except openai.AuthenticationError:
+    except AuthenticationError:
         logger.error("ERREUR: Erreur d'authentification OpenAI. Verifiez votre cle API.")
         return f"[ERREUR: Clé API invalide]"
-    except openai.RateLimitError:
+    except RateLimitError:
         logger.error("ERREUR: Limite de taux depassee. Attendez avant de reessayer.")
         return f"[ERREUR: Limite de taux]"
     except Exception as e:
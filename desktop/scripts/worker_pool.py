@@ -0,0 +1,235 @@
+"""
+Pool de processus persistants pour le traitement par lots
+
+Chaque processus charge et chauffe ses modèles une seule fois, à son démarrage (init_worker), puis
+traite les pages les unes après les autres ; le pool est gardé d'un lot à l'autre. Le nombre de
+processus est choisi d'après la mémoire disponible et le nombre de cœurs (auto_workers), avec
+l'empreinte mémoire de chaque modèle mesurée par les workers eux-mêmes et conservée dans
+models/worker_footprints.json. Le débit de chaque processus est suivi (WorkerPool.worker_stats).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import logging
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+FOOTPRINTS_FILE = os.path.join(PROJECT_DIR, "models", "worker_footprints.json")
+
+# Empreintes initiales (Mo) tant qu'aucune mesure n'a été faite sur ce poste : processus sans modèle
+# (Python, OpenCV, pipeline) puis chaque modèle, bibliothèque comprise
+DEFAULT_FOOTPRINTS_MB = {"base": 250, "detectron2": 900, "easyocr": 500, "openai": 60}
+
+MEMORY_RESERVE_MB = int(os.getenv("BATCH_MEMORY_RESERVE_MB", "1024"))  # Interface et système
+MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+THREADS_PER_WORKER = int(os.getenv("BATCH_THREADS_PER_WORKER", "2"))
+
+def private_memory_mb():
+    """Mémoire propre du processus en Mo (pages anonymes sous Linux, USS avec psutil), None si inconnue"""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Anonymous:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_full_info().uss / 2**20
+    except Exception:
+        return None
+
+def available_memory_mb():
+    """Mémoire disponible sur le poste en Mo, None si inconnue"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 2**20
+    except Exception:
+        return None
+
+def load_footprints():
+    """Empreintes mémoire par modèle (Mo) : mesures de ce poste, sinon valeurs initiales"""
+    footprints = dict(DEFAULT_FOOTPRINTS_MB)
+    try:
+        with open(FOOTPRINTS_FILE, encoding="utf-8") as f:
+            footprints.update({name: float(value) for name, value in json.load(f).items()})
+    except (OSError, ValueError):
+        pass
+    return footprints
+
+def save_footprints(measured):
+    """Enregistre les empreintes mesurées (remplacent les précédentes pour les mêmes modèles)"""
+    if not measured:
+        return
+    footprints = {}
+    try:
+        with open(FOOTPRINTS_FILE, encoding="utf-8") as f:
+            footprints = json.load(f)
+    except (OSError, ValueError):
+        pass
+    footprints.update({name: round(value, 1) for name, value in measured.items()})
+    try:
+        os.makedirs(os.path.dirname(FOOTPRINTS_FILE), exist_ok=True)
+        tmp_path = f"{FOOTPRINTS_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(footprints, f, indent=2)
+        os.replace(tmp_path, FOOTPRINTS_FILE)
+    except OSError as e:
+        logger.warning(f"Empreintes memoire non enregistrees: {e}")
+
+def auto_workers(profile):
+    """
+    Nombre de processus du pool : borné par la mémoire disponible (empreinte d'un worker du profil),
+    par les cœurs (THREADS_PER_WORKER par processus) et par BATCH_MAX_WORKERS. Indépendant de la taille
+    du lot : le pool est gardé pour les lots suivants. Retourne (nombre, explication).
+    """
+    from scripts.model_loader import PROFILES
+
+    footprints = load_footprints()
+    per_worker = footprints["base"] + sum(footprints[name] for name in PROFILES[profile])
+    by_cores = max(1, (os.cpu_count() or 1) // THREADS_PER_WORKER)
+    available = available_memory_mb()
+    if available is not None:
+        by_memory = max(1, int((available - MEMORY_RESERVE_MB) // per_worker))
+    else:
+        # Mémoire inconnue : prudence
+        by_memory = 2
+    count = max(1, min(by_cores, by_memory, MAX_WORKERS))
+    memory_text = f"{available:.0f} Mo disponibles" if available is not None else "memoire inconnue"
+    details = (f"{count} processus ({per_worker:.0f} Mo par worker {profile}, {memory_text}, "
+               f"{os.cpu_count()} coeurs)")
+    return count, details
+
+# === CÔTÉ WORKER ===
+
+# Informations du processus courant (profil, temps de démarrage, empreintes mesurées)
+_worker = {}
+
+def _warm_up(name, resource):
+    """Première inférence sur une page blanche : allocations et noyaux prêts avant la première vraie page"""
+    import numpy as np
+
+    if name == "detectron2":
+        resource(np.full((1200, 800, 3), 255, dtype=np.uint8))
+    elif name == "easyocr":
+        resource.readtext(np.full((64, 256, 3), 255, dtype=np.uint8))
+
+def init_worker(profile, threads=THREADS_PER_WORKER, warm_up=True):
+    """
+    Initialisation de chaque processus du pool : modèles du profil chargés et chauffés une fois,
+    empreinte mémoire de chacun mesurée. Une erreur de chargement est journalisée sans casser le
+    pool ; la page concernée échouera comme avant.
+    """
+    started = time.perf_counter()
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    from scripts import model_loader
+    model_loader.set_profile(profile)
+    model_loader.use_prepared_weights()
+    # Pipeline importé avant la première page (compté dans l'empreinte de base)
+    import scripts.main_pipeline
+
+    footprints = {}
+    before = private_memory_mb()
+    if before is not None:
+        footprints["base"] = before
+    for name in model_loader.PROFILES[profile]:
+        resource = model_loader.RESOURCES[name]
+        try:
+            resource.get()
+            if warm_up:
+                _warm_up(name, resource)
+        except Exception as e:
+            logger.error(f"Chargement de {name} impossible dans le processus {os.getpid()}: {e}")
+            continue
+        after = private_memory_mb()
+        if before is not None and after is not None:
+            footprints[name] = max(0.0, after - before)
+        before = after
+
+    # Threads de calcul par processus : les workers ne se disputent pas les cœurs
+    try:
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(threads)
+        import cv2
+        cv2.setNumThreads(threads)
+    except Exception as e:
+        logger.warning(f"Nombre de threads non applique: {e}")
+    _worker.update(profile=profile, startup_seconds=time.perf_counter() - started, footprints=footprints)
+    logger.info(f"Processus {os.getpid()} pret en {_worker['startup_seconds']:.1f}s (profil {profile})")
+
+def run_task(func, *args):
+    """Exécute une tâche dans le worker ; retourne (résultat, infos du worker et durée de la tâche)"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, dict(_worker, pid=os.getpid(), seconds=time.perf_counter() - started)
+
+# === CÔTÉ INTERFACE ===
+
+class WorkerPool:
+    """Pool de processus persistants d'un profil, avec le débit de chaque processus"""
+
+    def __init__(self, profile, num_workers):
+        self.profile = profile
+        self.num_workers = num_workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers, initializer=init_worker, initargs=(profile, THREADS_PER_WORKER))
+        self.workers = {}
+        self._lock = threading.Lock()
+        logger.info(f"Pool de {num_workers} processus cree (profil {profile})")
+
+    def matches(self, profile, num_workers):
+        """Pool réutilisable pour un lot : même profil et au moins `num_workers` processus"""
+        return self.profile == profile and self.num_workers >= num_workers
+
+    def submit(self, func, *args):
+        """Soumet func(*args) ; le résultat du future est (résultat, infos du worker)"""
+        return self.executor.submit(run_task, func, *args)
+
+    def reset_stats(self):
+        with self._lock:
+            self.workers = {}
+
+    def record(self, info, success=True):
+        """Comptabilise une tâche terminée dans les statistiques de son processus"""
+        with self._lock:
+            stats = self.workers.setdefault(info["pid"], {
+                "pid": info["pid"], "images": 0, "failed": 0, "busy_seconds": 0.0,
+                "startup_seconds": info.get("startup_seconds"), "footprints": info.get("footprints", {}),
+            })
+            stats["images"] += 1
+            stats["failed"] += 0 if success else 1
+            stats["busy_seconds"] += info["seconds"]
+
+    def worker_stats(self):
+        """Statistiques par processus, avec le débit en pages par minute"""
+        with self._lock:
+            workers = [dict(stats) for stats in self.workers.values()]
+        for stats in workers:
+            busy = stats["busy_seconds"]
+            stats["pages_per_minute"] = stats["images"] / busy * 60 if busy > 0 else 0.0
+        return sorted(workers, key=lambda stats: stats["pid"])
+
+    def save_footprints(self):
+        """Conserve les empreintes mesurées (la plus forte par modèle) pour dimensionner les prochains pools"""
+        measured = {}
+        for stats in self.worker_stats():
+            for name, value in stats["footprints"].items():
+                measured[name] = max(value, measured.get(name, 0.0))
+        save_footprints(measured)
+
+    def shutdown(self, cancel=False):
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
+        logger.info("Pool de processus arrete")
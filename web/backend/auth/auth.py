@@ -5,11 +5,12 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
 
-from database.database import get_db
-from crud import crud
+from database.database import get_async_db
+from crud import crud, async_crud
 from schemas import schemas
 
 load_dotenv()
@@ -57,7 +58,7 @@ def verify_token(token: str):
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,7 +76,7 @@ async def get_current_user(
         print("❌ Token invalide ou expiré")
         raise credentials_exception
     
-    user = crud.get_user_by_email(db, email=email)
+    user = await async_crud.get_user_by_email(db, email=email)
     print(f"👤 Utilisateur trouvé: {user.email if user else 'Aucun'}")
     
     if user is None:
@@ -0,0 +1,147 @@
+"""
+Benchmark des requêtes exécutées à chaque appel d'API (quotas, statistiques, sessions).
+
+Peuple une base (SQLite temporaire par défaut, ou BENCHMARK_DATABASE_URL, par exemple un
+PostgreSQL local jetable) puis mesure chaque requête avec et sans les index de la
+migration d01bc5c46f79, et affiche le plan d'exécution de chacune :
+
+    python -m benchmarks.db_lookups [--users N] [--sessions-per-user N] [--iterations N]
+
+ATTENTION : les tables sont supprimées puis recréées dans la base cible.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, text
+
+from database.database import Base, to_sync_url
+from models import models
+
+# Index ajoutés par la migration d01bc5c46f79 (supprimés pour la mesure « sans index »)
+HOT_PATH_INDEXES = [
+    ("usage_stats", "uq_usage_stats_user_id"),
+    ("user_quotas", "uq_user_quotas_user_type"),
+    ("user_sessions", "idx_user_sessions_active_user"),
+    ("password_resets", "idx_password_resets_unused_user"),
+]
+
+def _lookups(user_id: int):
+    """Requêtes du chemin chaud, telles qu'émises par crud/async_crud.py"""
+    return {
+        "quota (user_id, quota_type)": select(models.UserQuota).where(
+            models.UserQuota.user_id == user_id, models.UserQuota.quota_type == "daily"
+        ),
+        "usage_stats (user_id)": select(models.UsageStats).where(models.UsageStats.user_id == user_id),
+        "sessions actives (user_id)": select(models.UserSession.id).where(
+            models.UserSession.user_id == user_id, models.UserSession.is_active == True
+        ),
+        "reset non utilisé (user_id)": select(models.PasswordReset.id).where(
+            models.PasswordReset.user_id == user_id, models.PasswordReset.is_used == False
+        ),
+    }
+
+def seed(engine, users: int, sessions_per_user: int):
+    """Recrée le schéma et insère des données réalistes (une seule session active par utilisateur)"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"email": f"user{i}@bench.local", "username": f"user{i}", "hashed_password": "x", "is_active": True}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(models.UsageStats), [
+            {"user_id": i, "images_processed": i % 50, "total_processing_time": 1.5, "retreatment_count": 0}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(models.UserQuota), [
+            {"user_id": i, "quota_type": quota_type, "limit_value": limit, "used_value": 0,
+             "reset_date": now + timedelta(days=1)}
+            for i in range(1, users + 1) for quota_type, limit in (("daily", 15), ("monthly", 200))
+        ])
+        conn.execute(insert(models.UserSession), [
+            {"user_id": i, "session_token": f"s-{i}-{j}", "is_active": j == 0,
+             "expires_at": now + timedelta(days=1 if j == 0 else -j)}
+            for i in range(1, users + 1) for j in range(sessions_per_user)
+        ])
+        conn.execute(insert(models.PasswordReset), [
+            {"user_id": i, "token": f"r-{i}", "is_used": True, "expires_at": now - timedelta(hours=1)}
+            for i in range(1, users + 1)
+        ])
+
+def explain(conn, stmt):
+    compiled = stmt.compile(conn, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.execute(text(prefix + str(compiled))).all()
+    return [str(row[-1]) for row in rows]
+
+def measure(engine, users: int, iterations: int):
+    """Temps médian (µs) de chaque requête sur des utilisateurs tirés au hasard"""
+    rng = random.Random(42)
+    timings = {name: [] for name in _lookups(1)}
+    plans = {}
+    with engine.connect() as conn:
+        for name, stmt in _lookups(1).items():
+            plans[name] = explain(conn, stmt)
+        for _ in range(iterations):
+            for name, stmt in _lookups(rng.randint(1, users)).items():
+                start = time.perf_counter()
+                conn.execute(stmt).all()
+                timings[name].append((time.perf_counter() - start) * 1e6)
+    return {name: statistics.median(values) for name, values in timings.items()}, plans
+
+def drop_hot_path_indexes(engine):
+    with engine.begin() as conn:
+        for table, index in HOT_PATH_INDEXES:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+            else:
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index}"'))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("ANALYZE"))
+    # Nouvelles connexions : SQLite garde sinon en cache les plans préparés avec les anciens index
+    engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des requêtes de quotas, statistiques et sessions")
+    parser.add_argument("--users", type=int, default=20000, help="Nombre d'utilisateurs à créer")
+    parser.add_argument("--sessions-per-user", type=int, default=10, help="Sessions par utilisateur (une seule active)")
+    parser.add_argument("--iterations", type=int, default=500, help="Requêtes mesurées par lookup")
+    parser.add_argument("--show-plans", action="store_true", help="Afficher les plans d'exécution")
+    args = parser.parse_args()
+
+    url = os.getenv("BENCHMARK_DATABASE_URL")
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(to_sync_url(url))
+
+    print(f"📦 Peuplement de {engine.url.render_as_string(hide_password=True)} ({args.users} utilisateurs)...")
+    seed(engine, args.users, args.sessions_per_user)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+    with_indexes, plans_with = measure(engine, args.users, args.iterations)
+    drop_hot_path_indexes(engine)
+    without_indexes, plans_without = measure(engine, args.users, args.iterations)
+
+    print(f"\n{'Requête':<32}{'sans index (µs)':>18}{'avec index (µs)':>18}{'gain':>8}")
+    for name in with_indexes:
+        before, after = without_indexes[name], with_indexes[name]
+        print(f"{name:<32}{before:>18.1f}{after:>18.1f}{before / after:>7.1f}x")
+
+    if args.show_plans:
+        for name in with_indexes:
+            print(f"\n🔎 {name}")
+            print("  sans index : " + " | ".join(plans_without[name]))
+            print("  avec index : " + " | ".join(plans_with[name]))
+
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Substituts déterministes du détecteur (Detectron2), de l'OCR (EasyOCR) et du traducteur (OpenAI).
+
+`install()` les enregistre à la place des bibliothèques, avant le premier usage des modèles : le code du
+pipeline (nettoyage, boucle d'OCR, traduction, réinsertion) s'exécute tel quel, hors ligne et sur CPU,
+sans poids de modèle ni clé d'API. Chaque substitut peut simuler une latence (inférence, appel réseau).
+
+- Détecteur : segmente les pages synthétiques (benchmarks/synthetic.py) d'après leur contenu. Les
+  zones blanc pur fermées sont des bulles (cartouches si rectangulaires) ; l'encre hors bulles forme les SFX.
+- OCR : texte déterministe, d'autant plus long que la zone contient d'encre.
+- Traducteur : transformation déterministe du texte (un peu plus long, comme du français).
+"""
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import types
+import zlib
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import WORDS
+from processing import model_loader
+
+class FakeTensor:
+    """Tableau numpy avec l'interface utilisée sur les tenseurs de Detectron2 (.to(), .numpy())"""
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def to(self, device):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def __len__(self):
+        return len(self.array)
+
+class FakeInstances:
+    def __init__(self, masks, classes, scores):
+        self.pred_masks = FakeTensor(masks)
+        self.pred_classes = FakeTensor(classes)
+        self.scores = FakeTensor(scores)
+
+    def __len__(self):
+        return len(self.pred_masks)
+
+class FakeDetector:
+    """Remplace DefaultPredictor : segmentation des pages synthétiques d'après leurs couleurs"""
+
+    def __init__(self, latency: float = 0.0, min_area_ratio: float = 0.0015):
+        self.latency = latency
+        self.min_area_ratio = min_area_ratio
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        height, width = image.shape[:2]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        min_area = self.min_area_ratio * height * width
+        masks, classes = [], []
+
+        # Bulles et cartouches : zones blanc pur (le texte qu'elles contiennent est inclus)
+        white = (gray >= 250).astype(np.uint8)
+        contours, _ = cv2.findContours(white, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        covered = np.zeros((height, width), np.uint8)
+        for contour in sorted(contours, key=lambda c: tuple(cv2.boundingRect(c)[:2][::-1])):
+            area = cv2.contourArea(contour)
+            if area < min_area:
+                continue
+            mask = np.zeros((height, width), np.uint8)
+            cv2.drawContours(mask, [contour], -1, 1, -1)
+            _, _, box_w, box_h = cv2.boundingRect(contour)
+            masks.append(mask.astype(bool))
+            classes.append(2 if area / (box_w * box_h) > 0.9 else 0)
+            covered |= mask
+
+        # SFX : encre hors bulles (et hors de leur contour), lettres regroupées par dilatation
+        margin = max(5, width // 100)
+        covered = cv2.dilate(covered, np.ones((2 * margin + 1, 2 * margin + 1), np.uint8))
+        ink = ((gray < 60) & (covered == 0)).astype(np.uint8)
+        ink = cv2.dilate(ink, np.ones((margin, 3 * margin), np.uint8))
+        contours, _ = cv2.findContours(ink, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in sorted(contours, key=lambda c: tuple(cv2.boundingRect(c)[:2][::-1])):
+            if cv2.contourArea(contour) < min_area:
+                continue
+            mask = np.zeros((height, width), np.uint8)
+            cv2.drawContours(mask, [contour], -1, 1, -1)
+            masks.append(mask.astype(bool))
+            classes.append(1)
+
+        masks = np.array(masks, dtype=bool).reshape(len(masks), height, width)
+        return {"instances": FakeInstances(masks, np.array(classes, dtype=np.int64), np.full(len(classes), 0.9, np.float32))}
+
+class FakeReader:
+    """Remplace easyocr.Reader : un texte déterministe par zone"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def readtext(self, image, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        height, width = image.shape[:2]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        ink = int(np.count_nonzero(gray < 100))
+        count = min(12, max(1, ink // 250))
+        seed = zlib.crc32(f"{width}x{height}:{ink}".encode())
+        words = [WORDS[(seed >> (i % 24) ^ i * 7919) % len(WORDS)] for i in range(count)]
+        return [([[0, 0], [width, 0], [width, height], [0, height]], " ".join(words).upper(), 0.95)]
+
+def fake_translation(text: str) -> str:
+    """Traduction factice : mots réécrits et un peu allongés"""
+    return " ".join(word.lower() + ("ment" if len(word) > 4 else "") for word in text.split())
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Message(content)
+
+class _Completion:
+    def __init__(self, content):
+        self.choices = [_Choice(content)]
+
+class _RawResponse:
+    retries_taken = 0
+
+    def __init__(self, completion):
+        self._completion = completion
+
+    def parse(self):
+        return self._completion
+
+class _Completions:
+    def __init__(self, translator):
+        self._translator = translator
+        self.with_raw_response = types.SimpleNamespace(create=lambda **kwargs: _RawResponse(self.create(**kwargs)))
+
+    def create(self, messages, **kwargs):
+        return _Completion(self._translator.complete(messages[-1]["content"]))
+
+class FakeTranslator:
+    """Remplace le client OpenAI : requêtes unitaires (translate) et groupées (translate_batch)"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prefix = "Traduis ce texte en français : "
+        if prompt.startswith(prefix):
+            return fake_translation(prompt[len(prefix):])
+        return json.dumps([fake_translation(text) for text in json.loads(prompt)], ensure_ascii=False)
+
+    def client(self, **kwargs):
+        return types.SimpleNamespace(chat=types.SimpleNamespace(completions=_Completions(self)))
+
+class _Config(types.SimpleNamespace):
+    """Configuration Detectron2 minimale : les attributs imbriqués sont créés à la demande"""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = _Config()
+        setattr(self, name, value)
+        return value
+
+    def merge_from_file(self, path):
+        pass
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def install(detect_latency: float = 0.0, ocr_latency: float = 0.0, translate_latency: float = 0.0):
+    """
+    Enregistre les substituts (latences en secondes) et retourne (détecteur, lecteur OCR, traducteur)
+    pour consulter leurs compteurs d'appels. À appeler avant le premier usage des modèles.
+    """
+    loaded = [name for name, resource in model_loader.RESOURCES.items() if resource.loaded]
+    if loaded:
+        raise RuntimeError(f"Substituts à installer avant le chargement de: {', '.join(loaded)}")
+
+    detector = FakeDetector(detect_latency)
+    reader = FakeReader(ocr_latency)
+    translator = FakeTranslator(translate_latency)
+
+    detectron2 = _module("detectron2", __version__="substitut")
+    detectron2.config = _module("detectron2.config", get_cfg=_Config)
+    detectron2.engine = _module("detectron2.engine", DefaultPredictor=lambda cfg: detector)
+    detectron2.model_zoo = _module("detectron2.model_zoo", get_config_file=lambda name: name,
+                                   get_checkpoint_url=lambda name: name)
+    _module("easyocr", Reader=lambda languages, **kwargs: reader)
+    _module("openai", OpenAI=translator.client,
+            AuthenticationError=type("AuthenticationError", (Exception,), {}),
+            RateLimitError=type("RateLimitError", (Exception,), {}))
+    if importlib.util.find_spec("torch") is None:
+        # Sans PyTorch (poste sans dépendances ML) : seul ce que le pipeline utilise hors modèle
+        _module("torch", tensor=FakeTensor, cuda=types.SimpleNamespace(is_available=lambda: False))
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    return detector, reader, translator
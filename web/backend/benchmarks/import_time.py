@@ -0,0 +1,100 @@
+"""
+Budget de temps d'import de l'application, modèles non chargés.
+
+Importe `main` dans des processus neufs (comme un worker, une migration ou un outil en ligne de
+commande qui l'importe) et échoue (code de sortie 1) si la durée médiane dépasse le budget ou si
+l'import a chargé un modèle ou une bibliothèque lourde (PyTorch, Detectron2, EasyOCR, OpenAI) :
+
+    python -m benchmarks.import_time [--budget-ms 3000] [--runs 5] [--module main] [--top 10]
+
+Sans DATABASE_URL, une base SQLite temporaire est utilisée (aucune connexion n'est ouverte à l'import).
+`--top` affiche les modules les plus coûteux (python -X importtime) pour trouver la régression.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Bibliothèques qui ne doivent être importées qu'au premier usage des modèles (processing/model_loader.py)
+HEAVY_MODULES = ("torch", "detectron2", "easyocr", "openai")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+from processing import model_loader
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy_modules": [name for name in {heavy!r} if name in sys.modules],
+    "models_loaded": [name for name, loaded in model_loader.get_status().items() if loaded],
+}}))
+"""
+
+def _environment():
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'import_time.db')}")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    return env
+
+def measure(module: str = "main"):
+    """Durée d'import de `module` dans un processus neuf, bibliothèques lourdes et modèles chargés"""
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=_environment(),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(module: str = "main", top: int = 10):
+    """Modules dont l'import (dépendances comprises) est le plus long, d'après python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=BACKEND_DIR,
+                            env=_environment(), capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, own, cumulative, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        rows.append((int(cumulative) / 1000, int(own) / 1000, name))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Budget de temps d'import de l'application (modèles non chargés)")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "3000")),
+                        help="Durée médiane maximale de l'import")
+    parser.add_argument("--runs", type=int, default=5, help="Nombre d'imports mesurés (processus neufs)")
+    parser.add_argument("--module", default="main", help="Module à importer")
+    parser.add_argument("--top", type=int, default=10, help="Modules les plus coûteux à afficher (0 : aucun)")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    median_ms = statistics.median(run["seconds"] for run in runs) * 1000
+    heavy = sorted({name for run in runs for name in run["heavy_modules"]})
+    loaded = sorted({name for run in runs for name in run["models_loaded"]})
+
+    print(f"⏱️  import {args.module}: médiane {median_ms:.0f} ms sur {len(runs)} processus (budget {args.budget_ms:.0f} ms)")
+    if args.top:
+        print(f"\n{'Module':<48}{'cumulé (ms)':>14}{'propre (ms)':>14}")
+        for cumulative, own, name in slowest_imports(args.module, args.top):
+            print(f"{name:<48}{cumulative:>14.1f}{own:>14.1f}")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"import trop long ({median_ms:.0f} ms > {args.budget_ms:.0f} ms)")
+    if heavy:
+        failures.append(f"bibliothèques lourdes importées: {', '.join(heavy)}")
+    if loaded:
+        failures.append(f"modèles chargés à l'import: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Import dans le budget, aucun modèle chargé")
+
+if __name__ == "__main__":
+    main()
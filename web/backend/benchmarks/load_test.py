@@ -0,0 +1,510 @@
+"""
+Test de charge hors ligne du backend : démarre main.py (uvicorn, un processus) sur SQLite ou sur une
+base PostgreSQL locale, avec le détecteur, l'OCR et le traducteur remplacés par les substituts de
+benchmarks/fakes.py (latences réglables), puis envoie un mélange de requêtes /login, /process,
+/get-bubble-polygons, /retreat-with-polygons et /reinsert à débit fixé.
+
+Les arrivées sont planifiées à l'avance (Poisson ou régulières, graine fixe) et la latence est
+mesurée depuis l'instant prévu : un serveur saturé ne ralentit pas le générateur. Chaque palier de
+--rates donne le débit obtenu, les centiles de latence et les erreurs par route, les étapes côté
+serveur (en-têtes Server-Timing) et l'écart des compteurs de /metrics ; le dernier palier non saturé
+donne la capacité estimée de l'instance.
+
+    python -m benchmarks.load_test --rates 1,2,4,8 --duration 60 --output load.json
+    python -m benchmarks.load_test --database-url postgresql://localhost/bench --server-env PIPELINE_MAX_CONCURRENCY=2
+    python -m benchmarks.load_test --mix process=1 --detect-latency 0.8 --translate-latency 0.3
+    python -m benchmarks.load_test --url http://localhost:8000 --metrics-token ...   # instance déjà lancée
+
+À lancer depuis web/backend. Les utilisateurs loadtest-N@example.com sont créés (ou réutilisés) et
+leurs quotas levés directement en base : seules les limites de débit (RATE_LIMIT_*) s'appliquent.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import random
+import re
+import secrets
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import cv2
+import httpx
+
+from benchmarks import fakes
+from benchmarks.pipeline import environment, git_commit
+from benchmarks.synthetic import PROFILES, generate_pages
+
+ROUTES = {
+    "login": "/login",
+    "process": "/process",
+    "polygons": "/get-bubble-polygons",
+    "retreat": "/retreat-with-polygons",
+    "reinsert": "/reinsert",
+}
+DEFAULT_MIX = "process=6,polygons=2,retreat=1,reinsert=1,login=1"
+USER_PASSWORD = "load-test-password"
+UNLIMITED_QUOTA = 10 ** 9
+
+SERVER_TIMING_ENTRY = re.compile(r"([\w.-]+);dur=([\d.]+)")
+METRIC_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$")
+METRIC_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+HISTOGRAMS = ("bubble_stage_duration_seconds", "bubble_http_request_duration_seconds", "bubble_db_query_duration_seconds")
+
+@dataclass
+class Sample:
+    endpoint: str
+    latency_ms: float
+    status: int = None
+    error: str = None
+    stages: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+@dataclass
+class Fixtures:
+    pages: list  # PNG des pages synthétiques
+    polygons: list  # JSON des polygones de chaque page (/retreat-with-polygons)
+    reinsert: list  # (image nettoyée PNG, JSON des bulles traduites) par page (/reinsert)
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+
+def parse_mix(text: str):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"Type de requête inconnu: {name} ({', '.join(ROUTES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+def unique_png(png: bytes, counter: int) -> bytes:
+    """Même image, octets différents (chunk tEXt après IHDR) : ni déduplication ni limite de retraitement"""
+    data = b"tEXt" + b"load-test\x00" + str(counter).encode()
+    chunk = struct.pack(">I", len(data) - 4) + data + struct.pack(">I", zlib.crc32(data))
+    return png[:33] + chunk + png[33:]
+
+def parse_server_timing(header: str):
+    return {name: float(duration) for name, duration in SERVER_TIMING_ENTRY.findall(header or "") if name != "total"}
+
+def parse_metrics(text: str):
+    """{(nom, labels triés): valeur} depuis le format texte Prometheus"""
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_SAMPLE.match(line)
+        if not match or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        try:
+            values[(name, tuple(sorted(METRIC_LABEL.findall(labels or ""))))] = float(value)
+        except ValueError:
+            continue
+    return values
+
+def metric_deltas(before, after):
+    """Compteurs (_total) et histogrammes (nombre, moyenne) observés pendant le palier"""
+    counters, histograms = {}, {}
+    for (name, labels), value in after.items():
+        delta = value - before.get((name, labels), 0.0)
+        label_text = ",".join(f"{key}={val}" for key, val in labels)
+        if name.endswith("_total") and delta:
+            counters[f"{name}{{{label_text}}}" if labels else name] = delta
+        for histogram in HISTOGRAMS:
+            if name == f"{histogram}_count" and delta:
+                total = after.get((f"{histogram}_sum", labels), 0.0) - before.get((f"{histogram}_sum", labels), 0.0)
+                histograms.setdefault(histogram, {})[label_text] = {"count": int(delta), "mean_ms": round(total / delta * 1000, 2)}
+    return {"counters": counters, "histograms": histograms}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# === SERVEUR ===
+def serve(port: int, detect_latency: float, ocr_latency: float, translate_latency: float):
+    """Processus serveur : substituts installés avant l'import de main, puis uvicorn"""
+    import uvicorn
+    fakes.install(detect_latency, ocr_latency, translate_latency)
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+def server_environment(args):
+    env = {
+        "DATABASE_URL": args.database_url,
+        "SECRET_KEY": os.getenv("SECRET_KEY") or secrets.token_hex(32),
+        "METRICS_TOKEN": args.metrics_token,
+    }
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+@contextlib.asynccontextmanager
+async def open_client(args, log):
+    """Client HTTP vers l'instance testée (lancée ici sauf avec --url)"""
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.max_in_flight + 4, max_keepalive_connections=args.max_in_flight + 4)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+            yield client
+        return
+
+    if args.in_process:
+        # Même processus (sans uvicorn) : le générateur partage la boucle et le GIL avec le serveur
+        fakes.install(args.detect_latency, args.ocr_latency, args.translate_latency)
+        with contextlib.redirect_stdout(log):
+            import main
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=timeout) as client:
+                yield client
+        return
+
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.load_test", "--serve", "--port", str(port),
+               "--detect-latency", str(args.detect_latency), "--ocr-latency", str(args.ocr_latency),
+               "--translate-latency", str(args.translate_latency)]
+    process = subprocess.Popen(command, env=os.environ, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+            deadline = time.monotonic() + args.startup_timeout
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Le serveur s'est arrêté au démarrage (journal: {log.name})")
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Serveur non prêt après {args.startup_timeout:.0f} s (journal: {log.name})")
+                await asyncio.sleep(0.5)
+            yield client
+    finally:
+        # SIGTERM : uvicorn exécute les handlers d'arrêt (statistiques en attente, baux de quotas)
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# === PRÉPARATION ===
+async def prepare_users(client, count: int):
+    """Inscrit (si besoin) et connecte les utilisateurs du test"""
+    semaphore = asyncio.Semaphore(8)
+
+    async def prepare(i):
+        email = f"loadtest-{i}@example.com"
+        async with semaphore:
+            response = await client.post("/register", json={"email": email, "username": f"loadtest-{i}", "password": USER_PASSWORD})
+            if response.status_code not in (200, 400):
+                raise RuntimeError(f"Inscription de {email} impossible: HTTP {response.status_code} {response.text[:200]}")
+            response = await client.post("/login", json={"email": email, "password": USER_PASSWORD})
+            response.raise_for_status()
+        return {"email": email, "token": response.json()["access_token"]}
+
+    return await asyncio.gather(*(prepare(i) for i in range(count)))
+
+def lift_quotas(emails):
+    """Quotas quotidien et mensuel illimités pour les utilisateurs du test (écriture directe en base)"""
+    from crud.async_crud import compute_reset_date
+    from database.database import SessionLocal
+    from models import models
+
+    with SessionLocal() as db:
+        user_ids = [user_id for (user_id,) in db.query(models.User.id).filter(models.User.email.in_(emails))]
+        db.query(models.UserQuota).filter(models.UserQuota.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.add_all(
+            models.UserQuota(user_id=user_id, quota_type=quota_type, limit_value=UNLIMITED_QUOTA, used_value=0,
+                             reset_date=compute_reset_date(quota_type))
+            for user_id in user_ids for quota_type in ("daily", "monthly")
+        )
+        db.commit()
+
+async def prepare_fixtures(client, user, profile, count: int, seed: int):
+    """Pages synthétiques, puis polygones et bulles traduites obtenus une fois du serveur (hors mesure)"""
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    pages = [cv2.imencode(".png", page.image)[1].tobytes() for page in generate_pages(profile, count, seed)]
+    polygons, reinsert = [], []
+    for i, png in enumerate(pages):
+        response = await client.post(ROUTES["polygons"], headers=headers, files={"file": (f"page-{i}.png", png, "image/png")})
+        response.raise_for_status()
+        polygons.append(json.dumps(response.json()["polygons"]))
+        response = await client.post(ROUTES["process"], headers=headers, files={"file": (f"page-{i}.png", png, "image/png")})
+        response.raise_for_status()
+        result = response.json()
+        reinsert.append((base64.b64decode(result["cleaned_base64"]), json.dumps(result["bubbles"])))
+    return Fixtures(pages, polygons, reinsert)
+
+# === CHARGE ===
+def plan_arrivals(rate: float, duration: float, mix, users: int, pages: int, arrival: str, rng):
+    """Instants d'arrivée et contenu de chaque requête, tirés à l'avance (reproductibles)"""
+    names, weights = list(mix), list(mix.values())
+    plan, at = [], 0.0
+    while at < duration:
+        plan.append((at, rng.choices(names, weights)[0], rng.randrange(users), rng.randrange(pages)))
+        at += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+    return plan
+
+async def send(client, endpoint: str, user, fixtures: Fixtures, page: int, counter):
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    if endpoint == "login":
+        return await client.post(ROUTES["login"], json={"email": user["email"], "password": USER_PASSWORD})
+    png = fixtures.reinsert[page][0] if endpoint == "reinsert" else fixtures.pages[page]
+    if counter is not None:
+        png = unique_png(png, counter)
+    files = {"file": (f"page-{page}.png", png, "image/png")}
+    data = None
+    if endpoint == "retreat":
+        data = {"polygons": fixtures.polygons[page]}
+    elif endpoint == "reinsert":
+        data = {"bubbles": fixtures.reinsert[page][1]}
+    return await client.post(ROUTES[endpoint], headers=headers, files=files, data=data)
+
+async def timed_request(client, scheduled: float, endpoint, user, fixtures, page, counter, samples):
+    sample = Sample(endpoint, 0.0)
+    try:
+        response = await send(client, endpoint, user, fixtures, page, counter)
+        sample.status = response.status_code
+        sample.stages = parse_server_timing(response.headers.get("server-timing"))
+        if response.status_code >= 400:
+            sample.error = f"HTTP {response.status_code}"
+    except httpx.TimeoutException:
+        sample.error = "timeout"
+    except httpx.HTTPError as e:
+        sample.error = type(e).__name__
+    # Depuis l'instant prévu : un retard d'envoi compte dans la latence
+    sample.latency_ms = (time.perf_counter() - scheduled) * 1000
+    samples.append(sample)
+
+async def read_metrics(client, token):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    try:
+        response = await client.get("/metrics", headers=headers)
+    except httpx.HTTPError:
+        return {}
+    return parse_metrics(response.text) if response.status_code == 200 else {}
+
+async def run_step(client, args, rate: float, users, fixtures, rng, counter_start: int):
+    plan = plan_arrivals(rate, args.duration, args.mix, len(users), len(fixtures.pages), args.arrival, rng)
+    samples, in_flight = [], set()
+    dropped = 0
+    queue_depths = []
+    before = await read_metrics(client, args.metrics_token)
+
+    async def watch_queue():
+        while True:
+            await asyncio.sleep(args.metrics_interval)
+            depth = (await read_metrics(client, args.metrics_token)).get(("bubble_pipeline_queue_depth", ()))
+            if depth is not None:
+                queue_depths.append(depth)
+
+    watcher = asyncio.create_task(watch_queue())
+    started = time.perf_counter()
+    for i, (at, endpoint, user, page) in enumerate(plan):
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            dropped += 1
+            continue
+        counter = None if args.repeat_uploads else counter_start + i
+        task = asyncio.create_task(timed_request(client, started + at, endpoint, users[user], fixtures, page, counter, samples))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(set(in_flight))
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    after = await read_metrics(client, args.metrics_token)
+    return summarize_step(rate, samples, dropped, elapsed, args), {
+        **metric_deltas(before, after), "max_queue_depth": max(queue_depths, default=None),
+    }, len(plan)
+
+def summarize_step(rate: float, samples, dropped: int, elapsed: float, args):
+    def latency(values):
+        return {"p50_ms": percentile(values, 0.5), "p90_ms": percentile(values, 0.9),
+                "p99_ms": percentile(values, 0.99), "max_ms": percentile(values, 1.0)}
+
+    endpoints = {}
+    for name in args.mix:
+        own = [s for s in samples if s.endpoint == name]
+        errors = {}
+        for s in own:
+            if not s.ok:
+                errors[s.error] = errors.get(s.error, 0) + 1
+        endpoints[name] = {"requests": len(own), "ok": sum(s.ok for s in own), "errors": errors,
+                           **latency([s.latency_ms for s in own if s.ok])}
+
+    stages = {}
+    for s in samples:
+        if s.ok:
+            for name, duration in s.stages.items():
+                stages.setdefault(name, []).append(duration)
+    ok = [s for s in samples if s.ok]
+    sent = len(samples) + dropped
+    error_rate = (sent - len(ok)) / sent if sent else 0.0
+    overall = latency([s.latency_ms for s in ok])
+    throughput = len(ok) / elapsed if elapsed else 0.0
+    # Saturé : trop d'erreurs, p99 hors objectif, ou file qui grossit (les réponses n'ont pas suivi les arrivées)
+    saturated = (error_rate > args.max_error_rate or (overall["p99_ms"] or 0) > args.slo_p99_ms
+                 or throughput < 0.9 * (1 - error_rate) * sent / args.duration)
+    return {
+        "offered_rps": rate,
+        "sent": sent,
+        "dropped": dropped,
+        "throughput_rps": round(throughput, 3),
+        "error_rate": round(error_rate, 4),
+        "elapsed_s": round(elapsed, 2),
+        "saturated": saturated,
+        "latency": overall,
+        "endpoints": endpoints,
+        "server_stages": {name: {"count": len(values), "p50_ms": percentile(values, 0.5), "p95_ms": percentile(values, 0.95)}
+                          for name, values in stages.items()},
+    }
+
+def print_step(step):
+    status = "❌ saturé" if step["saturated"] else "✅"
+    latency = step["latency"]
+    print(f"\n📈 {step['offered_rps']:g} req/s demandées -> {step['throughput_rps']:.2f} req/s réussies, "
+          f"{step['error_rate']:.1%} d'erreurs, {step['dropped']} abandonnées  {status}")
+    print(f"  latence p50 {latency['p50_ms']} ms, p90 {latency['p90_ms']} ms, p99 {latency['p99_ms']} ms, max {latency['max_ms']} ms")
+    print(f"  {'route':<10}{'requêtes':>10}{'ok':>6}{'p50 (ms)':>11}{'p90 (ms)':>11}{'p99 (ms)':>11}  erreurs")
+    for name, stats in step["endpoints"].items():
+        errors = ", ".join(f"{error}: {count}" for error, count in stats["errors"].items())
+        print(f"  {name:<10}{stats['requests']:>10}{stats['ok']:>6}{stats['p50_ms'] or '-':>11}{stats['p90_ms'] or '-':>11}"
+              f"{stats['p99_ms'] or '-':>11}  {errors}")
+    if step["server_stages"]:
+        print("  étapes serveur (Server-Timing) : " + ", ".join(
+            f"{name} p50 {stats['p50_ms']} / p95 {stats['p95_ms']} ms"
+            for name, stats in sorted(step["server_stages"].items(), key=lambda item: -(item[1]["p95_ms"] or 0))))
+    server = step["server_metrics"]
+    if server.get("max_queue_depth") is not None:
+        print(f"  file du pipeline : {server['max_queue_depth']:g} au maximum")
+    for name, delta in server.get("counters", {}).items():
+        if "rejection" in name or "timeout" in name or "failure" in name:
+            print(f"  {name}: +{delta:g}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne du backend (substituts des modèles)")
+    parser.add_argument("--rates", default="1,2,4", help="Paliers de débit (requêtes/s), séparés par des virgules")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée de chaque palier (s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Poids des types de requêtes (défaut: {DEFAULT_MIX})")
+    parser.add_argument("--arrival", choices=("poisson", "constant"), default="poisson", help="Loi des arrivées")
+    parser.add_argument("--users", type=int, default=50, help="Utilisateurs simulés (le débit par utilisateur est limité)")
+    parser.add_argument("--pages", type=int, default=4, help="Pages synthétiques distinctes")
+    parser.add_argument("--profile", default="typical", choices=list(PROFILES), help="Profil des pages synthétiques")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des pages et du planning des requêtes")
+    parser.add_argument("--repeat-uploads", action="store_true",
+                        help="Envoyer les pages à l'identique (déduplication et limite de retraitement actives)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Requêtes simultanées au-delà desquelles les arrivées sont abandonnées")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Délai maximal d'une requête (s)")
+    parser.add_argument("--slo-p99-ms", type=float, default=10000.0, help="p99 au-delà duquel un palier est saturé")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Taux d'erreurs au-delà duquel un palier est saturé")
+    parser.add_argument("--database-url", default=None, help="Base du serveur (défaut: SQLite temporaire)")
+    parser.add_argument("--server-env", action="append", default=[], metavar="CLE=VALEUR",
+                        help="Variable d'environnement du serveur (ex. PIPELINE_MAX_CONCURRENCY=2), répétable")
+    parser.add_argument("--detect-latency", type=float, default=0.5, help="Latence simulée du détecteur (s)")
+    parser.add_argument("--ocr-latency", type=float, default=0.05, help="Latence simulée par appel d'OCR (s)")
+    parser.add_argument("--translate-latency", type=float, default=0.3, help="Latence simulée par appel de traduction (s)")
+    parser.add_argument("--url", help="Instance déjà lancée (aucun serveur démarré, quotas levés via DATABASE_URL)")
+    parser.add_argument("--metrics-token", default=None, help="METRICS_TOKEN de l'instance (défaut: généré)")
+    parser.add_argument("--metrics-interval", type=float, default=1.0, help="Intervalle de lecture de la file du pipeline (s)")
+    parser.add_argument("--in-process", action="store_true", help="Application dans ce processus (sans uvicorn)")
+    parser.add_argument("--startup-timeout", type=float, default=120.0, help="Attente maximale du démarrage du serveur (s)")
+    parser.add_argument("--server-log", default=None, help="Journal du serveur (défaut: fichier temporaire)")
+    parser.add_argument("--output", help="Fichier JSON des résultats")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.detect_latency, args.ocr_latency, args.translate_latency)
+        return
+
+    try:
+        args.mix = parse_mix(args.mix)
+        rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+    workdir = tempfile.mkdtemp(prefix="bubble-load-")
+    if args.database_url is None:
+        args.database_url = os.getenv("DATABASE_URL") if args.url else f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    if args.metrics_token is None and not args.url:
+        args.metrics_token = secrets.token_hex(16)
+    if not args.url:
+        # Serveur lancé ici : même environnement pour lui et pour la préparation des quotas
+        os.environ.update(server_environment(args))
+    elif args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    log_path = args.server_log or os.path.join(workdir, "server.log")
+    asyncio.run(run(args, rates, log_path))
+
+async def run(args, rates, log_path):
+    results = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_commit": git_commit(),
+        "environment": environment(),
+        "settings": {
+            "mix": args.mix, "arrival": args.arrival, "duration_s": args.duration, "users": args.users,
+            "pages": args.pages, "profile": args.profile, "seed": args.seed, "unique_uploads": not args.repeat_uploads,
+            "database": args.database_url.split("://")[0] if args.database_url else None,
+            "target": args.url or ("in-process" if args.in_process else "uvicorn"),
+            "server_env": args.server_env,
+            "stand_in_latency_s": {"detect": args.detect_latency, "ocr": args.ocr_latency, "translate": args.translate_latency},
+        },
+        "steps": [],
+    }
+    # En processus, les print() du serveur vont dans son journal pendant les paliers
+    quiet = (lambda: contextlib.redirect_stdout(log)) if args.in_process else contextlib.nullcontext
+
+    with open(log_path, "w", encoding="utf-8") as log:
+        print(f"🚀 Démarrage du serveur (journal: {log_path})")
+        async with open_client(args, log) as client:
+            print(f"👥 Préparation de {args.users} utilisateurs et {args.pages} pages...")
+            with quiet():
+                users = await prepare_users(client, args.users)
+                await asyncio.to_thread(lift_quotas, [user["email"] for user in users])
+                fixtures = await prepare_fixtures(client, users[0], PROFILES[args.profile], args.pages, args.seed)
+
+            rng = random.Random(args.seed)
+            counter = int(time.time() * 1000)  # uploads uniques, y compris d'un lancement à l'autre
+            for rate in rates:
+                print(f"⏱️  Palier {rate:g} req/s pendant {args.duration:g} s...")
+                with quiet():
+                    step, server_metrics, planned = await run_step(client, args, rate, users, fixtures, rng, counter)
+                counter += planned
+                step["server_metrics"] = server_metrics
+                results["steps"].append(step)
+                print_step(step)
+
+    capacity = [step["offered_rps"] for step in results["steps"] if not step["saturated"]]
+    results["capacity_rps"] = max(capacity, default=None)
+    if capacity:
+        print(f"\n🏁 Capacité estimée : {results['capacity_rps']:g} req/s (dernier palier non saturé)")
+    else:
+        print("\n🏁 Tous les paliers sont saturés : réduire --rates")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 Résultats écrits dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Benchmark du pipeline d'image sur des pages synthétiques (benchmarks/synthetic.py), hors ligne et sur CPU :
+détecteur, OCR et traducteur sont remplacés par les substituts déterministes de benchmarks/fakes.py,
+le reste du code (décodage, redimensionnement, nettoyage, boucle d'OCR, traduction, wrap_text, rendu,
+encodage) est celui de `processing`.
+
+Chaque étape est mesurée isolément sur des entrées préparées à l'avance, puis le pipeline complet
+(process_image_pipeline_with_bubbles, graphe d'étapes compris). Les résultats sont écrits en JSON ;
+avec --memory, une exécution profilée du pipeline complet ajoute le pic de mémoire Python (tracemalloc)
+et de RSS de chaque étape (processing/memory_profile.py). Avec --baseline, médianes et pics mémoire sont
+comparés à un résultat précédent et le code de sortie vaut 1 si une étape a ralenti ou consomme plus
+de mémoire au-delà du seuil :
+
+    python -m benchmarks.pipeline --memory --output bench.json
+    python -m benchmarks.pipeline --memory --baseline bench.json --threshold 0.15
+
+À lancer depuis web/backend (polices de fonts/ résolues depuis le répertoire courant).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from benchmarks import fakes
+from benchmarks.synthetic import PROFILES, generate_pages
+
+# Étapes qui mesurent surtout un substitut (leur temps réel dépend du modèle ou de l'API)
+STAND_IN_STAGES = ("detect",)
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(ordered), 3),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))], 3),
+        "min_ms": round(ordered[0], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "samples": len(ordered),
+    }
+
+def _timed(func, repeats: int):
+    """Durées (ms) de `repeats` appels, après un appel de chauffe"""
+    func()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def _page_inputs(page):
+    """Entrées de chaque étape, obtenues en exécutant une fois le pipeline étape par étape"""
+    from PIL import ImageFont
+    from processing.clean_bubbles import clean_bubbles, predictor
+    from processing.ingest import decode_image
+    from processing.pipeline import resize_and_pad_cv2
+    from processing.reinsert_translations import draw_translated_text, find_font
+    from processing.translate_bubbles import extract_texts, translate
+
+    png = cv2.imencode(".png", page.image)[1].tobytes()
+    decoded = decode_image(png, target_size=(800, 1200))
+    resized = resize_and_pad_cv2(decoded, target_size=(800, 1200))
+    outputs = predictor(resized)
+    cleaned = clean_bubbles(resized, outputs)
+    bubbles = extract_texts(resized, outputs)
+    translated = [{**bubble, "translated_text": translate(bubble["ocr_text"])} for bubble in bubbles]
+    final = draw_translated_text(cleaned, translated)
+
+    # Police et largeur disponibles calculées comme dans draw_text_on_image
+    font_path = find_font()
+    wrap_inputs = []
+    for bubble in translated:
+        box_width, box_height = bubble["x_max"] - bubble["x_min"], bubble["y_max"] - bubble["y_min"]
+        font_size = max(min(box_width // 10, box_height // 2, 72), 8)
+        font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
+        wrap_inputs.append((bubble["translated_text"], font, box_width - 2 * int(box_width * 0.15)))
+    return {
+        "png": png, "decoded": decoded, "resized": resized, "outputs": outputs, "cleaned": cleaned,
+        "bubbles": bubbles, "translated": translated, "final": final, "wrap_inputs": wrap_inputs,
+    }
+
+def stage_benchmarks(inputs):
+    """{étape: fonction sans argument} pour une page préparée"""
+    from processing.clean_bubbles import clean_bubbles, predictor
+    from processing.ingest import decode_image
+    from processing.pipeline import process_image_pipeline_with_bubbles, resize_and_pad_cv2
+    from processing.reinsert_translations import draw_translated_text, wrap_text
+    from processing.translate_bubbles import extract_texts, translate, translate_batch
+
+    texts = [bubble["ocr_text"] for bubble in inputs["bubbles"]]
+    return {
+        "decode": lambda: decode_image(inputs["png"], target_size=(800, 1200)),
+        "resize": lambda: resize_and_pad_cv2(inputs["decoded"], target_size=(800, 1200)),
+        "detect": lambda: predictor(inputs["resized"]),
+        "clean": lambda: clean_bubbles(inputs["resized"], inputs["outputs"]),
+        "ocr": lambda: extract_texts(inputs["resized"], inputs["outputs"]),
+        "translate": lambda: [translate(text) for text in texts],
+        "translate_batch": lambda: translate_batch(texts),
+        "wrap_text": lambda: [wrap_text(text, font, width) for text, font, width in inputs["wrap_inputs"]],
+        "render": lambda: draw_translated_text(inputs["cleaned"], inputs["translated"]),
+        "encode": lambda: cv2.imencode(".png", inputs["final"]),
+        "end_to_end": lambda: process_image_pipeline_with_bubbles(inputs["png"]),
+    }
+
+def memory_benchmark(inputs):
+    """Pics mémoire (Mo au-dessus du départ) de chaque étape d'une exécution profilée du pipeline complet"""
+    from processing.memory_profile import MB, profile_request
+    from processing.pipeline import process_image_pipeline_with_bubbles
+
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        with profile_request("benchmark", enabled=True, write=False, top=0) as profile:
+            process_image_pipeline_with_bubbles(inputs["png"])
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()  # les mesures de durée suivantes se font sans tracemalloc
+    peaks = {}
+    for stage in profile.stages:
+        current = peaks.setdefault(stage["name"], {"traced_peak_mb": 0.0, "rss_peak_mb": None})
+        current["traced_peak_mb"] = max(current["traced_peak_mb"], stage["traced_peak_delta_mb"])
+        if stage["rss_peak_delta_mb"] is not None:
+            current["rss_peak_mb"] = max(current["rss_peak_mb"] or 0.0, stage["rss_peak_delta_mb"])
+    peaks["end_to_end"] = {
+        "traced_peak_mb": round((profile.traced_peak - profile.traced_start) / MB, 1),
+        "rss_peak_mb": round((profile.rss_peak - profile.rss_start) / MB, 1) if profile.rss_start is not None else None,
+    }
+    return peaks
+
+def run_profile(profile, pages: int, repeats: int, seed: int, save_pages=None, memory: bool = False):
+    samples = {}
+    peaks = {}
+    bubble_counts = []
+    for page in generate_pages(profile, pages, seed):
+        if save_pages:
+            cv2.imwrite(os.path.join(save_pages, f"{page.name}.png"), page.image)
+        inputs = _page_inputs(page)
+        bubble_counts.append(len(inputs["bubbles"]))
+        for stage, func in stage_benchmarks(inputs).items():
+            samples.setdefault(stage, []).extend(_timed(func, repeats))
+        if memory:
+            # Pire page du profil, par étape
+            for stage, values in memory_benchmark(inputs).items():
+                current = peaks.setdefault(stage, values)
+                for key, value in values.items():
+                    if value is not None and value > (current[key] or 0.0):
+                        current[key] = value
+    result = {
+        "page_size": list(profile.size),
+        "regions_per_page": profile.bubbles + profile.narration_boxes + profile.sfx,
+        "ocr_bubbles_per_page": round(statistics.fmean(bubble_counts), 2),
+        "stages": {stage: _summary(values) for stage, values in samples.items()},
+    }
+    if memory:
+        result["memory"] = peaks
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    from PIL import __version__ as pillow_version
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "pillow": pillow_version,
+    }
+
+def compare(baseline, results, threshold: float, min_delta_ms: float, min_delta_mb: float = 1.0):
+    """
+    Étapes dont la médiane (ms) ou le pic de mémoire Python (Mo) dépasse celui de la référence de plus
+    de `threshold`, et d'au moins min_delta_ms / min_delta_mb
+    """
+    regressions = []
+    for profile, current in results["profiles"].items():
+        reference = baseline.get("profiles", {}).get(profile)
+        if reference is None:
+            continue
+        checks = [("latency", "median_ms", min_delta_ms, current["stages"], reference["stages"])]
+        if "memory" in current and "memory" in reference:
+            checks.append(("memory", "traced_peak_mb", min_delta_mb, current["memory"], reference["memory"]))
+        for metric, key, min_delta, stages, reference_stages in checks:
+            for stage, stats in stages.items():
+                before = reference_stages.get(stage)
+                if before is None:
+                    continue
+                delta = stats[key] - before[key]
+                if delta > min_delta and stats[key] > before[key] * (1 + threshold):
+                    regressions.append({
+                        "profile": profile, "stage": stage, "metric": metric, "baseline": before[key],
+                        "current": stats[key], "change": round(delta / before[key], 3) if before[key] else None,
+                    })
+    return regressions
+
+def print_report(results, baseline=None):
+    for profile, current in results["profiles"].items():
+        reference = (baseline or {}).get("profiles", {}).get(profile, {}).get("stages", {})
+        print(f"\n📄 {profile} ({current['page_size'][0]}x{current['page_size'][1]}, "
+              f"{current['ocr_bubbles_per_page']} bulles lues par page)")
+        header = f"  {'étape':<18}{'médiane (ms)':>14}{'p90 (ms)':>12}"
+        print(header + (f"{'référence':>12}{'écart':>9}" if reference else ""))
+        for stage, stats in current["stages"].items():
+            line = f"  {stage + (' *' if stage in STAND_IN_STAGES else ''):<18}{stats['median_ms']:>14.2f}{stats['p90_ms']:>12.2f}"
+            if stage in reference:
+                before = reference[stage]["median_ms"]
+                line += f"{before:>12.2f}{(stats['median_ms'] - before) / before * 100 if before else 0:>8.1f}%"
+            print(line)
+        if "memory" in current:
+            reference_memory = (baseline or {}).get("profiles", {}).get(profile, {}).get("memory", {})
+            print(f"  {'pic mémoire':<18}{'Python (Mo)':>14}{'RSS (Mo)':>12}" + (f"{'référence':>12}" if reference_memory else ""))
+            for stage, peaks in current["memory"].items():
+                line = f"  {stage:<18}{peaks['traced_peak_mb']:>14.1f}{peaks['rss_peak_mb'] if peaks['rss_peak_mb'] is not None else '-':>12}"
+                if stage in reference_memory:
+                    line += f"{reference_memory[stage]['traced_peak_mb']:>12.1f}"
+                print(line)
+    print("\n  * substitut (la durée réelle dépend du modèle)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des étapes du pipeline sur des pages synthétiques")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"Profils de pages ({', '.join(PROFILES)})")
+    parser.add_argument("--pages", type=int, default=3, help="Pages générées par profil")
+    parser.add_argument("--repeats", type=int, default=5, help="Mesures par étape et par page")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des pages synthétiques")
+    parser.add_argument("--output", help="Fichier JSON des résultats")
+    parser.add_argument("--baseline", help="Résultats JSON de référence à comparer")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Ralentissement toléré (0.15 = +15 %%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Écart absolu ignoré (bruit de mesure)")
+    parser.add_argument("--memory", action="store_true", help="Mesurer aussi le pic mémoire de chaque étape")
+    parser.add_argument("--min-delta-mb", type=float, default=1.0, help="Écart de pic mémoire ignoré (Mo)")
+    parser.add_argument("--detect-latency", type=float, default=0.0, help="Latence simulée du détecteur (s)")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="Latence simulée par appel d'OCR (s)")
+    parser.add_argument("--translate-latency", type=float, default=0.0, help="Latence simulée par appel de traduction (s)")
+    parser.add_argument("--save-pages", help="Répertoire où écrire les pages générées (PNG)")
+    args = parser.parse_args()
+
+    profiles = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    unknown = [name for name in profiles if name not in PROFILES]
+    if unknown:
+        parser.error(f"Profils inconnus: {', '.join(unknown)}")
+    if args.save_pages:
+        os.makedirs(args.save_pages, exist_ok=True)
+
+    fakes.install(args.detect_latency, args.ocr_latency, args.translate_latency)
+    # Les modules de traitement journalisent chaque bulle : seules les alertes sont gardées
+    logging.basicConfig(level=logging.WARNING)
+    from processing.reinsert_translations import find_font
+    if find_font() is None:
+        print("⚠️  Police introuvable (lancer depuis web/backend) : rendu mesuré avec la police par défaut")
+
+    results = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_commit": git_commit(),
+        "environment": environment(),
+        "settings": {
+            "pages": args.pages, "repeats": args.repeats, "seed": args.seed, "memory": args.memory,
+            "stand_in_latency_s": {"detect": args.detect_latency, "ocr": args.ocr_latency, "translate": args.translate_latency},
+        },
+        "profiles": {},
+    }
+    for name in profiles:
+        print(f"⏱️  Profil {name}...")
+        results["profiles"][name] = run_profile(PROFILES[name], args.pages, args.repeats, args.seed, args.save_pages, args.memory)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("platform") != results["environment"]["platform"]:
+            print("⚠️  Référence mesurée sur une autre machine : comparaison indicative")
+        if baseline.get("settings") != results["settings"]:
+            print("⚠️  Paramètres différents de la référence (pages, répétitions, graine ou latences)")
+        results["regressions"] = compare(baseline, results, args.threshold, args.min_delta_ms, args.min_delta_mb)
+
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Résultats écrits dans {args.output}")
+
+    if baseline is not None:
+        if results["regressions"]:
+            print(f"\n❌ {len(results['regressions'])} régression(s) au-delà de {args.threshold:.0%} :")
+            for regression in results["regressions"]:
+                unit = "ms" if regression["metric"] == "latency" else "Mo"
+                change = f" (+{regression['change']:.0%})" if regression["change"] is not None else ""
+                print(f"  {regression['profile']}/{regression['stage']}: {regression['baseline']:.2f} {unit} -> "
+                      f"{regression['current']:.2f} {unit}{change}")
+            sys.exit(1)
+        print(f"\n✅ Aucune régression au-delà de {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Pages de manga synthétiques et déterministes pour les benchmarks du pipeline.
+
+Fond en trame (screentone), bulles elliptiques blanches cerclées de noir avec du texte, cartouches
+de narration rectangulaires et onomatopées (SFX) hors bulles. Une même graine donne toujours la même
+page ; les profils font varier le nombre et la taille des bulles ainsi que la résolution.
+"""
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+WORDS = (
+    "what are you doing here we have to go now before they find us i told you this would happen "
+    "never again listen to me the door is locked someone took the key wait for me i can not see anything"
+).split()
+SFX_WORDS = ("BAM", "DOKI", "WHOOSH", "KRAK", "GOGOGO", "ZAP", "THUD")
+
+BACKGROUND = 232  # jamais blanc pur : seules les bulles et cartouches atteignent 255
+TONE_DOT = 175
+PANEL_BORDER = 110  # bordures de cases plus claires que l'encre (ignorées comme SFX)
+
+@dataclass
+class PageProfile:
+    name: str
+    bubbles: int
+    narration_boxes: int
+    sfx: int
+    size: tuple = (800, 1200)  # (largeur, hauteur), ratio de la cible du pipeline
+    bubble_scale: float = 1.0
+
+# Profils mesurés par défaut : peu, typique et beaucoup de bulles, puis une page haute résolution
+PROFILES = {
+    "sparse": PageProfile("sparse", bubbles=3, narration_boxes=0, sfx=1),
+    "typical": PageProfile("typical", bubbles=8, narration_boxes=1, sfx=2),
+    "dense": PageProfile("dense", bubbles=18, narration_boxes=2, sfx=3, bubble_scale=0.7),
+    "large": PageProfile("large", bubbles=8, narration_boxes=1, sfx=2, size=(2400, 3600)),
+}
+
+@dataclass
+class SyntheticPage:
+    name: str
+    image: np.ndarray  # BGR uint8
+    regions: list = field(default_factory=list)  # {"class", "bbox": (x_min, y_min, x_max, y_max), "text"}
+
+def _screentone(height: int, width: int, scale: float):
+    """Trame de points régulière sur fond gris clair"""
+    step = max(4, int(round(6 * scale)))
+    tile = np.full((step, step), BACKGROUND, np.uint8)
+    cv2.circle(tile, (step // 2, step // 2), max(1, step // 4), TONE_DOT, -1)
+    tone = np.tile(tile, (height // step + 1, width // step + 1))[:height, :width]
+    return cv2.cvtColor(tone, cv2.COLOR_GRAY2BGR)
+
+def _panels(image, rng, scale: float):
+    height, width = image.shape[:2]
+    rows = int(rng.integers(2, 4))
+    for i in range(1, rows):
+        y = int(height * i / rows)
+        cv2.line(image, (0, y), (width, y), (PANEL_BORDER,) * 3, max(2, int(4 * scale)))
+    x = int(width * rng.uniform(0.35, 0.65))
+    cv2.line(image, (x, 0), (x, height), (PANEL_BORDER,) * 3, max(2, int(4 * scale)))
+
+def _text_lines(rng, count: int):
+    words = [WORDS[int(i)] for i in rng.integers(0, len(WORDS), count)]
+    lines, line = [], []
+    for word in words:
+        line.append(word)
+        if len(line) == 3:
+            lines.append(" ".join(line))
+            line = []
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+def _draw_lines(image, lines, box, scale: float):
+    """Texte centré dans box (x_min, y_min, x_max, y_max), police réduite jusqu'à ce qu'il tienne"""
+    x_min, y_min, x_max, y_max = box
+    font_scale = 0.5 * scale
+    while font_scale > 0.2 * scale:
+        sizes = [cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)[0] for line in lines]
+        line_height = max(h for _, h in sizes) * 1.6
+        if max(w for w, _ in sizes) <= x_max - x_min and line_height * len(lines) <= y_max - y_min:
+            break
+        font_scale *= 0.85
+    thickness = max(1, int(round(scale)))
+    y = (y_min + y_max) / 2 - line_height * len(lines) / 2 + line_height * 0.8
+    for line, (w, _) in zip(lines, sizes):
+        x = int((x_min + x_max - w) / 2)
+        cv2.putText(image, line.upper(), (x, int(y)), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+        y += line_height
+
+def _place(rng, occupied, width, height, box_w, box_h, margin):
+    """Position libre pour un rectangle box_w x box_h (tirages successifs), None si la page est pleine"""
+    for _ in range(200):
+        x = int(rng.integers(margin, max(margin + 1, width - box_w - margin)))
+        y = int(rng.integers(margin, max(margin + 1, height - box_h - margin)))
+        box = (x - margin, y - margin, x + box_w + margin, y + box_h + margin)
+        if all(box[2] < o[0] or o[2] < box[0] or box[3] < o[1] or o[3] < box[1] for o in occupied):
+            occupied.append(box)
+            return x, y
+    return None
+
+def generate_page(profile: PageProfile, seed: int = 0) -> SyntheticPage:
+    width, height = profile.size
+    scale = width / 800
+    rng = np.random.default_rng(seed)
+    image = _screentone(height, width, scale)
+    _panels(image, rng, scale)
+    occupied = []
+    regions = []
+    margin = int(12 * scale)
+
+    for _ in range(profile.bubbles):
+        axis_x = int(rng.integers(60, 110) * scale * profile.bubble_scale)
+        axis_y = int(rng.integers(40, 75) * scale * profile.bubble_scale)
+        position = _place(rng, occupied, width, height, 2 * axis_x, 2 * axis_y, margin)
+        if position is None:
+            break
+        center = (position[0] + axis_x, position[1] + axis_y)
+        cv2.ellipse(image, center, (axis_x, axis_y), 0, 0, 360, (255, 255, 255), -1)
+        cv2.ellipse(image, center, (axis_x, axis_y), 0, 0, 360, (0, 0, 0), max(2, int(3 * scale)))
+        lines = _text_lines(rng, int(rng.integers(3, 10)))
+        inner = (int(center[0] - axis_x * 0.68), int(center[1] - axis_y * 0.62),
+                 int(center[0] + axis_x * 0.68), int(center[1] + axis_y * 0.62))
+        _draw_lines(image, lines, inner, scale)
+        regions.append({"class": 0, "bbox": (center[0] - axis_x, center[1] - axis_y, center[0] + axis_x, center[1] + axis_y),
+                        "text": " ".join(lines)})
+
+    for _ in range(profile.narration_boxes):
+        box_w, box_h = int(rng.integers(160, 260) * scale), int(rng.integers(50, 80) * scale)
+        position = _place(rng, occupied, width, height, box_w, box_h, margin)
+        if position is None:
+            break
+        box = (position[0], position[1], position[0] + box_w, position[1] + box_h)
+        cv2.rectangle(image, box[:2], box[2:], (255, 255, 255), -1)
+        cv2.rectangle(image, box[:2], box[2:], (0, 0, 0), max(2, int(2 * scale)))
+        lines = _text_lines(rng, int(rng.integers(4, 9)))
+        _draw_lines(image, lines, (box[0] + margin, box[1] + margin // 2, box[2] - margin, box[3] - margin // 2), scale)
+        regions.append({"class": 2, "bbox": box, "text": " ".join(lines)})
+
+    for _ in range(profile.sfx):
+        word = SFX_WORDS[int(rng.integers(0, len(SFX_WORDS)))]
+        font_scale = float(rng.uniform(1.8, 2.6)) * scale
+        thickness = int(7 * scale)
+        (text_w, text_h), baseline = cv2.getTextSize(word, cv2.FONT_HERSHEY_DUPLEX, font_scale, thickness)
+        position = _place(rng, occupied, width, height, text_w, text_h + baseline, margin)
+        if position is None:
+            break
+        cv2.putText(image, word, (position[0], position[1] + text_h), cv2.FONT_HERSHEY_DUPLEX, font_scale,
+                    (0, 0, 0), thickness, cv2.LINE_AA)
+        regions.append({"class": 1, "bbox": (position[0], position[1], position[0] + text_w, position[1] + text_h + baseline),
+                        "text": word})
+
+    return SyntheticPage(f"{profile.name}-{seed}", image, regions)
+
+def generate_pages(profile: PageProfile, count: int, seed: int = 0):
+    return [generate_page(profile, seed + i) for i in range(count)]
@@ -0,0 +1,428 @@
+"""
+Versions asynchrones des opérations CRUD utilisées par les routes FastAPI.
+Elles utilisent AsyncSession (asyncpg) pour ne pas bloquer la boucle d'événements.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, case, select, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import models
+from datetime import datetime, timedelta
+
+# Limites par défaut des quotas
+DEFAULT_QUOTA_LIMITS = {"daily": 15, "monthly": 200}
+
+def compute_reset_date(quota_type: str, now: datetime = None):
+    """Calcule la prochaine date de reset d'un quota"""
+    now = now or datetime.utcnow()
+    if quota_type == "daily":
+        # Reset à minuit le lendemain
+        return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if quota_type == "monthly":
+        # Reset le 1er du mois prochain
+        if now.month == 12:
+            return now.replace(year=now.year + 1, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        return now.replace(month=now.month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    return now + timedelta(days=365)
+
+# Opérations utilisateur
+async def create_user(db: AsyncSession, email: str, username: str, hashed_password: str):
+    db_user = models.User(
+        email=email,
+        username=username,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+async def authenticate_user(db: AsyncSession, email: str, password: str, verify_password_func):
+    user = await get_user_by_email(db, email)
+    if not user or not verify_password_func(password, user.hashed_password):
+        return None
+    return user
+
+# Opérations statistiques
+async def get_user_usage_stats(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.UsageStats).where(models.UsageStats.user_id == user_id))
+    return result.scalars().first()
+
+async def create_usage_stats(db: AsyncSession, user_id: int):
+    usage_stats = models.UsageStats(user_id=user_id, images_processed=0, total_processing_time=0.0, retreatment_count=0)
+    db.add(usage_stats)
+    await db.flush()
+    return usage_stats
+
+async def update_usage_stats(db: AsyncSession, user_id: int, images_processed: int = 1, processing_time: float = 0.0):
+    usage_stats = await get_user_usage_stats(db, user_id)
+    if not usage_stats:
+        usage_stats = await create_usage_stats(db, user_id)
+
+    usage_stats.images_processed = (usage_stats.images_processed or 0) + images_processed
+    usage_stats.total_processing_time = (usage_stats.total_processing_time or 0.0) + processing_time
+    usage_stats.last_activity = datetime.utcnow()
+
+    await db.commit()
+    return usage_stats
+
+# Opérations retraitements par image
+def _dialect_insert(db: AsyncSession):
+    """INSERT propre au dialecte (PostgreSQL en production, SQLite en développement) pour ON CONFLICT"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite_insert
+    return pg_insert
+
+async def get_image_retreatment(db: AsyncSession, user_id: int, image_hash: str):
+    """Récupère les informations de retraitement pour une image spécifique"""
+    result = await db.execute(select(models.ImageRetreatment).where(
+        and_(
+            models.ImageRetreatment.user_id == user_id,
+            models.ImageRetreatment.image_hash == image_hash
+        )
+    ))
+    return result.scalars().first()
+
+async def check_and_increment_image_retreatment(db: AsyncSession, user_id: int, image_hash: str, max_retreatments: int = 2):
+    """
+    Vérifie la limite et incrémente le compteur de retraitements d'une image en une seule requête.
+    Upsert avec mise à jour conditionnelle : retourne le nouveau compteur, ou None si la limite est atteinte.
+    """
+    table = models.ImageRetreatment.__table__
+    now = datetime.utcnow()
+    stmt = _dialect_insert(db)(table).values(
+        user_id=user_id,
+        image_hash=image_hash,
+        retreatment_count=1,
+        last_retreatment=now,
+        created_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.image_hash],
+        set_={
+            "retreatment_count": table.c.retreatment_count + 1,
+            "last_retreatment": now
+        },
+        where=table.c.retreatment_count < max_retreatments
+    ).returning(table.c.retreatment_count)
+
+    result = await db.execute(stmt)
+    new_count = result.scalar_one_or_none()
+    await db.commit()
+    return new_count
+
+async def release_image_retreatment(db: AsyncSession, user_id: int, image_hash: str):
+    """Annule un retraitement compté par check_and_increment_image_retreatment (échec du traitement)"""
+    table = models.ImageRetreatment.__table__
+    await db.execute(
+        update(table)
+        .where(
+            and_(
+                table.c.user_id == user_id,
+                table.c.image_hash == image_hash,
+                table.c.retreatment_count > 0
+            )
+        )
+        .values(retreatment_count=table.c.retreatment_count - 1)
+    )
+    await db.commit()
+
+async def get_image_retreatment_count(db: AsyncSession, user_id: int, image_hash: str):
+    """Récupère le nombre de retraitements pour une image spécifique"""
+    retreatment = await get_image_retreatment(db, user_id, image_hash)
+    if not retreatment:
+        return 0
+    return retreatment.retreatment_count
+
+# Opérations quotas
+async def get_user_quotas(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.UserQuota).where(models.UserQuota.user_id == user_id))
+    return result.scalars().all()
+
+async def get_user_quota_by_type(db: AsyncSession, user_id: int, quota_type: str, for_update: bool = False):
+    stmt = select(models.UserQuota).where(
+        and_(
+            models.UserQuota.user_id == user_id,
+            models.UserQuota.quota_type == quota_type
+        )
+    )
+    if for_update:
+        stmt = stmt.with_for_update()
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+async def _get_or_create_quota(db: AsyncSession, user_id: int, quota_type: str, for_update: bool = False):
+    """Récupère le quota (créé avec la limite par défaut s'il n'existe pas) et le remet à zéro s'il est expiré"""
+    quota = await get_user_quota_by_type(db, user_id, quota_type, for_update=for_update)
+    if not quota:
+        # ON CONFLICT DO NOTHING : deux premières requêtes concurrentes ne violent pas uq_user_quotas_user_type
+        await db.execute(
+            _dialect_insert(db)(models.UserQuota)
+            .values(
+                user_id=user_id,
+                quota_type=quota_type,
+                limit_value=DEFAULT_QUOTA_LIMITS.get(quota_type, 1000),
+                used_value=0,
+                reset_date=compute_reset_date(quota_type)
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "quota_type"])
+        )
+        quota = await get_user_quota_by_type(db, user_id, quota_type, for_update=for_update)
+
+    # Vérifier si le quota est expiré
+    if datetime.utcnow().replace(tzinfo=None) > quota.reset_date.replace(tzinfo=None):
+        quota.used_value = 0
+        quota.reset_date = compute_reset_date(quota_type)
+    return quota
+
+def _quota_status(daily_quota, monthly_quota, daily_ok: bool, monthly_ok: bool):
+    message = None
+    if not daily_ok:
+        message = f"Limite quotidienne de {daily_quota.limit_value} images atteinte. Réessayez demain."
+    elif not monthly_ok:
+        message = f"Limite mensuelle de {monthly_quota.limit_value} images atteinte. Réessayez le mois prochain."
+
+    return {
+        "can_process": daily_ok and monthly_ok,
+        "message": message,
+        "daily_used": daily_quota.used_value,
+        "daily_limit": daily_quota.limit_value,
+        "monthly_used": monthly_quota.used_value,
+        "monthly_limit": monthly_quota.limit_value
+    }
+
+async def reserve_quota_tokens(db: AsyncSession, user_id: int, lease_size: int = 1):
+    """
+    Vérifie les quotas et réserve des crédits en une transaction (lignes verrouillées FOR UPDATE).
+    Réserve `lease_size` crédits si la marge le permet, un seul à l'approche de la limite.
+    Retourne (nombre de crédits réservés, statut des quotas après réservation).
+    """
+    daily_quota = await _get_or_create_quota(db, user_id, "daily", for_update=True)
+    monthly_quota = await _get_or_create_quota(db, user_id, "monthly", for_update=True)
+
+    daily_ok = daily_quota.used_value < daily_quota.limit_value
+    monthly_ok = monthly_quota.used_value < monthly_quota.limit_value
+
+    granted = 0
+    if daily_ok and monthly_ok:
+        remaining = min(daily_quota.limit_value - daily_quota.used_value,
+                        monthly_quota.limit_value - monthly_quota.used_value)
+        granted = lease_size if remaining >= 2 * lease_size else 1
+        daily_quota.used_value += granted
+        monthly_quota.used_value += granted
+    await db.commit()
+
+    status = _quota_status(daily_quota, monthly_quota, daily_ok, monthly_ok)
+    status["daily_reset_date"] = daily_quota.reset_date
+    status["monthly_reset_date"] = monthly_quota.reset_date
+    return granted, status
+
+async def release_quota_tokens(db: AsyncSession, user_id: int, tokens: int, daily_reset_date: datetime, monthly_reset_date: datetime):
+    """Rend des crédits réservés et non consommés, seulement si la fenêtre de quota n'a pas été remise à zéro"""
+    table = models.UserQuota.__table__
+    await db.execute(
+        update(table)
+        .where(
+            and_(
+                table.c.user_id == user_id,
+                or_(
+                    and_(table.c.quota_type == "daily", table.c.reset_date == daily_reset_date),
+                    and_(table.c.quota_type == "monthly", table.c.reset_date == monthly_reset_date)
+                )
+            )
+        )
+        .values(used_value=case((table.c.used_value > tokens, table.c.used_value - tokens), else_=0))
+    )
+    await db.commit()
+
+async def refund_quota_tokens(db: AsyncSession, user_id: int, tokens: int):
+    """Rend des crédits consommés par des traitements qui ont échoué (fenêtres de quota en cours)"""
+    for quota_type in ("daily", "monthly"):
+        quota = await _get_or_create_quota(db, user_id, quota_type, for_update=True)
+        quota.used_value = max(0, quota.used_value - tokens)
+    await db.commit()
+
+async def check_user_quotas(db: AsyncSession, user_id: int):
+    """Vérifie les quotas quotidiens et mensuels (sans incrémentation)"""
+    daily_quota = await _get_or_create_quota(db, user_id, "daily")
+    monthly_quota = await _get_or_create_quota(db, user_id, "monthly")
+    await db.commit()
+
+    daily_ok = daily_quota.used_value < daily_quota.limit_value
+    monthly_ok = monthly_quota.used_value < monthly_quota.limit_value
+    return _quota_status(daily_quota, monthly_quota, daily_ok, monthly_ok)
+
+async def check_quotas_for_retreatment(db: AsyncSession, user_id: int):
+    """Vérifie les quotas sans incrémentation (utilisé pour le retraitement)"""
+    return await check_user_quotas(db, user_id)
+
+def _quota_window(quota, effective_used: int, quota_type: str, now: datetime):
+    """Fenêtre de quota en lecture seule : valeurs par défaut si la ligne n'existe pas encore"""
+    if quota is None:
+        return {"limit": DEFAULT_QUOTA_LIMITS.get(quota_type, 1000), "used": 0, "reset_date": compute_reset_date(quota_type, now), "row": None}
+    reset_date = quota.reset_date
+    if now > reset_date.replace(tzinfo=None):
+        # Quota expiré : la remise à zéro est calculée ici, elle sera écrite au prochain traitement
+        reset_date = compute_reset_date(quota_type, now)
+    return {"limit": quota.limit_value, "used": effective_used or 0, "reset_date": reset_date, "row": quota}
+
+async def get_profile_snapshot(db: AsyncSession, user_id: int):
+    """
+    Profil complet en une seule requête (utilisateur, statistiques, quotas quotidien et mensuel).
+    Lecture seule : l'expiration des quotas est évaluée en SQL, aucune ligne n'est créée ni remise à zéro.
+    """
+    now = datetime.utcnow()
+    daily = aliased(models.UserQuota, name="daily_quota")
+    monthly = aliased(models.UserQuota, name="monthly_quota")
+    daily_used = case((daily.reset_date < now, 0), else_=daily.used_value).label("daily_used")
+    monthly_used = case((monthly.reset_date < now, 0), else_=monthly.used_value).label("monthly_used")
+
+    stmt = (
+        select(models.User, models.UsageStats, daily, monthly, daily_used, monthly_used)
+        .select_from(models.User)
+        .outerjoin(models.UsageStats, models.UsageStats.user_id == models.User.id)
+        .outerjoin(daily, and_(daily.user_id == models.User.id, daily.quota_type == "daily"))
+        .outerjoin(monthly, and_(monthly.user_id == models.User.id, monthly.quota_type == "monthly"))
+        .where(models.User.id == user_id)
+        .limit(1)
+    )
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        return None
+
+    user, usage_stats, daily_quota, monthly_quota, daily_used_value, monthly_used_value = row
+    daily_window = _quota_window(daily_quota, daily_used_value, "daily", now)
+    monthly_window = _quota_window(monthly_quota, monthly_used_value, "monthly", now)
+
+    daily_ok = daily_window["used"] < daily_window["limit"]
+    monthly_ok = monthly_window["used"] < monthly_window["limit"]
+    message = None
+    if not daily_ok:
+        message = f"Limite quotidienne de {daily_window['limit']} images atteinte. Réessayez demain."
+    elif not monthly_ok:
+        message = f"Limite mensuelle de {monthly_window['limit']} images atteinte. Réessayez le mois prochain."
+
+    quotas = []
+    for quota_type, window in (("daily", daily_window), ("monthly", monthly_window)):
+        if window["row"] is not None:
+            quotas.append({
+                "id": window["row"].id,
+                "user_id": user_id,
+                "quota_type": quota_type,
+                "limit_value": window["limit"],
+                "used_value": window["used"],
+                "reset_date": window["reset_date"],
+                "created_at": window["row"].created_at
+            })
+
+    return {
+        "user": user,
+        "usage_stats": usage_stats,
+        "quotas": quotas,
+        "quota_status": {
+            "can_process": daily_ok and monthly_ok,
+            "message": message,
+            "daily_used": daily_window["used"],
+            "daily_limit": daily_window["limit"],
+            "monthly_used": monthly_window["used"],
+            "monthly_limit": monthly_window["limit"]
+        }
+    }
+
+# Opérations sessions
+async def deactivate_all_user_sessions(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        update(models.UserSession)
+        .where(
+            and_(
+                models.UserSession.user_id == user_id,
+                models.UserSession.is_active == True
+            )
+        )
+        .values(is_active=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+# Gestion des utilisateurs
+async def update_user_password(db: AsyncSession, user_id: int, new_hashed_password: str):
+    """Met à jour le mot de passe d'un utilisateur"""
+    user = await get_user_by_id(db, user_id)
+    if user:
+        user.hashed_password = new_hashed_password
+        user.updated_at = datetime.utcnow()
+        await db.commit()
+    return user
+
+async def update_user_username(db: AsyncSession, user_id: int, new_username: str):
+    """Met à jour le nom d'utilisateur"""
+    user = await get_user_by_id(db, user_id)
+    if user:
+        user.username = new_username
+        user.updated_at = datetime.utcnow()
+        await db.commit()
+    return user
+
+async def update_user_email(db: AsyncSession, user_id: int, new_email: str):
+    """Met à jour l'email d'un utilisateur"""
+    user = await get_user_by_id(db, user_id)
+    if user:
+        user.email = new_email
+        user.updated_at = datetime.utcnow()
+        await db.commit()
+    return user
+
+async def create_password_reset_token(db: AsyncSession, user_id: int, token: str, expires_at: datetime):
+    """Crée un token de récupération de mot de passe"""
+    # Désactiver les anciens tokens non utilisés
+    await db.execute(
+        update(models.PasswordReset)
+        .where(
+            and_(
+                models.PasswordReset.user_id == user_id,
+                models.PasswordReset.is_used == False
+            )
+        )
+        .values(is_used=True)
+    )
+
+    reset_token = models.PasswordReset(
+        user_id=user_id,
+        token=token,
+        expires_at=expires_at,
+        is_used=False
+    )
+    db.add(reset_token)
+    await db.commit()
+    return reset_token
+
+async def get_password_reset_token(db: AsyncSession, token: str):
+    """Récupère un token de récupération de mot de passe"""
+    result = await db.execute(select(models.PasswordReset).where(
+        and_(
+            models.PasswordReset.token == token,
+            models.PasswordReset.is_used == False,
+            models.PasswordReset.expires_at > datetime.utcnow()
+        )
+    ))
+    return result.scalars().first()
+
+async def mark_password_reset_token_used(db: AsyncSession, token: str):
+    """Marque un token de récupération comme utilisé"""
+    reset_token = await get_password_reset_token(db, token)
+    if reset_token:
+        reset_token.is_used = True
+        await db.commit()
+    return reset_token
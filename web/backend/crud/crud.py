@@ -350,30 +350,28 @@ def deactivate_session(db: Session, session_token: str):
     return session
 
 def deactivate_all_user_sessions(db: Session, user_id: int):
-    sessions = db.query(models.UserSession).filter(
+    """Désactive toutes les sessions actives de l'utilisateur en un seul UPDATE"""
+    count = db.query(models.UserSession).filter(
         and_(
             models.UserSession.user_id == user_id,
             models.UserSession.is_active == True
         )
-    ).all()
-    
-    for session in sessions:
-        session.is_active = False
+    ).update({models.UserSession.is_active: False}, synchronize_session=False)
     
     db.commit()
-    return sessions
+    return count
 
 def cleanup_expired_sessions(db: Session):
-    """Nettoie les sessions expirées"""
-    expired_sessions = db.query(models.UserSession).filter(
-        models.UserSession.expires_at <= datetime.utcnow()
-    ).all()
-    
-    for session in expired_sessions:
-        session.is_active = False
+    """Nettoie les sessions expirées (voir aussi services/maintenance.py pour la suppression)"""
+    count = db.query(models.UserSession).filter(
+        and_(
+            models.UserSession.expires_at <= datetime.utcnow(),
+            models.UserSession.is_active == True
+        )
+    ).update({models.UserSession.is_active: False}, synchronize_session=False)
     
     db.commit()
-    return len(expired_sessions)
+    return count
 
 # Nouvelles fonctions pour la gestion des utilisateurs
 def update_user_password(db: Session, user_id: int, new_hashed_password: str):
@@ -409,15 +407,12 @@ def update_user_email(db: Session, user_id: int, new_email: str):
 def create_password_reset_token(db: Session, user_id: int, token: str, expires_at: datetime):
     """Crée un token de récupération de mot de passe"""
     # Désactiver les anciens tokens non utilisés
-    old_tokens = db.query(models.PasswordReset).filter(
+    db.query(models.PasswordReset).filter(
         and_(
             models.PasswordReset.user_id == user_id,
             models.PasswordReset.is_used == False
         )
-    ).all()
-    
-    for old_token in old_tokens:
-        old_token.is_used = True
+    ).update({models.PasswordReset.is_used: True}, synchronize_session=False)
     
     # Créer le nouveau token
     reset_token = models.PasswordReset(
@@ -452,12 +447,12 @@ def mark_password_reset_token_used(db: Session, token: str):
 def cleanup_expired_password_resets(db: Session):
     """Nettoie les tokens de récupération expirés"""
     now = datetime.utcnow()
-    expired_tokens = db.query(models.PasswordReset).filter(
-        models.PasswordReset.expires_at < now
-    ).all()
-    
-    for token in expired_tokens:
-        token.is_used = True
+    count = db.query(models.PasswordReset).filter(
+        and_(
+            models.PasswordReset.expires_at < now,
+            models.PasswordReset.is_used == False
+        )
+    ).update({models.PasswordReset.is_used: True}, synchronize_session=False)
     
     db.commit()
-    return len(expired_tokens) 
\ No newline at end of file
+    return count 
\ No newline at end of file
@@ -2,47 +2,88 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, status
+from fastapi import FastAPI, File, UploadFile, Form, Header, Depends, HTTPException, status
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from datetime import datetime, timedelta
 
 import time
 
+import asyncio
+
+import hmac
+
 import os
 
+import sys
 
+from contextlib import asynccontextmanager
 
-from processing.pipeline import process_image_pipeline_with_bubbles
+
+
+from processing.pipeline import process_image_pipeline_with_bubbles, process_pages_batch, process_image_pipeline_stream
 
 from processing.reinsert_translations import draw_translated_text
 
 from processing.bubble_editor import get_bubble_polygons, process_with_custom_polygons
 
+from processing.ingest import ImageRejected, decode_image
+
+from processing.stage_graph import measure
+
+from processing.tracing import propagate, set_attributes, start_span, exporter as trace_exporter
+from processing.flight_recorder import recorder as flight_recorder, folded
+from processing.memory_profile import memory_stage, profile_request, profiled
+from processing import model_loader
+
+from processing.stages import StageInputError, parse_detections, parse_bubbles, detect_stage, clean_stage, ocr_stage, translate_stage, render_stage
+
 
 
 # Import des modules de base de données
 
-from database.database import get_db, engine
+from database.database import get_async_db, engine, async_engine, get_pool_status, AsyncSessionLocal
 
 from models import models
 
 from schemas import schemas
 
-from crud import crud
+from crud import async_crud
 
-from auth.auth import get_current_active_user, create_access_token, get_password_hash, verify_password
+from auth.auth import get_current_active_user, create_access_token, get_password_hash, verify_password, SECRET_KEY, ALGORITHM
 
 
 
 # Import du service d'email
 
-from services.email_service import send_password_reset_email, send_welcome_email
+from services.email_service import render_password_reset_email, render_welcome_email
+
+from services.email_outbox import email_outbox, enqueue_email
+
+from services.usage_accounting import usage_accumulator
+
+from services.profile_cache import profile_cache
+
+from services.rate_limiter import quota_admission, AdmissionMiddleware, STAGE_COSTS
+
+from services.maintenance import maintenance_worker
+
+from services.single_flight import single_flight
+
+from services.upload_limits import UploadLimitMiddleware, read_image_upload
+
+from services.worker_profile import WorkerProfileMiddleware, unavailable_message
+
+from services.chapter_batch import MAX_ARCHIVE_BYTES, BATCH_PAGE_GROUP, open_archive, read_page, CbzStreamWriter
+
+from services.metrics import metrics, MetricsMiddleware, TracingMiddleware, FlightRecorderMiddleware, RequestTiming, instrument_engine, observe_spans
 
 
 
@@ -54,6 +95,18 @@ import cv2
 
 import json
 
+import re
+
+import logging
+
+
+
+# Journaux de l'application (services, pipeline, routes) sur la sortie standard, à côté de ceux d'uvicorn
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+
+logger = logging.getLogger(__name__)
+
 
 
 # Créer les tables
@@ -66,6 +119,135 @@ app = FastAPI(title="Bubble Cleaner API", version="1.0.0")
 
 
 
+# Admission en mémoire (seau à jetons + bail de quotas), avant la lecture du fichier envoyé.
+
+# Ajouté avant CORS pour que les réponses 429 portent les en-têtes CORS.
+
+app.add_middleware(
+
+    AdmissionMiddleware,
+
+    admission=quota_admission,
+
+    secret_key=SECRET_KEY,
+
+    algorithm=ALGORITHM,
+
+    quota_paths=["/process", "/retreat-with-polygons", "/process-batch", "/process-stream",
+                 "/stages/detect", "/stages/clean", "/stages/ocr", "/stages/translate"],
+
+    rate_paths=["/quotas"],
+
+)
+
+
+
+# Taille maximale des fichiers envoyés, vérifiée avant la lecture du corps
+
+app.add_middleware(UploadLimitMiddleware, path_limits={"/process-batch": MAX_ARCHIVE_BYTES})
+
+
+
+# Routes dont les modèles sont exclus par le profil du worker (WORKER_PROFILE) : 503 avant admission et lecture
+
+app.add_middleware(WorkerProfileMiddleware)
+
+
+
+# Les pipelines tournent dans un thread pour ne pas bloquer la boucle d'événements (les requêtes
+
+# identiques peuvent ainsi s'attacher au calcul en cours) ; 1 = un pipeline à la fois, comme avant
+
+PIPELINE_MAX_CONCURRENCY = int(os.getenv("PIPELINE_MAX_CONCURRENCY", "1"))
+
+pipeline_slots = asyncio.Semaphore(PIPELINE_MAX_CONCURRENCY)
+
+pipeline_queue = {"waiting": 0, "running": 0}
+
+
+
+# Pipelines progressifs (/process-stream) en cours, gardés jusqu'à leur fin
+
+pipeline_tasks = set()
+
+
+
+# Modèles chargés au démarrage plutôt qu'à la première requête (en tâche de fond, /health répond pendant ce temps)
+
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0").lower() in ("1", "true", "yes")
+
+
+
+@asynccontextmanager
+
+async def pipeline_slot(timing=None):
+
+    """Réserve une place de pipeline ; l'attente est mesurée (span "queue") et comptée dans la file"""
+
+    timing = timing or RequestTiming()
+
+    pipeline_queue["waiting"] += 1
+
+    try:
+
+        with timing.span("queue"):
+
+            await pipeline_slots.acquire()
+
+    finally:
+
+        pipeline_queue["waiting"] -= 1
+
+    pipeline_queue["running"] += 1
+
+    try:
+
+        yield
+
+    finally:
+
+        pipeline_queue["running"] -= 1
+
+        pipeline_slots.release()
+
+
+
+async def run_pipeline(func, *args, timing=None):
+
+    async with pipeline_slot(timing):
+
+        # Profil mémoire par étape si MEMORY_PROFILE est activé (processing/memory_profile.py) ;
+
+        # le thread du pipeline est rattaché à la trace et à l'enregistrement de vol de la requête
+
+        return await run_in_threadpool(propagate(profiled(func)), *args)
+
+
+
+async def run_pipeline_timed(func, *args):
+
+    """
+
+    Exécute `func(*args, spans)` dans une place de pipeline et retourne (résultat, spans).
+
+    Les spans (attente + étapes) sont observés ici, une seule fois par calcul.
+
+    """
+
+    job = RequestTiming()
+
+    spans = []
+
+    with start_span("pipeline", function=func.__name__):
+
+        result = await run_pipeline(func, *args, spans, timing=job)
+
+    observe_spans(spans)
+
+    return result, job.spans + spans
+
+
+
 # Autoriser le frontend local (à adapter en prod)
 
 
@@ -88,10 +270,26 @@ app.add_middleware(
 
     allow_headers=["*"],
 
+    expose_headers=["X-Trace-Id"],
+
 )
 
 
 
+# Durée et statut de chaque requête HTTP (/metrics), mesurés au plus près du serveur
+
+app.add_middleware(MetricsMiddleware)
+# Enregistreur de vol (FLIGHT_RECORDER_* ou /admin/flight-recorder) : piles échantillonnées des requêtes lentes
+app.add_middleware(FlightRecorderMiddleware)
+
+# Trace de chaque requête (TRACE_FILE / TRACE_OTLP_ENDPOINT), racine englobant tous les autres middlewares
+
+app.add_middleware(TracingMiddleware)
+
+instrument_engine(async_engine)
+
+
+
 # ==================== ROUTES D'AUTHENTIFICATION ====================
 
 
@@ -107,13 +305,13 @@ async def root():
 
 @app.post("/register", response_model=schemas.User)
 
-async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
 
     """Inscription d'un nouvel utilisateur"""
 
     # Vérifier si l'email existe déjà
 
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
 
     if db_user:
 
@@ -123,7 +321,7 @@ async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
     # Vérifier si le username existe déjà
 
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await async_crud.get_user_by_username(db, username=user.username)
 
     if db_user:
 
@@ -135,19 +333,21 @@ async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
     hashed_password = get_password_hash(user.password)
 
-    db_user = crud.create_user(db, user.email, user.username, hashed_password)
+    db_user = await async_crud.create_user(db, user.email, user.username, hashed_password)
 
     
 
-    # Envoyer un email de bienvenue (en arrière-plan, sans bloquer la réponse)
+    # Mettre l'email de bienvenue dans la file d'envoi (envoyé en arrière-plan, sans attendre le SMTP)
 
     try:
 
-        await send_welcome_email(email=db_user.email, username=db_user.username)
+        subject, body = render_welcome_email(db_user.username)
+
+        await enqueue_email(db, db_user.email, subject, body, kind="welcome")
 
     except Exception as e:
 
-        print(f"Erreur lors de l'envoi de l'email de bienvenue: {e}")
+        logger.error(f"Erreur lors de la mise en file de l'email de bienvenue: {e}")
 
         # On ne fait pas échouer l'inscription si l'email échoue
 
@@ -159,11 +359,11 @@ async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 @app.post("/login", response_model=schemas.Token)
 
-async def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
 
     """Connexion d'un utilisateur"""
 
-    user = crud.authenticate_user(db, user_credentials.email, user_credentials.password, verify_password)
+    user = await async_crud.authenticate_user(db, user_credentials.email, user_credentials.password, verify_password)
 
     if not user:
 
@@ -187,43 +387,75 @@ async def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_d
 
 
 
-@app.get("/profile", response_model=schemas.UserProfile)
+async def get_profile_snapshot(db: AsyncSession, user_id: int) -> schemas.UserProfile:
 
-async def get_user_profile(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Profil + quotas en une requête, servi depuis le cache court par utilisateur"""
 
-    """Récupérer le profil de l'utilisateur connecté"""
+    snapshot = profile_cache.get(user_id)
 
-    usage_stats = crud.get_user_usage_stats(db, current_user.id)
+    set_attributes(profile_cache_hit=snapshot is not None)
 
-    quotas = crud.get_user_quotas(db, current_user.id)
+    if snapshot is None:
+
+        data = await async_crud.get_profile_snapshot(db, user_id)
+
+        snapshot = schemas.UserProfile.model_validate(data, from_attributes=True)
+
+        profile_cache.set(user_id, snapshot)
 
     
 
-    return {
+    # Ajouter les statistiques pas encore écrites en base (écriture différée)
 
-        "user": current_user,
+    pending = usage_accumulator.pending_for(user_id)
 
-        "usage_stats": usage_stats,
+    if pending and snapshot.usage_stats:
 
-        "quotas": quotas
+        usage_stats = snapshot.usage_stats.model_copy(update={
+
+            "images_processed": snapshot.usage_stats.images_processed + pending.images_processed,
+
+            "total_processing_time": snapshot.usage_stats.total_processing_time + pending.processing_time,
+
+            "last_activity": pending.last_activity
+
+        })
+
+        snapshot = snapshot.model_copy(update={"usage_stats": usage_stats})
+
+    
+
+    # Crédits réservés par ce worker et pas encore consommés exclus (mêmes chiffres pour /profile et /quotas)
+
+    return quota_admission.adjust_profile(user_id, snapshot)
 
-    }
+
+
+@app.get("/profile", response_model=schemas.UserProfile)
+
+async def get_user_profile(current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+
+    """Récupérer le profil de l'utilisateur connecté"""
+
+    return await get_profile_snapshot(db, current_user.id)
 
 
 
 @app.get("/quotas")
 
-async def get_user_quotas(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_user_quotas(current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
 
     """Récupérer les quotas de l'utilisateur"""
 
-    quota_status = crud.check_user_quotas(db, current_user.id)
+    quota_admission.remember(current_user.email, current_user.id)
+
+    snapshot = await get_profile_snapshot(db, current_user.id)
 
     
 
     return {
 
-        **quota_status,
+        **snapshot.quota_status.model_dump(),
 
         "retreatment_limit": 2,
 
@@ -241,44 +473,281 @@ async def get_user_quotas(current_user: schemas.User = Depends(get_current_activ
 async def process_image(
     file: UploadFile = File(...),
     current_user: schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Traiter une image avec authentification et vérification des quotas"""
     start_time = time.time()
+    timing = RequestTiming()
+    
+    logger.info(f"Début du traitement pour l'utilisateur {current_user.email}: {file.filename}, {file.size} bytes")
+    
+    # Lecture bornée : taille, format et dimensions vérifiés avant le décodage
+    try:
+        with timing.span("upload"):
+            image_bytes = await read_image_upload(file)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     
-    print(f"🖼️  Début du traitement pour l'utilisateur: {current_user.email}")
-    print(f"📁 Fichier reçu: {file.filename}, taille: {file.size} bytes")
+    quota_admission.remember(current_user.email, current_user.id)
     
-    # Vérifier et incrémenter les quotas
-    quota_status = crud.check_and_increment_quotas(db, current_user.id)
+    async def charge():
+        # Vérifier et incrémenter les quotas (une seule fois pour des soumissions identiques)
+        with timing.span("quota"):
+            quota_status = await quota_admission.charge(db, current_user.id)
+        if not quota_status["can_process"]:
+            raise HTTPException(status_code=429, detail=quota_status["message"])
+        return quota_status
+    
+    async def refund():
+        # L'image n'a pas été traitée : le crédit débité est rendu
+        await quota_admission.refund(db, current_user.id, 1)
+    
+    async def compute():
+        # Le profil mémoire (si activé) couvre aussi la réponse : les chaînes base64 y sont une étape
+        with profile_request("process", image_bytes=len(image_bytes)):
+            (result_bytes, bubbles, cleaned_base64), spans = await run_pipeline_timed(process_image_pipeline_with_bubbles, image_bytes)
+            logger.info(f"Traitement terminé: {len(result_bytes)} bytes, {len(bubbles)} bulles détectées")
+            with memory_stage("response"):
+                result = {
+                    "image_base64": base64.b64encode(result_bytes).decode('utf-8'),
+                    "bubbles": bubbles,
+                    "cleaned_base64": cleaned_base64
+                }
+        return result, spans
+    
+    try:
+        (result, spans), quota_status, coalesced = await single_flight.run(
+            single_flight.make_key("process", image_bytes), current_user.id, compute, charge, refund
+        )
+        timing.add(spans)
+        set_attributes(coalesced=coalesced, image_bytes=len(image_bytes), bubble_count=len(result["bubbles"]))
+        
+        # Mettre à jour les statistiques (écriture différée, en lot), sauf pour une soumission en double
+        if not coalesced:
+            processing_time = time.time() - start_time
+            usage_accumulator.record_processing(current_user.id, 1, processing_time)
+        
+        return JSONResponse(content={**result, "quota_status": quota_status}, headers=timing.header())
+    except HTTPException:
+        raise
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Erreur lors du traitement: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors du traitement: {str(e)}")
+
+
+
+@app.post("/process-stream")
+async def process_image_stream(
+    file: UploadFile = File(...),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Variante progressive de /process en Server-Sent Events : l'image nettoyée est envoyée dès la fin
+    du nettoyage (événement `cleaned`), puis chaque bulle traduite (`bubble`) et enfin l'image finale (`final`).
+    """
+    start_time = time.time()
+    try:
+        image_bytes = await read_image_upload(file)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    quota_admission.remember(current_user.email, current_user.id)
+    quota_status = await quota_admission.charge(db, current_user.id)
     if not quota_status["can_process"]:
         raise HTTPException(status_code=429, detail=quota_status["message"])
+    user_id = current_user.id
+    
+    def sse(event_name, payload):
+        return f"event: {event_name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
     
-    # Traitement de l'image
-    image_bytes = await file.read()
-    print(f"📊 Image lue: {len(image_bytes)} bytes")
+    async def stream_events():
+        yield sse("start", {"quota_status": quota_status})
+        # Le pipeline dépose ses événements dans une file pendant qu'il tient sa place ; ils sont envoyés
+        # au client hors de la place : un client lent ou déconnecté ne bloque pas les autres pipelines
+        events = asyncio.Queue()
+        finished = object()
+        loop = asyncio.get_running_loop()
+        
+        def produce():
+            try:
+                for item in process_image_pipeline_stream(image_bytes):
+                    loop.call_soon_threadsafe(events.put_nowait, item)
+                loop.call_soon_threadsafe(events.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, e)
+        
+        async def run():
+            async with pipeline_slot():
+                await run_in_threadpool(propagate(produce))
+        
+        # Référence gardée : si le client se déconnecte, le pipeline se termine et libère sa place sans lui
+        producer = asyncio.create_task(run())
+        pipeline_tasks.add(producer)
+        producer.add_done_callback(pipeline_tasks.discard)
+        try:
+            while (item := await events.get()) is not finished:
+                if isinstance(item, Exception):
+                    raise item
+                event_name, payload = item
+                yield sse(event_name, payload)
+        except Exception as e:
+            logger.error(f"Erreur lors du traitement progressif: {e}")
+            # L'image n'a pas été traitée : le crédit débité est rendu
+            try:
+                async with AsyncSessionLocal() as refund_db:
+                    await quota_admission.refund(refund_db, user_id, 1)
+            except Exception as refund_error:
+                logger.error(f"Erreur lors de la restitution du crédit: {refund_error}")
+            yield sse("error", {"error": f"Erreur lors du traitement: {str(e)}"})
+            return
+        usage_accumulator.record_processing(user_id, 1, time.time() - start_time)
     
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def process_archive_group(archive, infos, spans=None):
+    """Lit un groupe de pages de l'archive et les traite ensemble (appelé dans un thread)"""
+    results = [None] * len(infos)
+    pages = []
+    for i, info in enumerate(infos):
+        try:
+            with measure(spans, "read_page", time.perf_counter()):
+                pages.append((i, read_page(archive, info)))
+        except ImageRejected as e:
+            results[i] = {"error": str(e)}
+    if pages:
+        for (i, _), result in zip(pages, process_pages_batch([data for _, data in pages], spans)):
+            results[i] = result
+    return results
+
+
+@app.post("/process-batch")
+async def process_chapter(
+    file: UploadFile = File(...),
+    output: str = Form("ndjson"),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """
+    Traite un chapitre entier envoyé en CBZ/ZIP. Les pages sont lues depuis l'archive sans extraction,
+    traitées par groupes de BATCH_PAGE_GROUP et renvoyées au fil de l'eau : une ligne JSON par page
+    (output=ndjson) ou un CBZ des pages traduites (output=cbz). Le quota est débité page par page.
+    """
+    if output not in ("ndjson", "cbz"):
+        raise HTTPException(status_code=400, detail="output doit valoir 'ndjson' ou 'cbz'")
+    if file.size is not None and file.size > MAX_ARCHIVE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Archive trop volumineuse (maximum {MAX_ARCHIVE_BYTES // (1024 * 1024)} Mo)")
     try:
-        result_bytes, bubbles, cleaned_base64 = process_image_pipeline_with_bubbles(image_bytes)
-        print(f"✅ Traitement terminé: {len(result_bytes)} bytes, {len(bubbles)} bulles détectées")
+        archive, pages = open_archive(file.file)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    logger.info(f"Chapitre reçu pour {current_user.email}: {file.filename}, {len(pages)} pages")
+    quota_admission.remember(current_user.email, current_user.id)
+    user_id = current_user.id
+    
+    async def stream_results():
+        start_time = time.time()
+        writer = CbzStreamWriter() if output == "cbz" else None
+        manifest = []
+        processed = failed = 0
+        quota_message = None
         
-        image_base64 = base64.b64encode(result_bytes).decode('utf-8')
+        def event(payload):
+            return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
         
-        # Mettre à jour les statistiques
-        processing_time = time.time() - start_time
-        crud.update_usage_stats(db, current_user.id, 1, processing_time)
+        try:
+            if writer is None:
+                yield event({"type": "start", "pages": len(pages), "name": file.filename})
         
-        return JSONResponse(content={
-            "image_base64": image_base64,
-            "bubbles": bubbles,
-            "cleaned_base64": cleaned_base64,
-            "quota_status": quota_status
-        })
-    except Exception as e:
-        print(f"❌ Erreur lors du traitement: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Erreur lors du traitement: {str(e)}")
+            for group_start in range(0, len(pages), BATCH_PAGE_GROUP):
+                group = pages[group_start:group_start + BATCH_PAGE_GROUP]
+            
+                # Débit du quota pour chaque page du groupe avant son traitement
+                charged = []
+                async with AsyncSessionLocal() as db:
+                    for info in group:
+                        quota_status = await quota_admission.charge(db, user_id)
+                        if not quota_status["can_process"]:
+                            quota_message = quota_status["message"]
+                            break
+                        charged.append(quota_status)
+            
+                if charged:
+                    group_time = time.time()
+                    try:
+                        results, _ = await run_pipeline_timed(process_archive_group, archive, group[:len(charged)])
+                    except Exception as e:
+                        logger.error(f"Erreur lors du traitement des pages {group_start + 1}-{group_start + len(charged)}: {e}")
+                        results = [{"error": f"Erreur lors du traitement: {e}"}] * len(charged)
+                    page_time = (time.time() - group_time) / len(charged)
+                
+                    # Les pages en échec ne consomment pas de crédit
+                    errors = sum(1 for result in results if "error" in result)
+                    if errors:
+                        try:
+                            async with AsyncSessionLocal() as db:
+                                await quota_admission.refund(db, user_id, errors)
+                        except Exception as e:
+                            logger.error(f"Erreur lors de la restitution des crédits: {e}")
+                
+                    for offset, (info, quota_status, result) in enumerate(zip(group, charged, results)):
+                        index = group_start + offset
+                        if "error" in result:
+                            failed += 1
+                            manifest.append({"index": index, "name": info.filename, "error": result["error"]})
+                            if writer is None:
+                                yield event({"type": "page", "index": index, "name": info.filename, "status": "error", "error": result["error"]})
+                            continue
+                    
+                        processed += 1
+                        usage_accumulator.record_processing(user_id, 1, page_time)
+                        manifest.append({"index": index, "name": info.filename, "bubbles": result["bubbles"]})
+                        if writer is None:
+                            yield event({
+                                "type": "page",
+                                "index": index,
+                                "name": info.filename,
+                                "status": "ok",
+                                "image_base64": base64.b64encode(result["image_bytes"]).decode('utf-8'),
+                                "cleaned_base64": result["cleaned_base64"],
+                                "bubbles": result["bubbles"],
+                                "quota_status": quota_status
+                            })
+                        else:
+                            yield writer.add(f"{index + 1:03d}_{os.path.splitext(os.path.basename(info.filename))[0]}.png", result["image_bytes"])
+            
+                if quota_message is not None:
+                    if writer is None:
+                        yield event({"type": "quota_exceeded", "message": quota_message, "remaining_pages": len(pages) - processed - failed})
+                    break
+        
+            summary = {"processed": processed, "failed": failed, "duration_s": round(time.time() - start_time, 2)}
+            if quota_message is not None:
+                summary["quota_message"] = quota_message
+            logger.info(f"Chapitre terminé: {summary}")
+            if writer is None:
+                yield event({"type": "done", **summary})
+            else:
+                yield writer.add("translations.json", json.dumps({"pages": manifest, **summary}, ensure_ascii=False, indent=2).encode("utf-8"))
+                yield writer.close()
+        finally:
+            archive.close()
+    
+    if output == "cbz":
+        stem = re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(file.filename or "chapitre"))[0], flags=re.ASCII)
+        return StreamingResponse(
+            stream_results(),
+            media_type="application/vnd.comicbook+zip",
+            headers={"Content-Disposition": f'attachment; filename="{stem}_fr.cbz"'}
+        )
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 
 
@@ -294,11 +763,15 @@ async def get_bubbles_for_editing(
 
     """Récupère les masques de bulles et les convertit en polygones simplifiés pour l'édition manuelle"""
 
-    image_bytes = await file.read()
+    try:
+
+        image_bytes = await read_image_upload(file)
 
-    nparr = np.frombuffer(image_bytes, np.uint8)
+    except ImageRejected as e:
 
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
+
+    image = decode_image(image_bytes)
 
     if image is None:
 
@@ -328,7 +801,7 @@ async def retreat_with_custom_polygons(
 
     current_user: schemas.User = Depends(get_current_active_user),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -336,21 +809,21 @@ async def retreat_with_custom_polygons(
 
     start_time = time.time()
 
-    
+    timing = RequestTiming()
 
-    # Vérifier les quotas sans incrémentation (retraitement)
+    
 
-    quota_status = crud.check_quotas_for_retreatment(db, current_user.id)
+    # Lire l'image et calculer son hash
 
-    if not quota_status["can_process"]:
+    try:
 
-        raise HTTPException(status_code=429, detail=quota_status["message"])
+        with timing.span("upload"):
 
-    
+            image_bytes = await read_image_upload(file)
 
-    # Lire l'image et calculer son hash
+    except ImageRejected as e:
 
-    image_bytes = await file.read()
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
 
     import hashlib
 
@@ -358,129 +831,191 @@ async def retreat_with_custom_polygons(
 
     
 
-    # Vérifier la limite de retraitements pour cette image spécifique
+    # Utiliser les bytes déjà lus (taille d'origine : les polygones sont dans ses coordonnées)
 
-    if not crud.check_image_retreatment_limit(db, current_user.id, image_hash, max_retreatments=2):
+    with timing.span("decode"):
 
-        retreatment_count = crud.get_image_retreatment_count(db, current_user.id, image_hash)
+        image = decode_image(image_bytes)
 
-        raise HTTPException(
+    if image is None:
 
-            status_code=429, 
+        return JSONResponse(content={"error": "Image illisible"}, status_code=400)
 
-            detail=f"Limite de retraitements atteinte pour cette image ({retreatment_count}/2). Vous ne pouvez plus retraiter cette image."
+    
 
-        )
+    quota_admission.remember(current_user.email, current_user.id)
 
     
 
-    # Utiliser les bytes déjà lus
+    async def charge():
 
-    nparr = np.frombuffer(image_bytes, np.uint8)
+        # Vérifier les quotas sans incrémentation (retraitement)
 
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with timing.span("quota"):
 
-    if image is None:
+            quota_status = await quota_admission.check(db, current_user.id)
 
-        return JSONResponse(content={"error": "Image illisible"}, status_code=400)
+        if not quota_status["can_process"]:
+
+            raise HTTPException(status_code=429, detail=quota_status["message"])
+
+        
+
+        # Vérifier la limite et compter le retraitement pour cette image en une seule requête atomique
+
+        retreatment_count = await async_crud.check_and_increment_image_retreatment(db, current_user.id, image_hash, max_retreatments=2)
+
+        if retreatment_count is None:
+
+            raise HTTPException(
+
+                status_code=429, 
+
+                detail="Limite de retraitements atteinte pour cette image (2/2). Vous ne pouvez plus retraiter cette image."
+
+            )
+
+        return quota_status
+
+    
+
+    async def refund():
+
+        # Le retraitement a échoué : il ne doit pas compter dans la limite de l'image
+
+        await async_crud.release_image_retreatment(db, current_user.id, image_hash)
+
+    
+
+    async def compute():
+
+        return await run_pipeline_timed(retreat_pipeline, image, json.loads(polygons))
 
     
 
     try:
 
-        polygons_list = json.loads(polygons)
+        (result, spans), quota_status, coalesced = await single_flight.run(
 
-        
+            single_flight.make_key("retreat", image_bytes, polygons), current_user.id, compute, charge, refund
 
-        # Créer les outputs simulés pour le nettoyage
+        )
 
-        from processing.bubble_editor import create_mock_outputs
+        timing.add(spans)
 
-        mock_outputs = create_mock_outputs(image, polygons_list)
+        set_attributes(coalesced=coalesced, image_bytes=len(image_bytes), bubble_count=len(result["bubbles"]))
 
         
 
-        # Extraire et traduire le texte depuis l'image originale
+        # Mettre à jour les statistiques (écriture différée, en lot), sauf pour une soumission en double
+
+        if not coalesced:
 
-        from processing.translate_bubbles import extract_and_translate
+            processing_time = time.time() - start_time
 
-        translations = extract_and_translate(image, mock_outputs)
+            usage_accumulator.record_retreatment(current_user.id, processing_time)
 
         
 
-        # Nettoyer l'image avec les polygones personnalisés
+        return JSONResponse(content={**result, "quota_status": quota_status}, headers=timing.header())
 
-        from processing.clean_bubbles import clean_bubbles
+        
 
-        cleaned_image = clean_bubbles(image, mock_outputs)
+    except HTTPException:
 
-        
+        raise
 
-        # Convertir l'image nettoyée en base64 (sans texte)
+    except Exception as e:
 
-        _, cleaned_buffer = cv2.imencode('.png', cleaned_image)
+        logger.exception(f"Erreur lors du retraitement: {e}")
 
-        cleaned_base64 = base64.b64encode(cleaned_buffer.tobytes()).decode('utf-8')
+        return JSONResponse(content={"error": f"Erreur lors du retraitement: {str(e)}"}, status_code=500)
 
-        
 
-        # Réinsérer le texte traduit
 
-        if translations:
+def retreat_pipeline(image, polygons_list, spans=None):
 
-            final_image = draw_translated_text(cleaned_image, translations)
+    """Nettoyage, traduction et réinsertion avec des polygones de bulles fournis par l'utilisateur"""
 
-        else:
+    origin = time.perf_counter()
 
-            final_image = cleaned_image
+    # Créer les outputs simulés pour le nettoyage
 
-        
+    from processing.bubble_editor import create_mock_outputs
 
-        # Convertir l'image finale en base64 (avec texte)
+    mock_outputs = create_mock_outputs(image, polygons_list)
 
-        _, final_buffer = cv2.imencode('.png', final_image)
+    
 
-        final_base64 = base64.b64encode(final_buffer.tobytes()).decode('utf-8')
+    # Extraire et traduire le texte depuis l'image originale
 
-        
+    from processing.translate_bubbles import extract_texts, translate
 
-        # Mettre à jour les statistiques
+    with measure(spans, "ocr", origin):
 
-        processing_time = time.time() - start_time
+        translations = extract_texts(image, mock_outputs)
 
-        crud.update_usage_stats(db, current_user.id, 1, processing_time)
+    with measure(spans, "translate", origin):
 
-        
+        for bubble in translations:
 
-        # Incrémenter le compteur de retraitements pour cette image spécifique
+            bubble["translated_text"] = translate(bubble["ocr_text"])
 
-        crud.increment_image_retreatment(db, current_user.id, image_hash)
+    
 
-        
+    # Nettoyer l'image avec les polygones personnalisés
 
-        return JSONResponse(content={
+    from processing.clean_bubbles import clean_bubbles
 
-            "image_base64": final_base64,
+    with measure(spans, "clean", origin):
 
-            "cleaned_base64": cleaned_base64,
+        cleaned_image = clean_bubbles(image, mock_outputs)
 
-            "bubbles": translations,
+    
 
-            "quota_status": quota_status
+    # Convertir l'image nettoyée en base64 (sans texte)
 
-        })
+    with measure(spans, "encode", origin):
 
-        
+        _, cleaned_buffer = cv2.imencode('.png', cleaned_image)
 
-    except Exception as e:
+    cleaned_base64 = base64.b64encode(cleaned_buffer.tobytes()).decode('utf-8')
 
-        import traceback
+    
 
-        error_details = traceback.format_exc()
+    # Réinsérer le texte traduit
 
-        print(f"Erreur détaillée: {error_details}")
+    with measure(spans, "render", origin):
 
-        return JSONResponse(content={"error": f"Erreur lors du retraitement: {str(e)}"}, status_code=500)
+        if translations:
+
+            final_image = draw_translated_text(cleaned_image, translations)
+
+        else:
+
+            final_image = cleaned_image
+
+    
+
+    # Convertir l'image finale en base64 (avec texte)
+
+    with measure(spans, "encode", origin):
+
+        _, final_buffer = cv2.imencode('.png', final_image)
+
+    final_base64 = base64.b64encode(final_buffer.tobytes()).decode('utf-8')
+
+    
+
+    return {
+
+        "image_base64": final_base64,
+
+        "cleaned_base64": cleaned_base64,
+
+        "bubbles": translations
+
+    }
 
 
 
@@ -498,11 +1033,15 @@ async def reinsert_text(
 
     """Prend une image + une liste de bulles (JSON) et retourne l'image avec le texte réinséré dans chaque bulle."""
 
-    image_bytes = await file.read()
+    try:
+
+        image_bytes = await read_image_upload(file)
+
+    except ImageRejected as e:
 
-    nparr = np.frombuffer(image_bytes, np.uint8)
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
 
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    image = decode_image(image_bytes)
 
     if image is None:
 
@@ -528,6 +1067,159 @@ async def reinsert_text(
 
 
 
+# ==================== ÉTAPES DU PIPELINE (À LA CARTE) ====================
+
+
+
+async def read_stage_image(file: UploadFile, timing: RequestTiming):
+    """Lit et décode l'image d'une route par étape, à sa taille d'origine (coordonnées des détections)"""
+    try:
+        with timing.span("upload"):
+            image_bytes = await read_image_upload(file)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    with timing.span("decode"):
+        image = decode_image(image_bytes)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Image illisible")
+    return image
+
+def parse_stage_input(parser, raw):
+    try:
+        return parser(raw)
+    except StageInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def charge_stages(db: AsyncSession, current_user: schemas.User, timing: RequestTiming, *stages):
+    """Débite le coût cumulé des étapes exécutées (fraction de crédit) ; 429 si le quota est épuisé"""
+    cost = sum(STAGE_COSTS[stage] for stage in stages)
+    if cost <= 0:
+        return None
+    quota_admission.remember(current_user.email, current_user.id)
+    with timing.span("quota"):
+        quota_status = await quota_admission.charge_partial(db, current_user.id, cost)
+    if not quota_status["can_process"]:
+        raise HTTPException(status_code=429, detail=quota_status["message"])
+    return quota_status
+
+def require_models(*models):
+    """503 si le profil du worker (WORKER_PROFILE) exclut l'un des modèles"""
+    if not model_loader.allows(*models):
+        raise HTTPException(status_code=503, detail=unavailable_message(*models),
+                            headers={"X-Worker-Profile": model_loader.get_profile()})
+
+async def run_stage(timing: RequestTiming, func, *args):
+    try:
+        result, spans = await run_pipeline_timed(func, *args)
+    except model_loader.ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"X-Worker-Profile": model_loader.get_profile()})
+    except Exception as e:
+        logger.error(f"Erreur lors de l'étape {func.__name__}: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors du traitement: {str(e)}")
+    timing.add(spans)
+    return result
+
+@app.post("/stages/detect")
+async def stage_detect(
+    file: UploadFile = File(...),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Détection seule : polygones des bulles, réutilisables par /stages/clean et /stages/ocr"""
+    timing = RequestTiming()
+    image = await read_stage_image(file, timing)
+    quota_status = await charge_stages(db, current_user, timing, "detect")
+    _, detections = await run_stage(timing, detect_stage, image)
+    height, width = image.shape[:2]
+    return JSONResponse(
+        content={"detections": detections, "width": width, "height": height, "quota_status": quota_status},
+        headers=timing.header()
+    )
+
+@app.post("/stages/clean")
+async def stage_clean(
+    file: UploadFile = File(...),
+    detections: str = Form(None),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Nettoyage seul (sans OCR ni traduction) ; la détection n'est exécutée que si `detections` est absent"""
+    timing = RequestTiming()
+    image = await read_stage_image(file, timing)
+    detections_list = parse_stage_input(parse_detections, detections) if detections is not None else None
+    stages = ("clean",) if detections_list is not None else ("detect", "clean")
+    if detections_list is None:
+        require_models("detectron2")
+    quota_status = await charge_stages(db, current_user, timing, *stages)
+    cleaned_png, detections_list = await run_stage(timing, clean_stage, image, detections_list)
+    return JSONResponse(content={
+        "cleaned_base64": base64.b64encode(cleaned_png).decode('utf-8'),
+        "detections": detections_list,
+        "quota_status": quota_status
+    }, headers=timing.header())
+
+@app.post("/stages/ocr")
+async def stage_ocr(
+    file: UploadFile = File(...),
+    detections: str = Form(None),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """OCR seul sur l'image d'origine ; la détection n'est exécutée que si `detections` est absent"""
+    timing = RequestTiming()
+    image = await read_stage_image(file, timing)
+    detections_list = parse_stage_input(parse_detections, detections) if detections is not None else None
+    stages = ("ocr",) if detections_list is not None else ("detect", "ocr")
+    if detections_list is None:
+        require_models("detectron2")
+    quota_status = await charge_stages(db, current_user, timing, *stages)
+    bubbles, detections_list = await run_stage(timing, ocr_stage, image, detections_list)
+    return JSONResponse(
+        content={"bubbles": bubbles, "detections": detections_list, "quota_status": quota_status},
+        headers=timing.header()
+    )
+
+@app.post("/stages/translate")
+async def stage_translate(
+    bubbles: str = Form(...),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Traduction seule des bulles issues de /stages/ocr (aucune image envoyée)"""
+    timing = RequestTiming()
+    bubbles_list = parse_stage_input(parse_bubbles, bubbles)
+    quota_status = await charge_stages(db, current_user, timing, "translate")
+    spans = []
+    try:
+        # Appels réseau uniquement : pas de place de pipeline réservée
+        bubbles_list = await run_in_threadpool(translate_stage, bubbles_list, spans)
+    except Exception as e:
+        logger.error(f"Erreur lors de la traduction: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la traduction: {str(e)}")
+    observe_spans(spans)
+    timing.add(spans)
+    return JSONResponse(content={"bubbles": bubbles_list, "quota_status": quota_status}, headers=timing.header())
+
+@app.post("/stages/render")
+async def stage_render(
+    file: UploadFile = File(...),
+    bubbles: str = Form(...),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Réinsertion seule du texte traduit dans l'image nettoyée envoyée"""
+    timing = RequestTiming()
+    image = await read_stage_image(file, timing)
+    bubbles_list = parse_stage_input(parse_bubbles, bubbles)
+    quota_status = await charge_stages(db, current_user, timing, "render")
+    final_png = await run_stage(timing, render_stage, image, bubbles_list)
+    return JSONResponse(
+        content={"image_base64": base64.b64encode(final_png).decode('utf-8'), "quota_status": quota_status},
+        headers=timing.header()
+    )
+
+
+
 # ==================== ROUTE DE SANTÉ ====================
 
 
@@ -545,22 +1237,169 @@ async def health_check():
     return {
         "status": "healthy", 
         "message": "Bubble Cleaner API is running",
-        "detectron2": detectron_status
+        "detectron2": detectron_status,
+        "worker_profile": model_loader.get_profile(),
+        "models_loaded": model_loader.get_status(),
+        "database_pool": get_pool_status(),
+        "usage_accounting": usage_accumulator.get_stats(),
+        "admission": quota_admission.get_stats(),
+        "maintenance": maintenance_worker.last_report,
+        "email_outbox": email_outbox.get_stats(),
+        "single_flight": single_flight.get_stats()
     }
 
 
 
+# ==================== MÉTRIQUES ====================
+
+
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def collect_service_metrics():
+    """Compteurs des autres services, lus à chaque collecte de /metrics"""
+    cache = profile_cache.get_stats()
+    admission = quota_admission.get_stats()
+    flights = single_flight.get_stats()
+    pool = get_pool_status()
+    outbox = email_outbox.get_stats()
+    usage = usage_accumulator.get_stats()
+    traces = trace_exporter.get_stats()
+    recordings = flight_recorder.get_stats()
+    # Modèles déjà chargés dans ce worker (processing/model_loader.py)
+    load_times = dict(model_loader.model_load_seconds)
+    return [
+        ("bubble_pipeline_queue_depth", "gauge", "Pipelines en attente d'une place ou en cours",
+         [({"state": "waiting"}, pipeline_queue["waiting"]), ({"state": "running"}, pipeline_queue["running"])]),
+        ("bubble_pipeline_slots", "gauge", "Pipelines exécutables en parallèle (PIPELINE_MAX_CONCURRENCY)",
+         [({}, PIPELINE_MAX_CONCURRENCY)]),
+        ("bubble_profile_cache_requests_total", "counter", "Lectures du cache du profil",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("bubble_quota_admissions_total", "counter", "Admissions de quota, locales (bail) ou synchronisées en base",
+         [({"source": "local"}, admission["local_admissions"]), ({"source": "db"}, admission["db_syncs"])]),
+        ("bubble_admission_rejections_total", "counter", "Requêtes rejetées avant lecture du fichier",
+         [({"reason": "rate"}, admission["rejected_rate"]), ({"reason": "quota"}, admission["rejected_quota"])]),
+        ("bubble_single_flight_requests_total", "counter", "Requêtes de traitement par issue de la déduplication",
+         [({"result": "computed"}, flights["computations"]), ({"result": "coalesced"}, flights["coalesced_requests"]),
+          ({"result": "shared"}, flights["shared_requests"])]),
+        ("bubble_single_flight_in_flight", "gauge", "Calculs en cours", [({}, flights["in_flight"])]),
+        ("bubble_db_pool_checkouts_total", "counter", "Connexions obtenues du pool", [({}, pool["checkouts"])]),
+        ("bubble_db_pool_checkout_timeouts_total", "counter", "Attentes du pool expirées", [({}, pool["checkout_timeouts"])]),
+        ("bubble_db_pool_checked_out", "gauge", "Connexions du pool en cours d'utilisation", [({}, pool.get("checked_out"))]),
+        ("bubble_emails_total", "counter", "Emails de l'outbox par issue",
+         [({"result": "sent"}, outbox["sent"]), ({"result": "retried"}, outbox["retried"]), ({"result": "dead"}, outbox["dead"])]),
+        ("bubble_usage_pending_users", "gauge", "Utilisateurs dont les statistiques attendent l'écriture en lot",
+         [({}, usage["pending_users"])]),
+        ("bubble_model_load_seconds", "gauge", "Temps de chargement des modèles",
+         [({"model": name}, seconds) for name, seconds in load_times.items()]),
+        ("bubble_worker_profile", "gauge", "Profil du worker (WORKER_PROFILE)", [({"profile": model_loader.get_profile()}, 1)]),
+        ("bubble_trace_spans_exported_total", "counter", "Spans de trace exportés", [({}, traces["exported_spans"])]),
+        ("bubble_trace_export_failures_total", "counter", "Traces perdues (file pleine) ou écritures échouées",
+         [({"reason": "dropped"}, traces["dropped_traces"]), ({"reason": "write"}, traces["failed_writes"])]),
+        ("bubble_flight_recordings_total", "counter", "Requêtes enregistrées par l'enregistreur de vol, par issue",
+         [({"result": "saved"}, recordings["saved"]), ({"result": "discarded"}, recordings["discarded"]),
+          ({"result": "failed"}, recordings["failed_writes"])]),
+    ]
+
+metrics.register_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint(authorization: str = Header(None)):
+    """Métriques au format texte Prometheus (protégées par METRICS_TOKEN s'il est défini)"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Token de métriques invalide")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ==================== ENREGISTREUR DE VOL ====================
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(authorization: str = Header(None)):
+    """Routes d'administration : désactivées sans ADMIN_TOKEN, sinon protégées par ce token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administration désactivée (ADMIN_TOKEN non défini)")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Token d'administration invalide")
+
+def flight_recording_path(recording_id: str, suffix: str = ".json"):
+    try:
+        path = flight_recorder.path(recording_id, suffix)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Enregistrement introuvable")
+    return path
+
+@app.get("/admin/flight-recorder", dependencies=[Depends(require_admin)])
+async def list_flight_recordings():
+    """État de l'enregistreur de vol et enregistrements conservés (sans les piles)"""
+    recordings = await run_in_threadpool(flight_recorder.list_recordings)
+    return {"recorder": flight_recorder.get_stats(), "recordings": recordings}
+
+@app.post("/admin/flight-recorder", dependencies=[Depends(require_admin)])
+async def arm_flight_recorder(arm: schemas.FlightRecorderArm):
+    """Arme l'enregistreur : prochaines requêtes, seuil des requêtes lentes, capture des entrées"""
+    return flight_recorder.arm(requests=arm.requests, slow_ms=arm.slow_ms, capture_input=arm.capture_input)
+
+@app.get("/admin/flight-recorder/{recording_id}", dependencies=[Depends(require_admin)])
+async def get_flight_recording(recording_id: str, format: str = "json"):
+    """Enregistrement complet (json) ou piles repliées pour flamegraph.pl / speedscope (folded)"""
+    flight_recording_path(recording_id)
+    record = await run_in_threadpool(flight_recorder.load, recording_id)
+    if format == "folded":
+        return Response(content=folded(record), media_type="text/plain")
+    return record
+
+@app.get("/admin/flight-recorder/{recording_id}/input", dependencies=[Depends(require_admin)])
+async def get_flight_recording_input(recording_id: str):
+    """Corps de la requête enregistrée (si FLIGHT_RECORDER_CAPTURE_INPUT), pour la rejouer"""
+    return FileResponse(flight_recording_path(recording_id, ".input"), media_type="application/octet-stream",
+                        filename=f"{recording_id}.input")
+
+
+
+@app.get("/health/db-pool")
+async def db_pool_status():
+    """Utilisation du pool de connexions et temps d'attente de checkout"""
+    return get_pool_status()
+
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Démarre l'écriture différée des statistiques, la restitution des baux de quotas, la maintenance, l'envoi des emails et le préchargement des modèles"""
+    usage_accumulator.start()
+    quota_admission.start()
+    maintenance_worker.start()
+    email_outbox.start()
+    if PRELOAD_MODELS:
+        asyncio.get_running_loop().run_in_executor(None, model_loader.preload)
+
+
+
+@app.on_event("shutdown")
+async def close_database_pool():
+    """Écrit les statistiques en attente, rend les crédits réservés puis ferme les connexions du pool async"""
+    await maintenance_worker.stop()
+    await email_outbox.stop()
+    await usage_accumulator.stop()
+    await quota_admission.stop()
+    await async_engine.dispose()
+    await run_in_threadpool(trace_exporter.shutdown)
+
+
+
 # ==================== ROUTES DE GESTION DES UTILISATEURS ====================
 
 
 
 @app.post("/forgot-password")
 
-async def forgot_password(request: schemas.ForgotPassword, db: Session = Depends(get_db)):
+async def forgot_password(request: schemas.ForgotPassword, db: AsyncSession = Depends(get_async_db)):
 
     """Demande de récupération de mot de passe"""
 
-    user = crud.get_user_by_email(db, email=request.email)
+    user = await async_crud.get_user_by_email(db, email=request.email)
 
     if not user:
 
@@ -582,7 +1421,7 @@ async def forgot_password(request: schemas.ForgotPassword, db: Session = Depends
 
     # Créer le token en base
 
-    crud.create_password_reset_token(db, user.id, token, expires_at)
+    await async_crud.create_password_reset_token(db, user.id, token, expires_at)
 
     
 
@@ -594,55 +1433,31 @@ async def forgot_password(request: schemas.ForgotPassword, db: Session = Depends
 
     
 
-    # Envoyer l'email de récupération
-
-    email_sent = await send_password_reset_email(
+    # Mettre l'email de récupération dans la file d'envoi (réessayé en arrière-plan si le SMTP échoue)
 
-        email=user.email,
+    subject, body = render_password_reset_email(user.username, reset_url)
 
-        username=user.username,
+    await enqueue_email(db, user.email, subject, body, kind="password_reset")
 
-        reset_token=token,
+    if os.getenv("ENVIRONMENT") == "development":
 
-        reset_url=reset_url
-
-    )
+        logger.info(f"Lien de récupération (développement) : {reset_url}")
 
     
 
-    if email_sent:
-
-        return {"message": "Email de récupération envoyé. Vérifiez votre boîte mail."}
-
-    else:
-
-        # En cas d'échec d'envoi, on peut retourner le lien directement (pour le développement)
-
-        if os.getenv("ENVIRONMENT") == "development":
-
-            return {
-
-                "message": "Erreur lors de l'envoi de l'email. Lien de récupération (développement uniquement):",
-
-                "reset_url": reset_url
-
-            }
-
-        else:
-
-            raise HTTPException(status_code=500, detail="Erreur lors de l'envoi de l'email")
+    return {"message": "Email de récupération envoyé. Vérifiez votre boîte mail."}
 
 
 
 @app.post("/reset-password")
 
-async def reset_password(request: schemas.ResetPassword, db: Session = Depends(get_db)):
+async def reset_password(request: schemas.ResetPassword, db: AsyncSession = Depends(get_async_db)):
 
     """Réinitialisation du mot de passe avec un token"""
 
     # Vérifier le token
 
-    reset_token = crud.get_password_reset_token(db, request.token)
+    reset_token = await async_crud.get_password_reset_token(db, request.token)
 
     if not reset_token:
 
@@ -658,7 +1473,7 @@ async def reset_password(request: schemas.ResetPassword, db: Session = Depends(g
 
     # Mettre à jour le mot de passe
 
-    user = crud.update_user_password(db, reset_token.user_id, new_hashed_password)
+    user = await async_crud.update_user_password(db, reset_token.user_id, new_hashed_password)
 
     if not user:
 
@@ -668,13 +1483,13 @@ async def reset_password(request: schemas.ResetPassword, db: Session = Depends(g
 
     # Marquer le token comme utilisé
 
-    crud.mark_password_reset_token_used(db, request.token)
+    await async_crud.mark_password_reset_token_used(db, request.token)
 
     
 
     # Désactiver toutes les sessions de l'utilisateur
 
-    crud.deactivate_all_user_sessions(db, user.id)
+    await async_crud.deactivate_all_user_sessions(db, user.id)
 
     
 
@@ -690,7 +1505,7 @@ async def change_password(
 
     current_user: schemas.User = Depends(get_current_active_user),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -712,7 +1527,7 @@ async def change_password(
 
     # Mettre à jour le mot de passe
 
-    user = crud.update_user_password(db, current_user.id, new_hashed_password)
+    user = await async_crud.update_user_password(db, current_user.id, new_hashed_password)
 
     if not user:
 
@@ -722,7 +1537,7 @@ async def change_password(
 
     # Désactiver toutes les sessions de l'utilisateur
 
-    crud.deactivate_all_user_sessions(db, current_user.id)
+    await async_crud.deactivate_all_user_sessions(db, current_user.id)
 
     
 
@@ -738,7 +1553,7 @@ async def change_username(
 
     current_user: schemas.User = Depends(get_current_active_user),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -754,7 +1569,7 @@ async def change_username(
 
     # Vérifier si le nouveau username existe déjà
 
-    existing_user = crud.get_user_by_username(db, request.new_username)
+    existing_user = await async_crud.get_user_by_username(db, request.new_username)
 
     if existing_user and existing_user.id != current_user.id:
 
@@ -764,12 +1579,14 @@ async def change_username(
 
     # Mettre à jour le username
 
-    user = crud.update_user_username(db, current_user.id, request.new_username)
+    user = await async_crud.update_user_username(db, current_user.id, request.new_username)
 
     if not user:
 
         raise HTTPException(status_code=400, detail="Erreur lors de la mise à jour")
 
+    profile_cache.invalidate(current_user.id)
+
     
 
     return {"message": "Nom d'utilisateur mis à jour avec succès", "new_username": request.new_username}
@@ -784,7 +1601,7 @@ async def change_email(
 
     current_user: schemas.User = Depends(get_current_active_user),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -800,7 +1617,7 @@ async def change_email(
 
     # Vérifier si le nouveau email existe déjà
 
-    existing_user = crud.get_user_by_email(db, request.new_email)
+    existing_user = await async_crud.get_user_by_email(db, request.new_email)
 
     if existing_user and existing_user.id != current_user.id:
 
@@ -810,12 +1627,14 @@ async def change_email(
 
     # Mettre à jour l'email
 
-    user = crud.update_user_email(db, current_user.id, request.new_email)
+    user = await async_crud.update_user_email(db, current_user.id, request.new_email)
 
     if not user:
 
         raise HTTPException(status_code=400, detail="Erreur lors de la mise à jour")
 
+    profile_cache.invalidate(current_user.id)
+
     
 
     return {"message": "Email mis à jour avec succès", "new_email": request.new_email}
@@ -824,12 +1643,12 @@ async def change_email(
 
 @app.delete("/logout")
 
-async def logout(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def logout(current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
 
     """Déconnexion de l'utilisateur"""
 
     # Désactiver toutes les sessions de l'utilisateur
 
-    crud.deactivate_all_user_sessions(db, current_user.id)
+    await async_crud.deactivate_all_user_sessions(db, current_user.id)
 
     return {"message": "Déconnexion réussie"} 
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""unique_user_image_retreatment
+
+Revision ID: 83629c2d28f3
+Revises: 7be0be920e30
+Create Date: 2026-10-19 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '83629c2d28f3'
+down_revision: Union[str, Sequence[str], None] = '7be0be920e30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Fusionner les doublons (user_id, image_hash) créés par la course entre lecture et insertion :
+    # la ligne la plus ancienne reçoit la somme des compteurs, les autres sont supprimées
+    op.execute("UPDATE image_retreatments SET retreatment_count = 0 WHERE retreatment_count IS NULL")
+    op.execute("""
+        WITH agg AS (
+            SELECT user_id, image_hash, MIN(id) AS keep_id,
+                   SUM(retreatment_count) AS total, MAX(last_retreatment) AS last_at
+            FROM image_retreatments
+            GROUP BY user_id, image_hash
+            HAVING COUNT(*) > 1
+        )
+        UPDATE image_retreatments AS r
+        SET retreatment_count = agg.total, last_retreatment = agg.last_at
+        FROM agg
+        WHERE r.id = agg.keep_id
+    """)
+    op.execute("""
+        DELETE FROM image_retreatments AS r
+        USING image_retreatments AS k
+        WHERE r.user_id = k.user_id AND r.image_hash = k.image_hash AND r.id > k.id
+    """)
+
+    # Remplacer l'index non unique par une contrainte unique (cible de l'ON CONFLICT)
+    op.execute("DROP INDEX IF EXISTS idx_user_image")
+    op.alter_column('image_retreatments', 'retreatment_count',
+                    existing_type=sa.Integer(), nullable=False, server_default='0')
+    op.create_unique_constraint('uq_image_retreatments_user_image', 'image_retreatments', ['user_id', 'image_hash'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_image_retreatments_user_image', 'image_retreatments', type_='unique')
+    op.alter_column('image_retreatments', 'retreatment_count',
+                    existing_type=sa.Integer(), nullable=True, server_default=None)
+    op.create_index('idx_user_image', 'image_retreatments', ['user_id', 'image_hash'], unique=False)
@@ -0,0 +1,91 @@
+"""hot_path_indexes_and_constraints
+
+Revision ID: d01bc5c46f79
+Revises: 83629c2d28f3
+Create Date: 2026-10-19 14:03:27.918344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd01bc5c46f79'
+down_revision: Union[str, Sequence[str], None] = '83629c2d28f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # === usage_stats : fusionner les doublons par utilisateur (somme des compteurs) ===
+    op.execute("""
+        WITH agg AS (
+            SELECT user_id, MIN(id) AS keep_id,
+                   SUM(COALESCE(images_processed, 0)) AS images,
+                   SUM(COALESCE(total_processing_time, 0)) AS total_time,
+                   SUM(COALESCE(retreatment_count, 0)) AS retreatments,
+                   MAX(last_activity) AS last_at,
+                   MIN(created_at) AS first_at
+            FROM usage_stats
+            GROUP BY user_id
+            HAVING COUNT(*) > 1
+        )
+        UPDATE usage_stats AS s
+        SET images_processed = agg.images, total_processing_time = agg.total_time,
+            retreatment_count = agg.retreatments, last_activity = agg.last_at, created_at = agg.first_at
+        FROM agg
+        WHERE s.id = agg.keep_id
+    """)
+    op.execute("""
+        DELETE FROM usage_stats AS s
+        USING usage_stats AS k
+        WHERE s.user_id = k.user_id AND s.id > k.id
+    """)
+    op.create_index('uq_usage_stats_user_id', 'usage_stats', ['user_id'], unique=True)
+
+    # === user_quotas : fusionner les doublons par (utilisateur, type) ===
+    # On garde la consommation la plus élevée pour ne jamais rendre de crédits à tort
+    op.execute("""
+        WITH agg AS (
+            SELECT user_id, quota_type, MIN(id) AS keep_id,
+                   MAX(COALESCE(used_value, 0)) AS used, MAX(reset_date) AS reset_at
+            FROM user_quotas
+            GROUP BY user_id, quota_type
+            HAVING COUNT(*) > 1
+        )
+        UPDATE user_quotas AS q
+        SET used_value = agg.used, reset_date = agg.reset_at
+        FROM agg
+        WHERE q.id = agg.keep_id
+    """)
+    op.execute("""
+        DELETE FROM user_quotas AS q
+        USING user_quotas AS k
+        WHERE q.user_id = k.user_id AND q.quota_type = k.quota_type AND q.id > k.id
+    """)
+    op.create_index('uq_user_quotas_user_type', 'user_quotas', ['user_id', 'quota_type'], unique=True)
+
+    # === user_sessions / password_resets : index partiels et index de purge ===
+    op.create_index('idx_user_sessions_active_user', 'user_sessions', ['user_id'],
+                    postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active = 1'))
+    op.create_index('idx_user_sessions_expires_at', 'user_sessions', ['expires_at'])
+    op.create_index('idx_password_resets_unused_user', 'password_resets', ['user_id'],
+                    postgresql_where=sa.text('NOT is_used'), sqlite_where=sa.text('is_used = 0'))
+    op.create_index('idx_password_resets_expires_at', 'password_resets', ['expires_at'])
+
+    # === image_retreatments : purge par ancienneté ===
+    op.create_index('idx_image_retreatments_last_retreatment', 'image_retreatments', ['last_retreatment'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_image_retreatments_last_retreatment', table_name='image_retreatments')
+    op.drop_index('idx_password_resets_expires_at', table_name='password_resets')
+    op.drop_index('idx_password_resets_unused_user', table_name='password_resets')
+    op.drop_index('idx_user_sessions_expires_at', table_name='user_sessions')
+    op.drop_index('idx_user_sessions_active_user', table_name='user_sessions')
+    op.drop_index('uq_user_quotas_user_type', table_name='user_quotas')
+    op.drop_index('uq_usage_stats_user_id', table_name='usage_stats')
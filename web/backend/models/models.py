@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from database.database import Base
 
 class User(Base):
@@ -34,6 +34,11 @@ class UsageStats(Base):
     
     # Relations
     user = relationship("User", back_populates="usage_stats")
+    
+    # Une seule ligne de statistiques par utilisateur (cible de l'upsert des statistiques différées)
+    __table_args__ = (
+        Index('uq_usage_stats_user_id', 'user_id', unique=True),
+    )
 
 class UserQuota(Base):
     __tablename__ = "user_quotas"
@@ -48,6 +53,11 @@ class UserQuota(Base):
     
     # Relations
     user = relationship("User", back_populates="quotas")
+    
+    # Un seul quota par (utilisateur, type) : lookup en une sonde d'index
+    __table_args__ = (
+        Index('uq_user_quotas_user_type', 'user_id', 'quota_type', unique=True),
+    )
 
 class UserSession(Base):
     __tablename__ = "user_sessions"
@@ -63,6 +73,13 @@ class UserSession(Base):
     
     # Relations
     user = relationship("User", back_populates="sessions")
+    
+    # Index partiel : seules les sessions actives sont recherchées par utilisateur
+    __table_args__ = (
+        Index('idx_user_sessions_active_user', 'user_id',
+              postgresql_where=text('is_active'), sqlite_where=text('is_active = 1')),
+        Index('idx_user_sessions_expires_at', 'expires_at'),
+    )
 
 class ImageRetreatment(Base):
     __tablename__ = "image_retreatments"
@@ -70,16 +87,17 @@ class ImageRetreatment(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     image_hash = Column(String, nullable=False)  # Hash de l'image pour l'identifier
-    retreatment_count = Column(Integer, default=0)
+    retreatment_count = Column(Integer, default=0, server_default="0", nullable=False)
     last_retreatment = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relations
     user = relationship("User")
     
-    # Index composite pour optimiser les requêtes
+    # Clé unique composite : sert aussi de cible à l'upsert de check_and_increment_image_retreatment
     __table_args__ = (
-        Index('idx_user_image', 'user_id', 'image_hash'),
+        UniqueConstraint('user_id', 'image_hash', name='uq_image_retreatments_user_image'),
+        Index('idx_image_retreatments_last_retreatment', 'last_retreatment'),
     )
 
 class PasswordReset(Base):
@@ -93,4 +111,32 @@ class PasswordReset(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relations
-    user = relationship("User", back_populates="password_resets") 
\ No newline at end of file
+    user = relationship("User", back_populates="password_resets")
+    
+    __table_args__ = (
+        # Index partiel : invalidation des tokens non utilisés d'un utilisateur
+        Index('idx_password_resets_unused_user', 'user_id',
+              postgresql_where=text('NOT is_used'), sqlite_where=text('is_used = 0')),
+        Index('idx_password_resets_expires_at', 'expires_at'),
+    )
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # 'welcome', 'password_reset'
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending", server_default="pending")  # 'pending', 'sending', 'sent', 'dead'
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        # L'expéditeur ne lit que les emails à (ré)envoyer, par date d'échéance
+        Index('idx_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
@@ -3,7 +3,6 @@ import numpy as np
 import logging
 from .clean_bubbles import predictor
 from .translate_bubbles import extract_and_translate
-import torch
 
 logger = logging.getLogger(__name__)
 
@@ -38,9 +37,9 @@ def simplify_polygon(points, target_points=8):
     
     return simplified
 
-def mask_to_polygon(mask):
+def mask_to_polygon(mask, target_points=8):
     """
-    Convertit un masque binaire en polygone simplifié
+    Convertit un masque binaire en polygone simplifié (contour complet si target_points est None)
     """
     # Trouver les contours du masque
     contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -51,8 +50,8 @@ def mask_to_polygon(mask):
     # Prendre le plus grand contour
     largest_contour = max(contours, key=cv2.contourArea)
     
-    # Simplifier le polygone à 8 points
-    simplified = simplify_polygon(largest_contour, 8)
+    # Simplifier le polygone (8 points par défaut, pour l'éditeur)
+    simplified = simplify_polygon(largest_contour, target_points) if target_points else largest_contour
     
     # Convertir en format liste de points
     points = []
@@ -113,6 +112,7 @@ def create_mock_outputs(image, custom_polygons):
     Crée un objet outputs simulé à partir de polygones personnalisés
     pour être compatible avec les fonctions existantes
     """
+    import torch  # chargé au premier retraitement, pas à l'import de processing
     height, width = image.shape[:2]
     masks = []
     classes = []
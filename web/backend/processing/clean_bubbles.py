@@ -1,53 +1,13 @@
-import os
 import cv2
-import torch
 import numpy as np
 import logging
-from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
-from detectron2 import model_zoo
+
+# Détecteur Detectron2 chargé au premier appel (processing/model_loader.py)
+from .model_loader import predictor
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
 
-# === CONFIGURATION DES CHEMINS ===
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
-
-cfg = get_cfg()
-cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-
-# Essayer de charger le modèle local, sinon utiliser le modèle par défaut
-model_path = os.path.join(PROJECT_DIR, "models_ai", "model_final.pth")
-if os.path.exists(model_path):
-    try:
-        cfg.MODEL.WEIGHTS = model_path
-        logger.info(f"Chargement du modèle local: {model_path}")
-        print(f"✅ Modèle local chargé: {model_path}")
-    except Exception as e:
-        logger.warning(f"Erreur lors du chargement du modèle local: {e}")
-        print(f"⚠️  Erreur modèle local: {e}")
-        cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-        logger.info("Utilisation du modèle par défaut Detectron2")
-        print("🔄 Utilisation du modèle par défaut Detectron2")
-else:
-    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-    logger.info("Modèle local non trouvé, utilisation du modèle par défaut Detectron2")
-    print("🔄 Modèle local non trouvé, utilisation du modèle par défaut")
-
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
-cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3  # bubble, floating_text, narration_box
-cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-
-try:
-    predictor = DefaultPredictor(cfg)
-    logger.info("Modèle Detectron2 chargé avec succès")
-    print("✅ Modèle Detectron2 chargé avec succès")
-except Exception as e:
-    logger.error(f"Erreur lors du chargement du modèle: {e}")
-    print(f"❌ Erreur chargement modèle: {e}")
-    predictor = None
-
 # === PARAMÈTRES DE NETTOYAGE ===
 FILL_COLOR = (255, 255, 255)  # Blanc
 
@@ -0,0 +1,397 @@
+"""
+Enregistreur de vol : profil échantillonné de requêtes de traitement en production, sans attacher
+de profileur au conteneur.
+
+- Sélection : les N prochaines requêtes (FLIGHT_RECORDER_NEXT au démarrage, ou POST /admin/flight-recorder)
+  et/ou celles plus lentes que FLIGHT_RECORDER_SLOW_MS (toutes profilées, conservées seulement si lentes).
+- Pendant une requête enregistrée, un thread relève toutes les FLIGHT_RECORDER_INTERVAL_MS ms la pile des
+  threads qui travaillent pour elle : pipeline et étapes du graphe, traductions (rattachés via
+  tracing.propagate) et boucle d'événements (où les piles des autres requêtes en cours peuvent apparaître).
+  Les piles sont agrégées au format « replié » des flamegraphs (flamegraph.pl, speedscope).
+- Chaque enregistrement garde aussi les durées des étapes (Server-Timing), le statut, les métadonnées
+  (taille de l'envoi, nombre de bulles... via tracing.set_attributes) et l'identifiant de trace ; le corps
+  de la requête seulement avec FLIGHT_RECORDER_CAPTURE_INPUT=1. Les FLIGHT_RECORDER_MAX_RECORDS
+  derniers sont gardés dans FLIGHT_RECORDER_DIR (anneau : les plus anciens sont supprimés).
+
+    python -m processing.flight_recorder flight_recordings                       # enregistrements
+    python -m processing.flight_recorder flight_recordings --show <id>           # fonctions les plus vues
+    python -m processing.flight_recorder flight_recordings --folded <id> > r.folded   # flamegraph.pl, speedscope
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+FLIGHT_RECORDER_DIR = os.getenv("FLIGHT_RECORDER_DIR", "flight_recordings")
+FLIGHT_RECORDER_MAX_RECORDS = int(os.getenv("FLIGHT_RECORDER_MAX_RECORDS", "50"))
+FLIGHT_RECORDER_INTERVAL_MS = float(os.getenv("FLIGHT_RECORDER_INTERVAL_MS", "5"))
+FLIGHT_RECORDER_NEXT = int(os.getenv("FLIGHT_RECORDER_NEXT", "0"))
+FLIGHT_RECORDER_SLOW_MS = float(os.getenv("FLIGHT_RECORDER_SLOW_MS", "0"))  # 0 : désactivé
+FLIGHT_RECORDER_CAPTURE_INPUT = os.getenv("FLIGHT_RECORDER_CAPTURE_INPUT", "0").lower() in ("1", "true", "yes")
+FLIGHT_RECORDER_MAX_INPUT_BYTES = int(os.getenv("FLIGHT_RECORDER_MAX_INPUT_BYTES", str(20 * 1024 * 1024)))
+FLIGHT_RECORDER_MAX_DEPTH = int(os.getenv("FLIGHT_RECORDER_MAX_DEPTH", "128"))
+# Préfixes des routes enregistrables
+FLIGHT_RECORDER_ROUTES = tuple(
+    prefix.strip() for prefix in os.getenv(
+        "FLIGHT_RECORDER_ROUTES", "/process,/retreat-with-polygons,/get-bubble-polygons,/reinsert,/stages/"
+    ).split(",") if prefix.strip()
+)
+
+# En-têtes de la requête conservés (jamais Authorization ni les cookies)
+KEPT_HEADERS = ("content-type", "content-length", "user-agent")
+_RECORDING_ID = re.compile(r"^[\w-]+$")
+_SERVER_TIMING_ENTRY = re.compile(r"([\w.-]+);dur=([\d.]+)")
+
+_active_recording = contextvars.ContextVar("flight_recording", default=None)
+_labels = {}
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename.replace("\\", "/")
+        label = _labels[code] = f"{code.co_name} ({'/'.join(path.split('/')[-2:])}:{code.co_firstlineno})"
+    return label
+
+def collapse(frame, max_depth: int = FLIGHT_RECORDER_MAX_DEPTH):
+    """Pile d'appels de `frame`, de la racine à la fonction en cours, séparée par des ';'"""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+def _thread_group(name: str):
+    """Nom de thread sans son numéro (les threads d'un même pool regroupés dans le flamegraph)"""
+    return re.sub(r"[-_ ]?\d+(_\d+)?$", "", name) or name
+
+def _idle(frame):
+    # Boucle d'événements en attente (selectors) : pas du travail de la requête
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+class Recording:
+    def __init__(self, method: str, route: str, headers: dict, keep=None, capture_input: bool = False, trace_id=None):
+        self.started_at = time.time()
+        self.id = time.strftime("%Y%m%d-%H%M%S", time.gmtime(self.started_at)) + f"-{int(self.started_at * 1000) % 1000:03d}-{os.urandom(3).hex()}"
+        self.method = method
+        self.route = route
+        self.headers = {key: value for key, value in headers.items() if key in KEPT_HEADERS}
+        self.keep = keep  # "armed" si demandé explicitement, sinon décidé selon la durée
+        self.trace_id = trace_id
+        self.metadata = {}
+        self.status = None
+        self.server_timing = None
+        self.duration_ms = None
+        self.body = bytearray() if capture_input else None
+        self.body_truncated = False
+        self.stacks = Counter()
+        self.samples = 0
+        self._threads = {}  # ident -> [profondeur de rattachement, groupe]
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def attach(self, ident: int, name: str):
+        with self._lock:
+            entry = self._threads.setdefault(ident, [0, _thread_group(name)])
+            entry[0] += 1
+
+    def detach(self, ident: int):
+        with self._lock:
+            entry = self._threads.get(ident)
+            if entry is not None:
+                entry[0] -= 1
+                if entry[0] <= 0:
+                    del self._threads[ident]
+
+    def sample(self, frames):
+        with self._lock:
+            threads = [(ident, group) for ident, (_, group) in self._threads.items()]
+            self.samples += 1
+        for ident, group in threads:
+            frame = frames.get(ident)
+            if frame is not None and not _idle(frame):
+                self.stacks[f"{group};{collapse(frame)}"] += 1
+
+    def add_body(self, chunk: bytes):
+        if self.body is None or self.body_truncated:
+            return
+        if len(self.body) + len(chunk) > FLIGHT_RECORDER_MAX_INPUT_BYTES:
+            self.body_truncated = True
+            self.body = None
+            return
+        self.body.extend(chunk)
+
+    def stage_timings(self):
+        return {name: float(duration) for name, duration in _SERVER_TIMING_ENTRY.findall(self.server_timing or "")}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "started_at": self.started_at,
+            "method": self.method,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": round(self.duration_ms or 0, 1),
+            "reason": self.keep,
+            "trace_id": self.trace_id,
+            "headers": self.headers,
+            "metadata": self.metadata,
+            "stages_ms": self.stage_timings(),
+            "interval_ms": FLIGHT_RECORDER_INTERVAL_MS,
+            "samples": self.samples,
+            "input_captured": self.body is not None,
+            "input_truncated": self.body_truncated,
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+class _Sampler:
+    """Thread d'échantillonnage, actif tant qu'au moins un enregistrement est en cours"""
+
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self._recordings = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, recording):
+        with self._lock:
+            self._recordings.add(recording)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="flight-recorder", daemon=True)
+                self._thread.start()
+
+    def remove(self, recording):
+        with self._lock:
+            self._recordings.discard(recording)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                recordings = list(self._recordings)
+                if not recordings:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for recording in recordings:
+                recording.sample(frames)
+            del frames
+
+class FlightRecorder:
+    def __init__(self, directory: str, max_records: int, next_requests: int = 0, slow_ms: float = 0.0,
+                 capture_input: bool = False, routes=FLIGHT_RECORDER_ROUTES):
+        self.directory = directory
+        self.max_records = max_records
+        self.remaining = max(0, next_requests)
+        self.slow_ms = slow_ms or 0.0
+        self.capture_input = capture_input
+        self.routes = routes
+        self._sampler = _Sampler(FLIGHT_RECORDER_INTERVAL_MS)
+        self._lock = threading.Lock()
+        self._stats = {"saved": 0, "discarded": 0, "failed_writes": 0}
+
+    def arm(self, requests=None, slow_ms=None, capture_input=None):
+        """Enregistre les `requests` prochaines requêtes et/ou celles plus lentes que `slow_ms` (0 : désactivé)"""
+        with self._lock:
+            if requests is not None:
+                self.remaining = max(0, int(requests))
+            if slow_ms is not None:
+                self.slow_ms = max(0.0, float(slow_ms))
+            if capture_input is not None:
+                self.capture_input = bool(capture_input)
+        logger.info(f"Enregistreur de vol: {self.remaining} requête(s) à enregistrer, seuil lent {self.slow_ms or '-'} ms")
+        return self.get_stats()
+
+    def wants(self, path: str):
+        return (self.remaining > 0 or self.slow_ms > 0) and path.startswith(self.routes)
+
+    @contextmanager
+    def record(self, method: str, route: str, headers: dict, trace_id=None):
+        """
+        Enregistre le bloc (la requête) si elle est sélectionnée : Recording, sinon None. Le thread
+        courant (boucle d'événements) est rattaché ; les autres le sont via attached().
+        """
+        with self._lock:
+            if self.remaining > 0:
+                self.remaining -= 1
+                keep = "armed"
+            elif self.slow_ms > 0:
+                keep = None
+            else:
+                keep = False
+            capture_input = self.capture_input
+        if keep is False:
+            yield None
+            return
+        recording = Recording(method, route, headers, keep, capture_input, trace_id)
+        token = _active_recording.set(recording)
+        recording.attach(threading.get_ident(), "event-loop")
+        self._sampler.add(recording)
+        try:
+            yield recording
+        finally:
+            self._sampler.remove(recording)
+            _active_recording.reset(token)
+            recording.duration_ms = (time.perf_counter() - recording._started) * 1000
+
+    def finish(self, recording):
+        """Conserve l'enregistrement (demandé ou lent) dans l'anneau ; à appeler hors de la boucle d'événements"""
+        if recording.keep is None and recording.duration_ms >= self.slow_ms:
+            recording.keep = "slow"
+        if not recording.keep:
+            self._count("discarded")
+            return None
+        try:
+            self._save(recording)
+        except OSError as e:
+            self._count("failed_writes")
+            logger.warning(f"Enregistrement de vol {recording.id} non écrit: {e}")
+            return None
+        self._count("saved")
+        logger.info(f"Enregistrement de vol {recording.id}: {recording.method} {recording.route} "
+                    f"{recording.duration_ms:.0f} ms, {recording.samples} échantillons")
+        return recording.id
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _save(self, recording):
+        os.makedirs(self.directory, exist_ok=True)
+        if recording.body is not None:
+            with open(os.path.join(self.directory, f"{recording.id}.input"), "wb") as f:
+                f.write(recording.body)
+        path = os.path.join(self.directory, f"{recording.id}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(recording.to_dict(), f, ensure_ascii=False, default=str)
+        os.replace(f"{path}.tmp", path)
+        self._prune()
+
+    def _prune(self):
+        recordings = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+        for recording_id in recordings[:max(0, len(recordings) - self.max_records)]:
+            for suffix in (".json", ".input"):
+                try:
+                    os.remove(os.path.join(self.directory, recording_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list_recordings(self):
+        """Résumés des enregistrements conservés (sans les piles), du plus récent au plus ancien"""
+        if not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            try:
+                record = self.load(name[:-5])
+            except (OSError, ValueError):
+                continue
+            record.pop("stacks", None)
+            summaries.append(record)
+        return summaries
+
+    def path(self, recording_id: str, suffix: str = ".json"):
+        if not _RECORDING_ID.match(recording_id or ""):
+            raise ValueError(f"Identifiant d'enregistrement invalide: {recording_id}")
+        return os.path.join(self.directory, recording_id + suffix)
+
+    def load(self, recording_id: str):
+        with open(self.path(recording_id), encoding="utf-8") as f:
+            return json.load(f)
+
+    def get_stats(self):
+        return {
+            "remaining_requests": self.remaining,
+            "slow_ms": self.slow_ms or None,
+            "capture_input": self.capture_input,
+            "directory": self.directory,
+            "max_records": self.max_records,
+            **self._stats,
+        }
+
+recorder = FlightRecorder(FLIGHT_RECORDER_DIR, FLIGHT_RECORDER_MAX_RECORDS, FLIGHT_RECORDER_NEXT,
+                          FLIGHT_RECORDER_SLOW_MS, FLIGHT_RECORDER_CAPTURE_INPUT)
+
+@contextmanager
+def attach():
+    """Rattache le thread courant à l'enregistrement en cours (sans effet hors enregistrement)"""
+    recording = _active_recording.get()
+    if recording is None:
+        yield
+        return
+    ident = threading.get_ident()
+    recording.attach(ident, threading.current_thread().name)
+    try:
+        yield
+    finally:
+        recording.detach(ident)
+
+def attached(func, *args, **kwargs):
+    with attach():
+        return func(*args, **kwargs)
+
+def annotate(**metadata):
+    """Ajoute des métadonnées à l'enregistrement en cours (sans effet hors enregistrement)"""
+    recording = _active_recording.get()
+    if recording is not None:
+        recording.metadata.update(metadata)
+
+# === ANALYSE ===
+def folded(record):
+    """Piles au format replié (« pile nombre » par ligne) de flamegraph.pl et speedscope"""
+    return "\n".join(f"{stack} {count}" for stack, count in record["stacks"].items())
+
+def hot_functions(record, limit: int = 15):
+    """(fonctions les plus souvent en cours d'exécution, fonctions les plus souvent sur la pile)"""
+    own, total = Counter(), Counter()
+    for stack, count in record["stacks"].items():
+        frames = stack.split(";")[1:]  # sans le groupe de threads
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return own.most_common(limit), total.most_common(limit)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lecture des enregistrements de vol (FLIGHT_RECORDER_DIR)")
+    parser.add_argument("directory", nargs="?", default=FLIGHT_RECORDER_DIR, help="Répertoire des enregistrements")
+    parser.add_argument("--show", metavar="ID", help="Fonctions les plus vues et durées des étapes d'un enregistrement")
+    parser.add_argument("--folded", metavar="ID", help="Piles au format replié (flamegraph.pl, speedscope)")
+    args = parser.parse_args()
+
+    store = FlightRecorder(args.directory, FLIGHT_RECORDER_MAX_RECORDS)
+    if args.folded:
+        print(folded(store.load(args.folded)))
+        return
+    if args.show:
+        record = store.load(args.show)
+        print(f"{record['method']} {record['route']}  {record['status']}  {record['duration_ms']} ms  "
+              f"({record['reason']}, {record['samples']} échantillons toutes les {record['interval_ms']} ms)")
+        if record["trace_id"]:
+            print(f"trace {record['trace_id']}")
+        print("métadonnées: " + json.dumps({**record["headers"], **record["metadata"]}, ensure_ascii=False))
+        print("étapes: " + ", ".join(f"{name} {duration:.1f} ms" for name, duration in record["stages_ms"].items()))
+        own, total = hot_functions(record)
+        print("\nen cours d'exécution (échantillons):")
+        for frame, count in own:
+            print(f"  {count:>6}  {frame}")
+        print("\nsur la pile (échantillons):")
+        for frame, count in total:
+            print(f"  {count:>6}  {frame}")
+        return
+    for record in store.list_recordings():
+        print(f"{record['id']}  {record['duration_ms']:9.1f} ms  {record['method']} {record['route']}  "
+              f"{record['status']}  {record['reason']}  {record['samples']} échantillons")
+
+if __name__ == "__main__":
+    main()
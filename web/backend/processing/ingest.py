@@ -0,0 +1,101 @@
+import io
+import logging
+import os
+import warnings
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Limites d'entrée : la mémoire de pointe par image est bornée par
+# MAX_UPLOAD_BYTES (fichier compressé) + MAX_IMAGE_PIXELS * 3 octets (image décodée)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(25_000_000)))
+SUPPORTED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "BMP", "TIFF"}
+# MPO : JPEG multi-images de certains appareils photo, décodé comme un JPEG
+JPEG_FORMATS = {"JPEG", "MPO"}
+
+# Facteurs de décodage réduit de libjpeg (le décodeur ne produit jamais l'image pleine taille)
+_REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+class ImageRejected(ValueError):
+    """Image refusée avant décodage (trop lourde, trop grande ou format non pris en charge)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def probe_image_header(source):
+    """
+    Lit uniquement l'en-tête de l'image (bytes ou fichier) : retourne (format, largeur, hauteur).
+    Aucun pixel n'est décodé.
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    position = stream.tell()
+    try:
+        # Nos propres limites s'appliquent ensuite : l'avertissement de PIL est inutile ici
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(stream) as img:
+                return img.format, img.width, img.height
+    except Image.DecompressionBombError:
+        raise ImageRejected("Image trop grande", status_code=413)
+    except Exception:
+        raise ImageRejected("Image illisible")
+    finally:
+        stream.seek(position)
+
+def check_image_limits(image_format: str, width: int, height: int, max_pixels: int = MAX_IMAGE_PIXELS):
+    if image_format not in SUPPORTED_FORMATS:
+        raise ImageRejected(f"Format d'image non pris en charge: {image_format}", status_code=415)
+    if width * height > max_pixels:
+        raise ImageRejected(
+            f"Image trop grande ({width}x{height}, maximum {max_pixels // 1_000_000} mégapixels)",
+            status_code=413
+        )
+
+def reduced_decode_factor(image_format: str, width: int, height: int, target_size=(800, 1200)):
+    """
+    Plus grand facteur de réduction au décodage (1, 2, 4 ou 8) qui garde l'image au moins aussi
+    grande que ce que resize_and_pad_cv2 produira. Seul JPEG se décode réellement à échelle réduite.
+    """
+    if image_format not in JPEG_FORMATS:
+        return 1
+    target_width, target_height = target_size
+    # L'orientation EXIF peut intervertir largeur et hauteur : on garde le cas le moins réduit
+    ratio = max(min(target_width / width, target_height / height),
+                min(target_width / height, target_height / width))
+    for factor, _ in _REDUCED_FLAGS:
+        if factor * ratio <= 1:
+            return factor
+    return 1
+
+def decode_image(image_bytes: bytes, target_size=None):
+    """
+    Décode l'image après vérification de l'en-tête.
+    Avec target_size, une image JPEG bien plus grande que la cible est décodée à échelle réduite.
+    Retourne None si l'image est illisible (comme cv2.imdecode), lève ImageRejected si elle dépasse les limites.
+    """
+    try:
+        image_format, width, height = probe_image_header(image_bytes)
+    except ImageRejected as e:
+        if e.status_code == 400:
+            return None
+        raise
+    check_image_limits(image_format, width, height)
+
+    flags = cv2.IMREAD_COLOR
+    if target_size is not None:
+        factor = reduced_decode_factor(image_format, width, height, target_size)
+        if factor > 1:
+            flags = dict(_REDUCED_FLAGS)[factor]
+            logger.info(f"Décodage réduit 1/{factor} pour une image {width}x{height}")
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(nparr, flags)
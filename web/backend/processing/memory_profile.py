@@ -0,0 +1,301 @@
+"""
+Profil mémoire par requête et par étape du pipeline, pour trouver ce qui fait dépasser la limite
+mémoire du conteneur (tenseur des masques N×H×W, copies d'image du rendu, chaînes base64, EasyOCR...).
+
+- Activé par MEMORY_PROFILE=1 : chaque calcul lancé par run_pipeline (main.py) ouvre un profil ; chaque
+  étape mesurée (stage_graph.measure) y ajoute son pic de RSS (échantillonné), son pic de mémoire Python
+  (tracemalloc : allocations numpy comprises, pas celles de PyTorch) et les lignes qui ont le plus alloué.
+- Pendant le profilage, les étapes sont exécutées une à une (verrou global) : les pics mesurés sont
+  attribuables à une étape, au prix de la latence. Mode de diagnostic, pas de production.
+- Un rapport par requête (une ligne JSON) est ajouté à MEMORY_PROFILE_FILE, avec l'identifiant de trace
+  s'il y en a une.
+
+Résumé des rapports (étapes triées par hausse de mémoire) :
+    python -m processing.memory_profile memory_profile.jsonl
+"""
+import argparse
+import contextvars
+import functools
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .tracing import JsonlFileSink, current_span
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "0").lower() in ("1", "true", "yes")
+MEMORY_PROFILE_FILE = os.getenv("MEMORY_PROFILE_FILE", "memory_profile.jsonl")
+# Lignes d'allocation retenues par étape (0 : pas d'instantané tracemalloc, bien plus rapide)
+MEMORY_PROFILE_TOP = int(os.getenv("MEMORY_PROFILE_TOP", "5"))
+MEMORY_PROFILE_FRAMES = int(os.getenv("MEMORY_PROFILE_FRAMES", "1"))
+MEMORY_PROFILE_SAMPLE_MS = float(os.getenv("MEMORY_PROFILE_SAMPLE_MS", "2"))
+
+MB = 1024 * 1024
+
+_current_profile = contextvars.ContextVar("memory_profile", default=None)
+# Une étape profilée à la fois, toutes requêtes confondues (pics de RSS et de tracemalloc globaux)
+_stage_lock = threading.RLock()
+_stage_depth = threading.local()
+_sink = None
+_sink_lock = threading.Lock()
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+def current_rss():
+    """Mémoire résidente du processus (octets), None si indisponible (hors Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _mb(value):
+    return None if value is None else round(value / MB, 1)
+
+class _RssSampler:
+    """Relève la RSS toutes les MEMORY_PROFILE_SAMPLE_MS ms dans un thread ; `reset()` démarre une fenêtre"""
+
+    def __init__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(MEMORY_PROFILE_SAMPLE_MS / 1000):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def reset(self):
+        self.peak = current_rss()
+        return self.peak
+
+    def read(self):
+        rss = current_rss()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+        return self.peak
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+def _top_allocations(before, after, limit: int):
+    if before is None or after is None:
+        return []
+    stats = after.compare_to(before, "lineno")
+    return [
+        {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+         "size_kb": round(stat.size_diff / 1024, 1), "count": stat.count_diff}
+        for stat in stats[:limit] if stat.size_diff > 0
+    ]
+
+def _snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+
+class MemoryProfile:
+    def __init__(self, name: str, top: int = MEMORY_PROFILE_TOP, **attributes):
+        self.name = name
+        self.top = top
+        self.attributes = attributes
+        self.trace_id = getattr(current_span(), "trace_id", None)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.stages = []
+        self.sampler = _RssSampler()
+        self.rss_start = self.sampler.peak
+        self.rss_end = None
+        self.rss_peak = self.rss_start
+        self.traced_start, self.traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+
+    @contextmanager
+    def stage(self, name: str):
+        with _stage_lock:
+            depth = getattr(_stage_depth, "value", 0)
+            _stage_depth.value = depth + 1
+            # Une étape imbriquée (même thread) hérite de la fenêtre de pic de l'étape englobante
+            if depth == 0:
+                rss_before = self.sampler.reset()
+                tracemalloc.reset_peak()
+            else:
+                rss_before = current_rss()
+            traced_before = tracemalloc.get_traced_memory()[0]
+            snapshot_before = _snapshot() if self.top else None
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                duration_ms = (time.perf_counter() - started) * 1000
+                traced_after, traced_peak = tracemalloc.get_traced_memory()
+                rss_peak = self.sampler.read()
+                rss_after = current_rss()
+                top = _top_allocations(snapshot_before, _snapshot() if self.top else None, self.top)
+                _stage_depth.value = depth
+                self.rss_peak = max(filter(None, (self.rss_peak, rss_peak)), default=None)
+                self.traced_peak = max(filter(None, (self.traced_peak, traced_peak)), default=None)
+                self.stages.append({
+                    "name": name,
+                    "thread": threading.current_thread().name,
+                    "duration_ms": round(duration_ms, 1),
+                    "rss_before_mb": _mb(rss_before),
+                    "rss_after_mb": _mb(rss_after),
+                    "rss_peak_mb": _mb(rss_peak),
+                    "rss_peak_delta_mb": _mb(rss_peak - rss_before) if None not in (rss_peak, rss_before) else None,
+                    "traced_before_mb": _mb(traced_before),
+                    "traced_after_mb": _mb(traced_after),
+                    "traced_peak_mb": _mb(traced_peak),
+                    "traced_peak_delta_mb": _mb(traced_peak - traced_before),
+                    "top_allocations": top,
+                })
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        self.rss_end = current_rss()
+        self.rss_peak = max(filter(None, (self.rss_peak, self.sampler.read())), default=None)
+        self.sampler.stop()
+
+    def peak_stage(self):
+        """Étape qui a le plus fait monter la RSS (la mémoire Python si la RSS est indisponible)"""
+        key = "rss_peak_delta_mb" if self.rss_start is not None else "traced_peak_delta_mb"
+        return max(self.stages, key=lambda stage: stage[key] or 0, default=None)
+
+    def to_dict(self):
+        peak = self.peak_stage()
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0, 1),
+            "attributes": self.attributes,
+            "rss_start_mb": _mb(self.rss_start),
+            "rss_end_mb": _mb(self.rss_end),
+            "rss_peak_mb": _mb(self.rss_peak),
+            "traced_start_mb": _mb(self.traced_start),
+            "traced_peak_mb": _mb(self.traced_peak),
+            "peak_stage": peak["name"] if peak else None,
+            "stages": self.stages,
+        }
+
+def _write(profile):
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = JsonlFileSink(MEMORY_PROFILE_FILE)
+        try:
+            _sink.write([profile])
+        except OSError as e:
+            logger.warning(f"Rapport mémoire non écrit ({MEMORY_PROFILE_FILE}): {e}")
+
+@contextmanager
+def profile_request(name: str, enabled=None, write: bool = True, top: int = MEMORY_PROFILE_TOP, **attributes):
+    """
+    Profil mémoire du bloc (MemoryProfile, ou None si le profilage est désactivé). `enabled` force
+    le profilage indépendamment de MEMORY_PROFILE ; un profil déjà actif est réutilisé (blocs imbriqués).
+    """
+    active = _current_profile.get()
+    if active is not None or not (MEMORY_PROFILE if enabled is None else enabled):
+        yield active
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_PROFILE_FRAMES)
+    profile = MemoryProfile(name, top=top, **attributes)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        profile.finish()
+        peak = profile.peak_stage()
+        logger.info(f"Mémoire {name}: pic RSS {_mb(profile.rss_peak)} Mo, pic Python {_mb(profile.traced_peak)} Mo"
+                    + (f" (étape {peak['name']})" if peak else ""))
+        if write:
+            _write(profile)
+
+@contextmanager
+def memory_stage(name: str):
+    """Mesure mémoire d'une étape dans le profil actif (sans effet hors profilage)"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+def profiled(func, name: str = None):
+    """`func` exécutée dans un profil mémoire si MEMORY_PROFILE est activé, sinon `func` elle-même"""
+    if not MEMORY_PROFILE:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile_request(name or func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+# === ANALYSE ===
+def load_reports(paths):
+    reports = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            reports.extend(json.loads(line) for line in f if line.strip())
+    return reports
+
+def summarize(reports):
+    """{étape: {count, rss_peak_delta_mb (médiane, max), traced_peak_delta_mb (médiane, max)}}"""
+    by_stage = {}
+    for report in reports:
+        for stage in report["stages"]:
+            by_stage.setdefault(stage["name"], []).append(stage)
+    summary = {}
+    for name, stages in by_stage.items():
+        rss = [s["rss_peak_delta_mb"] for s in stages if s["rss_peak_delta_mb"] is not None]
+        traced = [s["traced_peak_delta_mb"] for s in stages]
+        summary[name] = {
+            "count": len(stages),
+            "rss_peak_delta_mb_median": round(statistics.median(rss), 1) if rss else None,
+            "rss_peak_delta_mb_max": max(rss, default=None),
+            "traced_peak_delta_mb_median": round(statistics.median(traced), 1),
+            "traced_peak_delta_mb_max": max(traced),
+        }
+    return summary
+
+def _cell(value, width: int):
+    return f"{'-' if value is None else value:>{width}}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Résumé des rapports mémoire (MEMORY_PROFILE_FILE)")
+    parser.add_argument("paths", nargs="+", help="Fichiers JSONL (fichiers de rotation compris)")
+    parser.add_argument("--largest", type=int, default=5, help="Nombre de requêtes au plus haut pic à lister")
+    args = parser.parse_args()
+
+    reports = load_reports(args.paths)
+    summary = summarize(reports)
+    print(f"{'étape':<16}{'n':>6}{'RSS méd.':>10}{'RSS max':>10}{'Python méd.':>13}{'Python max':>12}  (pics, Mo au-dessus du départ)")
+    for name, stats in sorted(summary.items(), key=lambda item: -max(item[1]["rss_peak_delta_mb_max"] or 0, item[1]["traced_peak_delta_mb_max"])):
+        print(f"{name:<16}{stats['count']:>6}{_cell(stats['rss_peak_delta_mb_median'], 10)}{_cell(stats['rss_peak_delta_mb_max'], 10)}"
+              f"{stats['traced_peak_delta_mb_median']:>13}{stats['traced_peak_delta_mb_max']:>12}")
+    print()
+    for report in sorted(reports, key=lambda r: -(r["rss_peak_mb"] or r["traced_peak_mb"] or 0))[:args.largest]:
+        print(f"{report['name']:<36} pic RSS {report['rss_peak_mb']} Mo, plus forte hausse : {report['peak_stage']}"
+              + (f", trace {report['trace_id']}" if report["trace_id"] else ""))
+        peak = next((s for s in report["stages"] if s["name"] == report["peak_stage"]), None)
+        for allocation in (peak or {}).get("top_allocations", [])[:3]:
+            print(f"    {allocation['size_kb']:>10.1f} Ko  {allocation['location']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Chargement paresseux des modèles : détecteur Detectron2, lecteur EasyOCR, client OpenAI.
+
+Importer `processing` (et donc `main`) ne charge ni PyTorch, ni Detectron2, ni EasyOCR, ni OpenAI :
+les migrations, les outils en ligne de commande et les routes d'authentification démarrent sans
+les modèles. Chaque ressource est créée au premier usage, une seule fois par processus même si
+plusieurs threads la demandent en même temps ; `preload()` les charge à l'avance (PRELOAD_MODELS).
+Les poids Detectron2 viennent du cache safetensors projeté en mémoire (processing/weights_cache.py)
+quand il est à jour, sinon de `model_final.pth`.
+
+Le profil du worker (WORKER_PROFILE) borne les modèles que le processus peut charger : un worker
+« clean » (détection, nettoyage) ne charge jamais EasyOCR ni OpenAI, un worker « translate » (OCR et
+traduction de bulles déjà détectées) jamais Detectron2. Un accès hors profil lève ModelUnavailable.
+
+`predictor`, `reader` et `client` s'utilisent comme les objets qu'ils remplacent :
+
+    outputs = predictor(image)          # DefaultPredictor
+    results = reader.readtext(roi)      # easyocr.Reader
+    client.chat.completions.create(...) # openai.OpenAI
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+MODEL_CONFIG = "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"
+
+# Temps de chargement des modèles (secondes), exposé sur /metrics
+model_load_seconds = {}
+
+# Modèles chargeables par profil de worker
+PROFILES = {
+    "clean": ("detectron2",),
+    "translate": ("easyocr", "openai"),
+    "full": ("detectron2", "easyocr", "openai"),
+}
+WORKER_PROFILE = os.getenv("WORKER_PROFILE", "full")
+
+class ModelUnavailable(RuntimeError):
+    """Modèle exclu par le profil du worker"""
+
+_profile = {"name": "full", "models": frozenset(PROFILES["full"])}
+
+def set_profile(name: str):
+    """Choisit le profil du processus (avant le premier usage des modèles) ; ValueError si inconnu"""
+    if name not in PROFILES:
+        raise ValueError(f"Profil de worker inconnu: {name} (attendu: {', '.join(PROFILES)})")
+    _profile.update(name=name, models=frozenset(PROFILES[name]))
+    logger.info(f"Profil de worker: {name} ({', '.join(PROFILES[name])})")
+
+def get_profile():
+    return _profile["name"]
+
+def allows(*names):
+    """True si le profil du worker peut charger tous les modèles `names`"""
+    return _profile["models"].issuperset(names)
+
+class LazyResource:
+    """Ressource créée par `loader()` au premier accès ; les attributs et appels sont délégués à la ressource"""
+
+    def __init__(self, name: str, loader):
+        self._name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            if not allows(self._name):
+                raise ModelUnavailable(f"Modèle {self._name} indisponible dans le profil {get_profile()} (WORKER_PROFILE)")
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    value = self._loader()
+                    model_load_seconds[self._name] = time.perf_counter() - started
+                    logger.info(f"{self._name} chargé en {model_load_seconds[self._name]:.1f} s")
+                    self._value = value
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        return f"<LazyResource {self._name} ({'chargé' if self.loaded else 'non chargé'})>"
+
+def _load_predictor():
+    import torch
+    from detectron2 import model_zoo
+    from detectron2.config import get_cfg
+    from detectron2.engine import DefaultPredictor
+
+    from . import weights_cache
+
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file(MODEL_CONFIG))
+    # Modèle local s'il existe, sinon modèle par défaut
+    model_path = os.path.join(PROJECT_DIR, "models_ai", "model_final.pth")
+    state = None
+    if os.path.exists(model_path):
+        # Poids projetés en mémoire depuis le cache safetensors, partagés entre les workers
+        state = weights_cache.load_state_dict(model_path)
+        cfg.MODEL.WEIGHTS = "" if state is not None else model_path
+        logger.info(f"Chargement du modèle local: {model_path}")
+        print(f"✅ Modèle local chargé: {model_path}{' (cache safetensors)' if state is not None else ''}")
+    else:
+        cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(MODEL_CONFIG)
+        logger.info("Modèle local non trouvé, utilisation du modèle par défaut Detectron2")
+        print("🔄 Modèle local non trouvé, utilisation du modèle par défaut")
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3  # bubble, floating_text, narration_box
+    cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    try:
+        predictor = DefaultPredictor(cfg)
+        if state is not None:
+            weights_cache.assign(predictor.model, state)
+    except Exception as e:
+        logger.error(f"Erreur lors du chargement du modèle: {e}")
+        print(f"❌ Erreur chargement modèle: {e}")
+        raise
+    print("✅ Modèle Detectron2 chargé avec succès")
+    return predictor
+
+def _load_reader():
+    # Patch de compatibilité pour Pillow >= 10.0 (utilisé par easyocr)
+    from PIL import Image
+    if not hasattr(Image, "ANTIALIAS"):
+        Image.ANTIALIAS = Image.Resampling.LANCZOS
+    import easyocr
+
+    return easyocr.Reader(['en'], gpu=True)
+
+def _load_client():
+    import openai
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    try:
+        # Essai standard
+        return openai.OpenAI(api_key=api_key)
+    except TypeError as e:
+        if "proxies" in str(e):
+            # Fallback 1: sans http_client
+            try:
+                return openai.OpenAI(api_key=api_key, http_client=None)
+            except:
+                pass
+        # Fallback 2: avec paramètres minimaux
+        try:
+            return openai.OpenAI(api_key=api_key, base_url="https://api.openai.com/v1")
+        except:
+            pass
+        # Fallback 3: approche alternative
+        try:
+            import httpx
+            return openai.OpenAI(api_key=api_key, http_client=httpx.Client())
+        except:
+            pass
+        # Si rien ne marche, on lève l'erreur originale
+        raise e
+
+predictor = LazyResource("detectron2", _load_predictor)
+reader = LazyResource("easyocr", _load_reader)
+client = LazyResource("openai", _load_client)
+
+RESOURCES = {"detectron2": predictor, "easyocr": reader, "openai": client}
+
+set_profile(WORKER_PROFILE)
+
+def preload(names=None):
+    """Charge les ressources demandées (celles du profil par défaut) ; une ressource en erreur n'empêche pas les autres"""
+    for name in names or PROFILES[get_profile()]:
+        try:
+            RESOURCES[name].get()
+        except Exception as e:
+            logger.error(f"Préchargement de {name} impossible: {e}")
+
+def get_status():
+    return {name: resource.loaded for name, resource in RESOURCES.items()}
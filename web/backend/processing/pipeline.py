@@ -3,13 +3,23 @@ import numpy as np
 import logging
 import traceback
 from .clean_bubbles import clean_bubbles, predictor as clean_predictor
-from .translate_bubbles import extract_and_translate, predictor as translate_predictor
+from .translate_bubbles import extract_texts, iter_bubble_texts, translate, translate_batch
 from .reinsert_translations import draw_translated_text
+from .ingest import ImageRejected, decode_image
+from .stage_graph import StageGraph, measure
+from .tracing import propagate, set_attributes
 import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image  # Ajouté pour le redimensionnement
 
 logger = logging.getLogger(__name__)
 
+# Traductions (appels réseau) lancées en parallèle pendant l'OCR des bulles suivantes
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "4"))
+_translation_pool = ThreadPoolExecutor(max_workers=TRANSLATION_CONCURRENCY, thread_name_prefix="translate")
+
 def resize_and_pad_cv2(image_cv2, target_size=(800, 1200), fill_color=(255, 255, 255)):
     """
     Redimensionne une image OpenCV à target_size sans déformation, avec padding si besoin.
@@ -29,15 +39,63 @@ def resize_and_pad_cv2(image_cv2, target_size=(800, 1200), fill_color=(255, 255,
     result[paste_y:paste_y+new_height, paste_x:paste_x+new_width] = resized
     return result
 
+def _encode_png(image):
+    _, buffer = cv2.imencode('.png', image)
+    return buffer.tobytes()
+
+def _ocr_and_submit(image, outputs):
+    """OCR bulle par bulle ; la traduction de chaque bulle part dès que son texte est lu"""
+    bubbles = []
+    futures = []
+    for bubble in iter_bubble_texts(image, outputs):
+        bubbles.append(bubble)
+        futures.append(_translation_pool.submit(propagate(translate), bubble["ocr_text"]))
+    return bubbles, futures
+
+def _collect_translations(ocr_result):
+    bubbles, futures = ocr_result
+    for bubble, future in zip(bubbles, futures):
+        bubble["translated_text"] = future.result()
+    return bubbles
+
+def _render(cleaned_image, translations):
+    return draw_translated_text(cleaned_image, translations) if translations else cleaned_image
+
+def build_page_graph(image):
+    """
+    Graphe d'une page : après la détection, deux branches indépendantes
+    - nettoyage puis encodage PNG de l'image nettoyée ;
+    - OCR des bulles, chaque traduction étant lancée pendant l'OCR des bulles suivantes ;
+    le rendu démarre dès que l'image nettoyée et les traductions sont prêtes.
+    """
+    return (
+        StageGraph()
+        .add("detect", lambda: clean_predictor(image))
+        .add("clean", lambda outputs: clean_bubbles(image, outputs), "detect")
+        .add("encode_cleaned", _encode_png, "clean")
+        .add("ocr", lambda outputs: _ocr_and_submit(image, outputs), "detect")
+        .add("translate", _collect_translations, "ocr")
+        .add("render", _render, "clean", "translate")
+        .add("encode_final", _encode_png, "render")
+    )
+
+def run_page_graph(image, spans=None, origin=None):
+    """Exécute le graphe d'une page ; retourne (PNG final, bulles traduites, PNG nettoyé)"""
+    page_spans = []
+    results = build_page_graph(image).run(page_spans, origin=origin)
+    logger.info("Étapes: " + ", ".join(f"{span['name']} {span['duration_ms']:.0f} ms" for span in page_spans))
+    if spans is not None:
+        spans.extend(page_spans)
+    return results["encode_final"], results["translate"], results["encode_cleaned"]
+
 def process_image_pipeline(image_bytes: bytes) -> bytes:
     """
     Pipeline complet de traitement d'image pour l'API web
     Prend une image en bytes et retourne l'image traitée en bytes
     """
     try:
-        # Convertir les bytes en image OpenCV
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Convertir les bytes en image OpenCV (décodage réduit si l'image est bien plus grande que la cible)
+        image = decode_image(image_bytes, target_size=(800, 1200))
         
         if image is None:
             logger.error("Impossible de décoder l'image")
@@ -48,30 +106,10 @@ def process_image_pipeline(image_bytes: bytes) -> bytes:
         
         logger.info("Début du pipeline de traitement")
         
-        # Étape 1: Détection et nettoyage des bulles
-        logger.info("Étape 1: Détection et nettoyage des bulles...")
-        outputs = clean_predictor(image)
-        cleaned_image = clean_bubbles(image, outputs)
-        logger.info("Nettoyage terminé")
-        
-        # Étape 2: Extraction et traduction du texte
-        logger.info("Étape 2: Extraction et traduction du texte...")
-        translations = extract_and_translate(image, outputs)
+        # Détection, puis nettoyage en parallèle de l'OCR et de la traduction, puis réinsertion
+        result_bytes, translations, _ = run_page_graph(image)
         logger.info(f"Traduction terminée: {len(translations)} bulles traitées")
         
-        # Étape 3: Réinsertion du texte traduit
-        if translations:
-            logger.info("Étape 3: Réinsertion du texte traduit...")
-            final_image = draw_translated_text(cleaned_image, translations)
-            logger.info("Réinsertion terminée")
-        else:
-            logger.info("Aucune traduction à réinsérer, utilisation de l'image nettoyée")
-            final_image = cleaned_image
-        
-        # Convertir l'image finale en bytes
-        _, buffer = cv2.imencode('.png', final_image)
-        result_bytes = buffer.tobytes()
-        
         logger.info("Pipeline terminé avec succès")
         return result_bytes
         
@@ -81,32 +119,167 @@ def process_image_pipeline(image_bytes: bytes) -> bytes:
         # En cas d'erreur, retourner l'image originale
         return image_bytes 
 
-def process_image_pipeline_with_bubbles(image_bytes: bytes):
+def process_image_pipeline_with_bubbles(image_bytes: bytes, spans=None):
     """
     Pipeline complet qui retourne l'image traitée, l'image nettoyée ET la liste des bulles (texte, coordonnées, etc.)
+    Les spans des étapes sont ajoutés à la liste `spans` si elle est fournie.
+    Lève ImageRejected si l'image est illisible ; toute autre erreur du pipeline est propagée.
     """
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        origin = time.perf_counter()
+        with measure(spans, "decode", origin, input_bytes=len(image_bytes)) as span:
+            image = decode_image(image_bytes, target_size=(800, 1200))
+            if image is not None:
+                span.set_attributes(width=image.shape[1], height=image.shape[0])
         if image is None:
-            logger.error("Impossible de décoder l'image")
-            return image_bytes, [], None
+            raise ImageRejected("Image illisible")
         # Redimensionnement à 800x1200 avec padding
-        image = resize_and_pad_cv2(image, target_size=(800, 1200))
+        with measure(spans, "resize", origin):
+            image = resize_and_pad_cv2(image, target_size=(800, 1200))
         logger.info("Début du pipeline de traitement (with bubbles)")
-        outputs = clean_predictor(image)
-        cleaned_image = clean_bubbles(image, outputs)
-        translations = extract_and_translate(image, outputs)
-        if translations:
-            final_image = draw_translated_text(cleaned_image, translations)
-        else:
-            final_image = cleaned_image
-        _, buffer_final = cv2.imencode('.png', final_image)
-        result_bytes = buffer_final.tobytes()
-        _, buffer_cleaned = cv2.imencode('.png', cleaned_image)
-        cleaned_base64 = base64.b64encode(buffer_cleaned.tobytes()).decode('utf-8')
+        result_bytes, translations, cleaned_bytes = run_page_graph(image, spans, origin)
+        set_attributes(bubble_count=len(translations))
+        cleaned_base64 = base64.b64encode(cleaned_bytes).decode('utf-8')
         return result_bytes, translations, cleaned_base64
     except Exception as e:
         logger.error(f"Erreur dans le pipeline: {e}")
-        traceback.print_exc()
-        return image_bytes, [], None 
\ No newline at end of file
+        raise
+
+def process_image_pipeline_stream(image_bytes: bytes):
+    """
+    Variante progressive du pipeline : générateur d'événements (nom, données) émis dès que
+    chaque étape est prête.
+    - ("cleaned", {"cleaned_base64", "bubble_count"}) après détection et nettoyage
+    - ("bubble", {...}) pour chaque bulle, dès son OCR et sa traduction terminés
+    - ("final", {"image_base64", "bubbles"}) après la réinsertion du texte
+    Lève ValueError si l'image est illisible.
+    """
+    # Les spans ne couvrent jamais un `yield` : chaque reprise du générateur a son propre contexte
+    origin = time.perf_counter()
+    with measure(None, "decode", origin, input_bytes=len(image_bytes)):
+        image = decode_image(image_bytes, target_size=(800, 1200))
+    if image is None:
+        raise ValueError("Image illisible")
+    image = resize_and_pad_cv2(image, target_size=(800, 1200))
+    logger.info("Début du pipeline de traitement (progressif)")
+
+    with measure(None, "detect", origin):
+        outputs = clean_predictor(image)
+    with measure(None, "clean", origin):
+        cleaned_image = clean_bubbles(image, outputs)
+    _, buffer_cleaned = cv2.imencode('.png', cleaned_image)
+    yield "cleaned", {
+        "cleaned_base64": base64.b64encode(buffer_cleaned.tobytes()).decode('utf-8'),
+        "bubble_count": len(outputs["instances"])
+    }
+
+    translations = []
+    for bubble in iter_bubble_texts(image, outputs):
+        bubble["translated_text"] = translate(bubble["ocr_text"])
+        translations.append(bubble)
+        yield "bubble", bubble
+
+    with measure(None, "render", origin, bubble_count=len(translations)):
+        final_image = draw_translated_text(cleaned_image, translations) if translations else cleaned_image
+    _, buffer_final = cv2.imencode('.png', final_image)
+    yield "final", {
+        "image_base64": base64.b64encode(buffer_final.tobytes()).decode('utf-8'),
+        "bubbles": translations
+    }
+
+def detect_batch(images):
+    """
+    Détection Detectron2 de plusieurs pages en un seul passage du modèle
+    (même prétraitement que DefaultPredictor, appliqué à chaque image).
+    """
+    if len(images) == 1:
+        return [clean_predictor(images[0])]
+    import torch
+    with torch.no_grad():
+        inputs = []
+        for image in images:
+            original = image[:, :, ::-1] if clean_predictor.input_format == "RGB" else image
+            height, width = original.shape[:2]
+            transformed = clean_predictor.aug.get_transform(original).apply_image(original)
+            tensor = torch.as_tensor(transformed.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+        return clean_predictor.model(inputs)
+
+def process_pages_batch(pages, spans=None):
+    """
+    Pipeline de plusieurs pages à la fois : détection en un lot, puis traduction groupée
+    de toutes les bulles des pages. `pages` est une liste d'images en bytes.
+    Retourne, pour chaque page, un dict (image_bytes, cleaned_base64, bubbles) ou {"error": ...}.
+    Les spans des étapes (cumulées sur les pages) sont ajoutés à `spans` si elle est fournie.
+    """
+    origin = time.perf_counter()
+    results = [None] * len(pages)
+    images = {}
+    for i, image_bytes in enumerate(pages):
+        try:
+            with measure(spans, "decode", origin):
+                image = decode_image(image_bytes, target_size=(800, 1200))
+        except Exception as e:
+            results[i] = {"error": str(e)}
+            continue
+        if image is None:
+            results[i] = {"error": "Image illisible"}
+            continue
+        with measure(spans, "resize", origin):
+            images[i] = resize_and_pad_cv2(image, target_size=(800, 1200))
+    if not images:
+        return results
+
+    indices = list(images.keys())
+    logger.info(f"Pipeline groupé: {len(indices)} page(s)")
+    try:
+        with measure(spans, "detect", origin, pages=len(indices)):
+            outputs = dict(zip(indices, detect_batch([images[i] for i in indices])))
+    except Exception as e:
+        logger.error(f"Erreur de détection du groupe: {e}")
+        for i in indices:
+            results[i] = {"error": f"Erreur de détection: {e}"}
+        return results
+
+    # Nettoyage et OCR page par page, puis une seule traduction pour toutes les bulles
+    cleaned = {}
+    bubbles = {}
+    for i in indices:
+        try:
+            with measure(spans, "clean", origin, page=i):
+                cleaned[i] = clean_bubbles(images[i], outputs[i])
+            with measure(spans, "ocr", origin, page=i):
+                bubbles[i] = extract_texts(images[i], outputs[i])
+        except Exception as e:
+            logger.error(f"Erreur sur la page {i}: {e}")
+            results[i] = {"error": str(e)}
+    all_bubbles = [bubble for i in bubbles for bubble in bubbles[i]]
+    try:
+        with measure(spans, "translate", origin, bubble_count=len(all_bubbles)):
+            translations = translate_batch([bubble["ocr_text"] for bubble in all_bubbles])
+    except Exception as e:
+        # Seules les pages avec du texte à traduire échouent
+        logger.error(f"Erreur de traduction du groupe: {e}")
+        for i in [i for i in bubbles if bubbles[i]]:
+            results[i] = {"error": f"Erreur de traduction: {e}"}
+            del bubbles[i]
+        translations = []
+    for bubble, translated in zip(all_bubbles, translations):
+        bubble["translated_text"] = translated
+
+    for i in bubbles:
+        try:
+            with measure(spans, "render", origin, page=i):
+                final_image = draw_translated_text(cleaned[i], bubbles[i]) if bubbles[i] else cleaned[i]
+            with measure(spans, "encode", origin):
+                final_bytes = _encode_png(final_image)
+                cleaned_bytes = _encode_png(cleaned[i])
+            results[i] = {
+                "image_bytes": final_bytes,
+                "cleaned_base64": base64.b64encode(cleaned_bytes).decode('utf-8'),
+                "bubbles": bubbles[i]
+            }
+        except Exception as e:
+            logger.error(f"Erreur sur la page {i}: {e}")
+            results[i] = {"error": str(e)}
+    return results
@@ -0,0 +1,105 @@
+"""
+Exécuteur de graphe d'étapes pour le pipeline d'une page.
+
+Chaque étape déclare les étapes dont elle dépend et démarre dès qu'elles sont toutes terminées,
+dans un pool de threads partagé (inférence, OCR, inpainting et encodage PNG libèrent le GIL).
+La latence d'une page tend ainsi vers la branche la plus longue du graphe plutôt que vers la
+somme de toutes les étapes.
+
+Chaque exécution peut enregistrer un span par étape : {"name", "start_ms", "duration_ms", "thread"},
+relatif au lancement du graphe. Si la requête est tracée (processing/tracing.py), chaque étape y est
+aussi un span, enfant du span actif au lancement du graphe.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from .memory_profile import memory_stage
+from .tracing import propagate, start_span
+
+# Étapes exécutées en parallèle, toutes pages confondues
+STAGE_GRAPH_WORKERS = int(os.getenv("STAGE_GRAPH_WORKERS", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Pool partagé, créé au premier usage"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=STAGE_GRAPH_WORKERS, thread_name_prefix="stage")
+        return _executor
+
+def _span(name, origin, started, ended):
+    return {
+        "name": name,
+        "start_ms": round((started - origin) * 1000, 1),
+        "duration_ms": round((ended - started) * 1000, 1),
+        "thread": threading.current_thread().name,
+    }
+
+@contextmanager
+def measure(spans, name: str, origin: float, **attributes):
+    """
+    Mesure un bloc hors graphe (décodage, redimensionnement...) et l'ajoute à `spans` (si fournie) ;
+    le bloc reçoit le span de trace correspondant (pour y ajouter des attributs). Pendant un profilage
+    mémoire (processing/memory_profile.py), le bloc y est aussi une étape.
+    """
+    started = time.perf_counter()
+    try:
+        with start_span(name, **attributes) as trace_span, memory_stage(name):
+            yield trace_span
+    finally:
+        if spans is not None:
+            spans.append(_span(name, origin, started, time.perf_counter()))
+
+class StageGraph:
+    def __init__(self):
+        self._stages = {}  # nom -> (fonction, dépendances), dans l'ordre d'ajout
+
+    def add(self, name: str, func, *deps):
+        """Ajoute une étape ; `func` reçoit les résultats de ses dépendances, dans l'ordre"""
+        if name in self._stages:
+            raise ValueError(f"Étape déjà définie: {name}")
+        for dep in deps:
+            # Les dépendances doivent exister : le graphe est acyclique par construction
+            if dep not in self._stages:
+                raise ValueError(f"Dépendance inconnue pour l'étape {name}: {dep}")
+        self._stages[name] = (func, deps)
+        return self
+
+    def run(self, spans=None, executor=None, origin=None):
+        """
+        Exécute le graphe et retourne {étape: résultat}. Les spans sont ajoutés à la liste `spans`
+        si elle est fournie (temps relatifs à `origin`, par défaut le lancement du graphe).
+        La première erreur est relevée ; les étapes pas encore lancées sont abandonnées.
+        """
+        executor = executor or get_executor()
+        origin = origin if origin is not None else time.perf_counter()
+        results = {}
+        pending = dict(self._stages)
+        running = {}
+
+        def traced(name, func, args):
+            with measure(spans, name, origin):
+                return func(*args)
+
+        try:
+            while pending or running:
+                ready = [name for name, (_, deps) in pending.items() if all(dep in results for dep in deps)]
+                for name in ready:
+                    func, deps = pending.pop(name)
+                    args = [results[dep] for dep in deps]
+                    running[executor.submit(propagate(traced), name, func, args)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        finally:
+            for future in running:
+                future.cancel()
+        if spans is not None:
+            spans.sort(key=lambda span: span["start_ms"])
+        return results
@@ -0,0 +1,149 @@
+"""
+Étapes du pipeline exécutables séparément (routes /stages/*).
+
+Représentation intermédiaire commune (JSON), dans les coordonnées de l'image envoyée, sans le
+redimensionnement 800x1200 de /process (comme pour l'éditeur de bulles) :
+- détections : [{"id", "class", "class_name", "confidence", "polygon", "bbox"}], le format de
+  /get-bubble-polygons avec le contour complet du masque (le nettoyage reste fidèle à la détection) ;
+- image nettoyée : PNG ;
+- bulles : [{"index", "class", "confidence", "ocr_text", "translated_text", "x_min", "x_max", "y_min", "y_max"}],
+  le format de /process, rempli par l'OCR puis par la traduction.
+Un client n'exécute que les étapes dont il a besoin et réutilise les résultats d'un appel à l'autre :
+les détections renvoyées par une étape peuvent être passées aux suivantes pour éviter une nouvelle détection.
+"""
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from .bubble_editor import create_mock_outputs, mask_to_polygon
+from .clean_bubbles import CLASS_NAMES, clean_bubbles, predictor
+from .reinsert_translations import draw_translated_text
+from .stage_graph import measure
+from .translate_bubbles import CONFIDENCE_THRESHOLD, extract_texts, translate_batch
+
+# Bulles acceptées par appel de traduction ou de rendu (le coût de la traduction en dépend)
+MAX_STAGE_BUBBLES = int(os.getenv("MAX_STAGE_BUBBLES", "100"))
+MAX_BUBBLE_TEXT_LENGTH = 2000
+
+class StageInputError(ValueError):
+    """Représentation intermédiaire envoyée par le client invalide"""
+
+def encode_png(image):
+    _, buffer = cv2.imencode('.png', image)
+    return buffer.tobytes()
+
+# === VALIDATION DES ENTRÉES ===
+def parse_detections(raw: str):
+    """Détections JSON envoyées par le client ; lève StageInputError si elles sont invalides"""
+    try:
+        detections = json.loads(raw)
+    except ValueError as e:
+        raise StageInputError(f"Détections JSON invalides: {e}")
+    if not isinstance(detections, list):
+        raise StageInputError("Les détections doivent être une liste")
+    if len(detections) > MAX_STAGE_BUBBLES:
+        raise StageInputError(f"Trop de détections ({len(detections)}, maximum {MAX_STAGE_BUBBLES})")
+    for detection in detections:
+        polygon = detection.get("polygon") if isinstance(detection, dict) else None
+        if not isinstance(polygon, list) or len(polygon) < 3 or not all(
+            isinstance(point, (list, tuple)) and len(point) == 2 and all(isinstance(v, (int, float)) for v in point)
+            for point in polygon
+        ):
+            raise StageInputError("Chaque détection doit avoir un polygone d'au moins 3 points [x, y]")
+        if detection.get("class", 0) not in CLASS_NAMES:
+            raise StageInputError(f"Classe de détection inconnue: {detection.get('class')}")
+    return detections
+
+def parse_bubbles(raw: str):
+    """Bulles JSON envoyées par le client ; lève StageInputError si elles sont invalides"""
+    try:
+        bubbles = json.loads(raw)
+    except ValueError as e:
+        raise StageInputError(f"Bulles JSON invalides: {e}")
+    if not isinstance(bubbles, list) or not all(isinstance(bubble, dict) for bubble in bubbles):
+        raise StageInputError("Les bulles doivent être une liste d'objets")
+    if len(bubbles) > MAX_STAGE_BUBBLES:
+        raise StageInputError(f"Trop de bulles ({len(bubbles)}, maximum {MAX_STAGE_BUBBLES})")
+    for bubble in bubbles:
+        for key in ("ocr_text", "translated_text"):
+            text = bubble.get(key, "")
+            if not isinstance(text, str) or len(text) > MAX_BUBBLE_TEXT_LENGTH:
+                raise StageInputError(f"Texte de bulle invalide ou trop long ({key}, maximum {MAX_BUBBLE_TEXT_LENGTH} caractères)")
+    return bubbles
+
+# === ÉTAPES ===
+def detections_from_outputs(outputs):
+    """Convertit les sorties Detectron2 en détections (représentation intermédiaire)"""
+    instances = outputs["instances"]
+    masks = instances.pred_masks.to("cpu").numpy()
+    classes = instances.pred_classes.to("cpu").numpy()
+    scores = instances.scores.to("cpu").numpy()
+
+    detections = []
+    for i, (mask, class_id, score) in enumerate(zip(masks, classes, scores)):
+        if score < CONFIDENCE_THRESHOLD:
+            continue
+        polygon = mask_to_polygon(mask, target_points=None)
+        if polygon is None or len(polygon) < 3:
+            continue
+        y_indices, x_indices = np.where(mask)
+        detections.append({
+            "id": i,
+            "class": int(class_id),
+            "class_name": CLASS_NAMES.get(int(class_id), "unknown"),
+            "confidence": float(score),
+            "polygon": polygon,
+            "bbox": {
+                "x_min": int(np.min(x_indices)),
+                "x_max": int(np.max(x_indices)),
+                "y_min": int(np.min(y_indices)),
+                "y_max": int(np.max(y_indices))
+            }
+        })
+    return detections
+
+def detect_stage(image, spans=None):
+    """Détection seule : retourne (sorties Detectron2, détections)"""
+    with measure(spans, "detect", time.perf_counter()):
+        outputs = predictor(image)
+        return outputs, detections_from_outputs(outputs)
+
+def _outputs_for(image, detections, spans):
+    """Sorties à utiliser : détection exécutée si le client n'a pas fourni de détections"""
+    if detections is None:
+        return detect_stage(image, spans)
+    return create_mock_outputs(image, detections), detections
+
+def clean_stage(image, detections=None, spans=None):
+    """Nettoyage des bulles : retourne (PNG de l'image nettoyée, détections utilisées)"""
+    outputs, detections = _outputs_for(image, detections, spans)
+    origin = time.perf_counter()
+    with measure(spans, "clean", origin):
+        cleaned = clean_bubbles(image, outputs)
+    with measure(spans, "encode", origin):
+        return encode_png(cleaned), detections
+
+def ocr_stage(image, detections=None, spans=None):
+    """OCR des bulles sur l'image d'origine : retourne (bulles sans traduction, détections utilisées)"""
+    outputs, detections = _outputs_for(image, detections, spans)
+    with measure(spans, "ocr", time.perf_counter()):
+        return extract_texts(image, outputs), detections
+
+def translate_stage(bubbles, spans=None):
+    """Traduction groupée du texte OCR des bulles (aucune image nécessaire)"""
+    with measure(spans, "translate", time.perf_counter(), bubble_count=len(bubbles)):
+        translations = translate_batch([bubble.get("ocr_text", "") for bubble in bubbles])
+    for bubble, translated in zip(bubbles, translations):
+        bubble["translated_text"] = translated
+    return bubbles
+
+def render_stage(image, bubbles, spans=None):
+    """Réinsertion du texte traduit dans l'image (nettoyée) : retourne le PNG final"""
+    origin = time.perf_counter()
+    with measure(spans, "render", origin, bubble_count=len(bubbles)):
+        final_image = draw_translated_text(image, bubbles) if bubbles else image
+    with measure(spans, "encode", origin):
+        return encode_png(final_image)
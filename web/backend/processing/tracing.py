@@ -0,0 +1,435 @@
+"""
+Traces par requête : spans parent/enfant de la route HTTP jusqu'à chaque appel d'OCR, de traduction
+et requête SQL, pour reconstituer après coup le déroulé d'une requête lente (attente d'une place,
+OCR d'une bulle énorme, traduction relancée...).
+
+- La route HTTP ouvre la racine (voir TracingMiddleware dans services/metrics.py) ; chaque span ouvert
+  pendant la requête en devient un descendant, y compris dans les threads (contexte copié à la soumission).
+- Une trace est exportée quand sa racine se termine, une ligne JSON par span, vers un fichier JSONL
+  à rotation (TRACE_FILE) et/ou un collecteur OTLP/HTTP JSON (TRACE_OTLP_ENDPOINT), depuis un thread dédié.
+- Sans exportateur configuré, aucun span n'est créé (coût nul).
+
+Analyse hors ligne (traces les plus lentes, arbre d'une trace et chemin critique) :
+    python -m processing.tracing traces.jsonl --slowest 10
+    python -m processing.tracing traces.jsonl traces.jsonl.1 --trace <trace_id>
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from .flight_recorder import annotate, attached
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "5"))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")  # ex. http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Spans conservés par trace (un lot de 200 pages compte plusieurs milliers d'appels d'OCR)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "5000"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "bubble-cleaner-backend")
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class _NoopSpan:
+    """Span retourné quand la requête n'est pas tracée"""
+    trace_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.root = None
+        self.finished = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def finish(self, span):
+        with self._lock:
+            if span is self.root:
+                spans, self.finished = self.finished + [span], []
+                if self.dropped:
+                    span.attributes["dropped_spans"] = self.dropped
+            elif self.root.end_ns is not None:
+                # Span terminé après la racine (traduction abandonnée...) : exporté seul
+                spans = [span]
+            elif len(self.finished) < TRACE_MAX_SPANS:
+                self.finished.append(span)
+                return
+            else:
+                self.dropped += 1
+                return
+        exporter.export(spans)
+
+class Span:
+    def __init__(self, trace: Trace, name: str, parent_id=None, attributes=None):
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.thread = threading.current_thread().name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end_ns = time.time_ns()
+        self.trace.finish(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+# === CRÉATION DES SPANS ===
+def tracing_enabled():
+    return exporter.enabled
+
+def current_span():
+    """Span actif du contexte courant (NOOP_SPAN hors trace)"""
+    return _current_span.get() or NOOP_SPAN
+
+def set_attributes(**attributes):
+    """Ajoute des attributs au span actif (sans effet hors trace) et à l'enregistrement de vol en cours"""
+    current_span().set_attributes(**attributes)
+    annotate(**attributes)
+
+def begin_span(name: str, **attributes):
+    """
+    Ouvre un span enfant du span actif sans l'activer (pour les hooks sans bloc `with`, comme
+    les événements SQLAlchemy) ; à terminer avec `span.end()`. Retourne NOOP_SPAN hors trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+@contextmanager
+def _activate(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """Span enfant du span actif pendant le bloc ; sans effet hors trace"""
+    span = begin_span(name, **attributes)
+    if span is NOOP_SPAN:
+        yield span
+        return
+    with _activate(span):
+        yield span
+
+def parse_traceparent(header):
+    """(trace_id, parent_id) d'un en-tête W3C traceparent échantillonné, sinon None"""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if match is None or not int(match.group(3), 16) & 1:
+        return None
+    return match.group(1), match.group(2)
+
+@contextmanager
+def start_trace(name: str, traceparent=None, **attributes):
+    """
+    Racine d'une trace (une requête HTTP), exportée à sa fin. Une trace amont (en-tête traceparent)
+    est prolongée ; sinon la requête est échantillonnée selon TRACE_SAMPLE_RATE.
+    """
+    upstream = parse_traceparent(traceparent)
+    if not exporter.enabled or (upstream is None and random.random() >= TRACE_SAMPLE_RATE):
+        yield NOOP_SPAN
+        return
+    trace_id, parent_id = upstream or (os.urandom(16).hex(), None)
+    trace = Trace(trace_id)
+    trace.root = Span(trace, name, parent_id, attributes)
+    with _activate(trace.root):
+        yield trace.root
+
+def propagate(func):
+    """
+    Fonction exécutable dans un autre thread avec le contexte de trace courant ; le thread est rattaché
+    à l'enregistrement de vol en cours pendant l'appel (processing/flight_recorder.py)
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(attached, func, *args, **kwargs)
+
+# === EXPORT ===
+class JsonlFileSink:
+    """Fichier JSONL, renommé en .1, .2... au-delà de max_bytes (backups fichiers conservés)"""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_FILE_MAX_BYTES, backups: int = TRACE_FILE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def write(self, spans):
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class OtlpHttpSink:
+    """Collecteur OTLP/HTTP au format JSON (ou tout service qui en reproduit l'interface)"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def _span(self, span):
+        data = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in {**span.attributes, "thread.name": span.thread}.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            data["parentSpanId"] = span.parent_id
+        return data
+
+    def write(self, spans):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [self._span(span) for span in spans]}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+class TraceExporter:
+    """Écrit les traces terminées depuis un thread dédié (jamais dans la boucle d'événements)"""
+
+    def __init__(self, sinks, max_queue: int = 1000):
+        self.sinks = list(sinks)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported_spans = 0
+        self.dropped_traces = 0
+        self.failed_writes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def export(self, spans):
+        if not self.sinks:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped_traces += 1
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                if spans is None:
+                    return
+                for sink in self.sinks:
+                    try:
+                        sink.write(spans)
+                    except Exception as e:
+                        self.failed_writes += 1
+                        logger.error(f"Erreur lors de l'export des traces ({type(sink).__name__}): {e}")
+                self.exported_spans += len(spans)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: float = 5.0):
+        """Attend l'écriture des traces en file (au plus `timeout` secondes)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def shutdown(self, timeout: float = 5.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        return {
+            "sinks": [type(sink).__name__ for sink in self.sinks],
+            "sample_rate": TRACE_SAMPLE_RATE,
+            "exported_spans": self.exported_spans,
+            "dropped_traces": self.dropped_traces,
+            "failed_writes": self.failed_writes,
+        }
+
+def _configured_sinks():
+    sinks = []
+    if TRACE_FILE:
+        sinks.append(JsonlFileSink(TRACE_FILE))
+    if TRACE_OTLP_ENDPOINT:
+        sinks.append(OtlpHttpSink(TRACE_OTLP_ENDPOINT))
+    return sinks
+
+exporter = TraceExporter(_configured_sinks())
+
+# === ANALYSE HORS LIGNE ===
+def load_traces(paths):
+    """Spans des fichiers JSONL regroupés par trace_id"""
+    traces = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    traces.setdefault(span["trace_id"], []).append(span)
+    return traces
+
+def _root(spans):
+    ids = {span["span_id"] for span in spans}
+    roots = [span for span in spans if span["parent_span_id"] not in ids]
+    return max(roots, key=lambda span: span["duration_ms"])
+
+def critical_path(spans):
+    """
+    Spans du chemin critique d'une trace : en remontant depuis la fin de chaque span, l'enfant qui se
+    termine le plus tard, puis celui qui se termine avant le début du précédent, etc. (récursivement)
+    """
+    children = {}
+    for span in spans:
+        children.setdefault(span["parent_span_id"], []).append(span)
+
+    def walk(span):
+        chosen = []
+        cursor = span["end_time_unix_nano"]
+        for child in sorted(children.get(span["span_id"], []), key=lambda s: s["end_time_unix_nano"], reverse=True):
+            if child["end_time_unix_nano"] <= cursor:
+                chosen.append(child)
+                cursor = child["start_time_unix_nano"]
+        path = [span]
+        for child in reversed(chosen):
+            path.extend(walk(child))
+        return path
+
+    return walk(_root(spans))
+
+def format_trace(spans):
+    """Arbre des spans d'une trace ; * marque le chemin critique"""
+    root = _root(spans)
+    critical = {span["span_id"] for span in critical_path(spans)}
+    children = {}
+    for span in spans:
+        children.setdefault(span["parent_span_id"], []).append(span)
+    lines = []
+
+    def walk(span, depth):
+        offset = (span["start_time_unix_nano"] - root["start_time_unix_nano"]) / 1e6
+        attributes = " ".join(f"{key}={' '.join(str(value).split())[:120]}" for key, value in span["attributes"].items())
+        lines.append(
+            f"{'*' if span['span_id'] in critical else ' '} {offset:9.1f} ms {span['duration_ms']:9.1f} ms  "
+            f"{'  ' * depth}{span['name']}{' [' + span['error'] + ']' if span['error'] else ''}  {attributes}".rstrip()
+        )
+        for child in sorted(children.get(span["span_id"], []), key=lambda s: s["start_time_unix_nano"]):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse des traces exportées (TRACE_FILE)")
+    parser.add_argument("paths", nargs="+", help="Fichiers JSONL (fichiers de rotation compris)")
+    parser.add_argument("--trace", help="Identifiant de la trace à afficher (en-tête X-Trace-Id de la réponse)")
+    parser.add_argument("--slowest", type=int, default=10, help="Nombre de traces les plus lentes à lister")
+    args = parser.parse_args()
+
+    traces = load_traces(args.paths)
+    if args.trace:
+        if args.trace not in traces:
+            parser.error(f"Trace introuvable: {args.trace}")
+        print(format_trace(traces[args.trace]))
+        return
+    roots = sorted((_root(spans) for spans in traces.values()), key=lambda span: span["duration_ms"], reverse=True)
+    for root in roots[:args.slowest]:
+        print(f"{root['trace_id']}  {root['duration_ms']:9.1f} ms  {root['name']}  {root['status']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,22 @@
 import os
 
-import sys
-
-from PIL import Image
-
-if not hasattr(Image, 'ANTIALIAS'):
-
-    Image.ANTIALIAS = Image.Resampling.LANCZOS
-
-import cv2
-
-import torch
-
 import json
 
 import numpy as np
 
-import easyocr
-
-import openai
-
 import logging
 
 from pathlib import Path
 
+from .tracing import start_span
 
 
-# Patch de compatibilité pour Pillow >= 10.0 (utilisé par easyocr)
-
-try:
-
-    from PIL import Image
-
-    if not hasattr(Image, "Resampling"):
-
-        # Pour compatibilité Pillow < 10
-
-        Image.Resampling = Image
-
-    # Image.LANCZOS est toujours disponible dans Pillow >= 10
-
-except ImportError:
 
-    pass
+# Modèles chargés au premier usage (processing/model_loader.py) : importer ce module ne charge
 
+# ni Detectron2, ni EasyOCR, ni OpenAI, et n'exige pas OPENAI_API_KEY
 
-
-from detectron2.config import get_cfg
-
-from detectron2.engine import DefaultPredictor
-
-from detectron2 import model_zoo
+from .model_loader import client, reader
 
 
 
@@ -60,42 +26,6 @@ logger = logging.getLogger(__name__)
 
 
 
-# === CONFIGURATION DETECTRON2 ===
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
-
-cfg = get_cfg()
-cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-
-# Essayer de charger le modèle local, sinon utiliser le modèle par défaut
-model_path = os.path.join(PROJECT_DIR, "models_ai", "model_final.pth")
-if os.path.exists(model_path):
-    try:
-        cfg.MODEL.WEIGHTS = model_path
-        logger.info(f"Chargement du modèle local: {model_path}")
-    except Exception as e:
-        logger.warning(f"Erreur lors du chargement du modèle local: {e}")
-        cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-        logger.info("Utilisation du modèle par défaut Detectron2")
-else:
-    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-    logger.info("Modèle local non trouvé, utilisation du modèle par défaut Detectron2")
-
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
-cfg.MODEL.ROI_HEADS.NUM_CLASSES = 3
-cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-
-try:
-    predictor = DefaultPredictor(cfg)
-    logger.info("Modèle Detectron2 chargé avec succès")
-except Exception as e:
-    logger.error(f"Erreur lors du chargement du modèle: {e}")
-    predictor = None
-
-reader = easyocr.Reader(['en'], gpu=True)
-
-
-
 CLASS_NAMES = {0: "bubble", 1: "floating_text", 2: "narration_box"}
 
 
@@ -106,83 +36,45 @@ CONFIDENCE_THRESHOLD = 0.5
 
 
 
-# === OPENAI (nouvelle API) ===
-
-api_key = os.getenv("OPENAI_API_KEY")
-
-if not api_key:
+# Nombre de bulles traduites par requête dans translate_batch
 
-    raise ValueError("OPENAI_API_KEY environment variable is required")
+TRANSLATION_BATCH_SIZE = int(os.getenv("TRANSLATION_BATCH_SIZE", "25"))
 
 
 
-# Initialisation du client OpenAI avec gestion d'erreur robuste
+def chat_completion(span, **kwargs):
 
-def create_openai_client():
+    """Appel de l'API de chat ; le nombre de nouvelles tentatives du client est ajouté au span"""
 
-    """Crée un client OpenAI avec gestion d'erreur pour compatibilité"""
+    raw = client.chat.completions.with_raw_response.create(**kwargs)
 
-    try:
-
-        # Essai standard
-
-        return openai.OpenAI(api_key=api_key)
-
-    except TypeError as e:
-
-        if "proxies" in str(e):
-
-            # Fallback 1: sans http_client
-
-            try:
-
-                return openai.OpenAI(api_key=api_key, http_client=None)
-
-            except:
-
-                pass
-
-        # Fallback 2: avec paramètres minimaux
-
-        try:
-
-            return openai.OpenAI(api_key=api_key, base_url="https://api.openai.com/v1")
-
-        except:
-
-            pass
+    span.set_attribute("retries", getattr(raw, "retries_taken", 0))
 
-        # Fallback 3: approche alternative
+    return raw.parse()
 
-        try:
 
-            import httpx
 
-            return openai.OpenAI(api_key=api_key, http_client=httpx.Client())
-
-        except:
-
-            pass
-
-        # Si rien ne marche, on lève l'erreur originale
+def translate(text):
 
-        raise e
+    if not text.strip():
 
+        return ""
 
+    with start_span("openai.translate", characters=len(text)) as span:
 
-client = create_openai_client()
+        return _translate(text, span)
 
 
 
-def translate(text):
+def _translate(text, span):
 
-    if not text.strip():
-
-        return ""
+    from openai import AuthenticationError, RateLimitError
 
     try:
 
-        response = client.chat.completions.create(
+        response = chat_completion(
+
+            span,
 
             model="gpt-3.5-turbo",
 
@@ -202,22 +94,28 @@ def translate(text):
 
         return response.choices[0].message.content.strip()
 
-    except openai.AuthenticationError:
+    except AuthenticationError:
 
         logger.error("ERREUR: Erreur d'authentification OpenAI. Verifiez votre cle API.")
 
+        span.set_attribute("error", "authentication")
+
         return f"[ERREUR: Clé API invalide]"
 
-    except openai.RateLimitError:
+    except RateLimitError:
 
         logger.error("ERREUR: Limite de taux depassee. Attendez avant de reessayer.")
 
+        span.set_attribute("error", "rate_limit")
+
         return f"[ERREUR: Limite de taux]"
 
     except Exception as e:
 
         logger.error(f"ERREUR: Erreur de traduction: {e}")
 
+        span.set_attribute("error", str(e))
+
         return f"[ERREUR DE TRADUCTION: {str(e)}]"
 
 
@@ -230,13 +128,19 @@ def clean_ocr(text):
 
 def extract_text_easyocr(image):
 
-    results = reader.readtext(image)
+    with start_span("easyocr.readtext", width=int(image.shape[1]), height=int(image.shape[0])) as span:
+
+        results = reader.readtext(image)
+
+        span.set_attribute("text_boxes", len(results))
 
     return " ".join([text for _, text, _ in results]).strip()
 
 
 
-def extract_and_translate(image, outputs):
+def iter_bubble_texts(image, outputs):
+
+    """OCR de chaque bulle détectée (sans traduction), bulle par bulle"""
 
     # Gérer à la fois les outputs de Detectron2 et nos MockOutputs
 
@@ -262,7 +166,7 @@ def extract_and_translate(image, outputs):
 
 
 
-    results = []
+    count = 0
 
     for i, (mask, class_id, score) in enumerate(zip(masks, classes, scores)):
 
@@ -306,13 +210,11 @@ def extract_and_translate(image, outputs):
 
 
 
-        translated_text = translate(ocr_text)
-
+        count += 1
 
+        yield {
 
-        results.append({
-
-            "index": len(results) + 1,
+            "index": count,
 
             "class": class_name,
 
@@ -320,7 +222,7 @@ def extract_and_translate(image, outputs):
 
             "ocr_text": ocr_text,
 
-            "translated_text": translated_text,
+            "translated_text": "",
 
             "x_min": int(x_min),
 
@@ -330,6 +232,92 @@ def extract_and_translate(image, outputs):
 
             "y_max": int(y_max)
 
-        })
+        }
+
+
+
+def extract_texts(image, outputs):
+
+    """OCR de chaque bulle détectée (sans traduction)"""
+
+    return list(iter_bubble_texts(image, outputs))
+
+
+
+def extract_and_translate(image, outputs):
+
+    results = extract_texts(image, outputs)
+
+    for bubble in results:
+
+        bubble["translated_text"] = translate(bubble["ocr_text"])
+
+    return results
+
+
+
+def translate_batch(texts):
+
+    """
+
+    Traduit plusieurs textes (par exemple toutes les bulles d'un chapitre) en une requête par
+
+    groupe de TRANSLATION_BATCH_SIZE textes. Repli sur translate() texte par texte si la réponse
+
+    n'est pas une liste JSON de la bonne longueur.
+
+    """
+
+    translations = []
+
+    for start in range(0, len(texts), TRANSLATION_BATCH_SIZE):
+
+        chunk = texts[start:start + TRANSLATION_BATCH_SIZE]
+
+        with start_span("openai.translate_batch", texts=len(chunk)) as span:
+
+            translations.extend(_translate_chunk(chunk, span))
+
+    return translations
+
+
+
+def _translate_chunk(chunk, span):
+
+    try:
+
+        response = chat_completion(
+
+            span,
+
+            model="gpt-3.5-turbo",
+
+            messages=[
+
+                {"role": "system", "content": "Tu es un traducteur automatique. Ne commente jamais. On te donne un tableau JSON de textes : réponds uniquement par un tableau JSON de même longueur contenant la traduction française brute de chaque texte, dans le même ordre."},
+
+                {"role": "user", "content": json.dumps(chunk, ensure_ascii=False)}
+
+            ],
+
+            max_tokens=min(4096, 150 * len(chunk)),  # Plafond de sortie du modèle
+
+            temperature=0.3
+
+        )
+
+        translated = json.loads(response.choices[0].message.content.strip())
+
+        if not isinstance(translated, list) or len(translated) != len(chunk):
+
+            raise ValueError(f"{len(chunk)} textes envoyés, réponse inattendue")
+
+        return [str(text).strip() for text in translated]
+
+    except Exception as e:
+
+        logger.warning(f"Traduction groupée impossible ({e}), traduction texte par texte")
+
+        span.set_attribute("fallback", str(e))
 
-    return results 
\ No newline at end of file
+        return [translate(text) for text in chunk] 
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+Cache des poids Detectron2 au format safetensors, projeté en mémoire (mmap).
+
+`DefaultPredictor` désérialise `model_final.pth` (pickle) dans la mémoire de chaque processus : le
+démarrage est lent et N workers gardent N copies privées des ~170 Mo de poids. L'étape de préparation
+convertit une fois le checkpoint en `model_final.safetensors` (même dossier) avec sa somme SHA-256
+(`model_final.safetensors.sha256`, format `sha256sum`) ; les workers projettent ensuite ce fichier en
+mémoire, sans copie : tous les processus d'une machine partagent les mêmes pages du cache disque.
+
+    python -m processing.weights_cache [models_ai/model_final.pth] [--force] [--check]
+
+Le fichier suit le format safetensors (en-tête JSON puis données brutes) et se lit avec la
+bibliothèque safetensors ; il est écrit et projeté ici avec numpy seulement. La projection est privée
+(copie à l'écriture) : le fichier n'est jamais modifié. Un cache absent, périmé (le `.pth` a changé)
+ou dont la somme ne correspond pas est ignoré, et le modèle est chargé depuis le `.pth`.
+
+Même module que desktop/scripts/weights_cache.py : le backend (construit depuis web/backend) et
+l'application de bureau (empaquetée depuis desktop/) sont livrés séparément et ne partagent pas de code.
+Seuls cet en-tête, DEFAULT_SOURCE et PREPARE_COMMAND diffèrent ; toute autre modification est à reporter
+dans les deux copies.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+DEFAULT_SOURCE = os.path.join(PROJECT_DIR, "models_ai", "model_final.pth")
+PREPARE_COMMAND = "python -m processing.weights_cache"
+
+# Vérifie aussi la somme SHA-256 du cache à chaque chargement (lecture complète du fichier). Par défaut
+# le chargement ne compare que la taille et la date du `.pth` : prepare() vérifie la somme au build
+VERIFY_WEIGHTS = os.getenv("VERIFY_WEIGHTS", "0") == "1"
+
+# Types safetensors <-> numpy (bfloat16 n'existe pas dans numpy)
+DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8,
+    "U8": np.uint8, "BOOL": np.bool_,
+}
+_DTYPE_NAMES = {np.dtype(dtype): name for name, dtype in DTYPES.items()}
+_CHUNK = 1 << 20
+
+def cache_path(source: str):
+    return os.path.splitext(source)[0] + ".safetensors"
+
+def checksum_path(path: str):
+    return path + ".sha256"
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _source_metadata(source: str):
+    stat = os.stat(source)
+    return {
+        "source": os.path.basename(source),
+        "source_sha256": file_sha256(source),
+        "source_size": str(stat.st_size),
+        "source_mtime_ns": str(stat.st_mtime_ns),
+    }
+
+def write(path: str, arrays: dict, metadata: dict = None):
+    """Écrit `arrays` (nom -> tableau numpy) au format safetensors ; renvoie la somme SHA-256 du fichier"""
+    header = {"__metadata__": {key: str(value) for key, value in (metadata or {}).items()}}
+    # Plus grands types d'abord : chaque tenseur reste aligné sur la taille de son type
+    names = sorted(arrays, key=lambda name: (-arrays[name].dtype.itemsize, name))
+    offset = 0
+    for name in names:
+        array = arrays[name]
+        if array.dtype not in _DTYPE_NAMES:
+            raise ValueError(f"Type non pris en charge pour {name}: {array.dtype}")
+        header[name] = {"dtype": _DTYPE_NAMES[array.dtype], "shape": list(array.shape),
+                        "data_offsets": [offset, offset + array.nbytes]}
+        offset += array.nbytes
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    encoded += b" " * (-len(encoded) % 8)
+
+    digest = hashlib.sha256()
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    tmp_checksum = f"{checksum_path(path)}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in (struct.pack("<Q", len(encoded)), encoded):
+                f.write(chunk)
+                digest.update(chunk)
+            for name in names:
+                data = np.ascontiguousarray(arrays[name]).tobytes()
+                f.write(data)
+                digest.update(data)
+        sha256 = digest.hexdigest()
+        with open(tmp_checksum, "w") as f:
+            f.write(f"{sha256}  {os.path.basename(path)}\n")
+        # Chaque fichier est remplacé d'un coup : un lecteur ne voit jamais de somme à moitié écrite
+        os.replace(tmp_path, path)
+        os.replace(tmp_checksum, checksum_path(path))
+    finally:
+        for leftover in (tmp_path, tmp_checksum):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return sha256
+
+def read_header(path: str):
+    """En-tête safetensors : (métadonnées, tenseurs, position du début des données)"""
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+    return header.pop("__metadata__", {}), header, 8 + size
+
+def read(path: str):
+    """Tableaux numpy projetés en mémoire depuis un fichier safetensors (copie à l'écriture, sans lecture)"""
+    _, tensors, start = read_header(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode="c")
+    arrays = {}
+    for name, info in tensors.items():
+        begin, end = info["data_offsets"]
+        arrays[name] = mapped[start + begin:start + end].view(DTYPES[info["dtype"]]).reshape(info["shape"])
+    return arrays
+
+def check(source: str, verify: bool = VERIFY_WEIGHTS):
+    """Raison pour laquelle le cache de `source` est inutilisable, ou None s'il est valide"""
+    path = cache_path(source)
+    if not os.path.exists(path) or not os.path.exists(checksum_path(path)):
+        return "cache absent"
+    metadata, _, _ = read_header(path)
+    stat = os.stat(source)
+    # Taille et date inchangées : même checkpoint ; sinon (copie, checkout) on compare le contenu
+    if (metadata.get("source_size"), metadata.get("source_mtime_ns")) != (str(stat.st_size), str(stat.st_mtime_ns)):
+        if metadata.get("source_sha256") != file_sha256(source):
+            return f"cache périmé ({os.path.basename(source)} a changé)"
+    if verify:
+        with open(checksum_path(path)) as f:
+            expected = f.read().split()[0]
+        if file_sha256(path) != expected:
+            return "somme SHA-256 du cache invalide"
+    return None
+
+def prepare(source: str = DEFAULT_SOURCE, force: bool = False):
+    """Convertit le checkpoint `source` en cache safetensors s'il est absent ou périmé ; renvoie son chemin"""
+    path = cache_path(source)
+    if not force and check(source, verify=True) is None:
+        logger.info(f"Cache de poids à jour: {path}")
+        return path
+
+    import torch
+
+    try:
+        # Checkpoint local de confiance : il peut contenir des objets numpy
+        checkpoint = torch.load(source, map_location="cpu", weights_only=False)
+    except TypeError:
+        checkpoint = torch.load(source, map_location="cpu")
+    state = checkpoint.get("model", checkpoint) if isinstance(checkpoint, dict) else checkpoint
+    arrays = {}
+    for name, value in state.items():
+        # Même normalisation que le checkpointer de Detectron2 (préfixe DDP, tableaux numpy)
+        if name.startswith("module."):
+            name = name[len("module."):]
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu().contiguous().numpy()
+        if isinstance(value, np.ndarray):
+            arrays[name] = value
+    write(path, arrays, _source_metadata(source))
+    logger.info(f"Cache de poids écrit: {path} ({len(arrays)} tenseurs)")
+    return path
+
+def load_state_dict(source: str, verify: bool = VERIFY_WEIGHTS):
+    """Poids projetés en mémoire (nom -> tenseur torch) pour `source`, ou None si le cache est inutilisable"""
+    try:
+        reason = check(source, verify)
+        if reason is None:
+            import torch
+
+            return {name: torch.from_numpy(array) for name, array in read(cache_path(source)).items()}
+    except Exception as e:
+        reason = str(e)
+    logger.warning(f"Cache de poids ignoré ({reason}), chargement depuis {source} "
+                   f"(préparation: {PREPARE_COMMAND})")
+    return None
+
+def assign(model, state: dict):
+    """Installe les poids dans le modèle ; sur CPU les paramètres restent les pages projetées"""
+    on_cpu = next(model.parameters()).device.type == "cpu"
+    try:
+        result = model.load_state_dict(state, strict=False, assign=on_cpu)
+    except TypeError:
+        # torch < 2.1 : pas d'`assign`, les poids sont copiés
+        result = model.load_state_dict(state, strict=False)
+    if result.missing_keys:
+        logger.warning(f"Poids absents du cache: {', '.join(result.missing_keys)}")
+    if result.unexpected_keys:
+        logger.warning(f"Poids du cache inutilisés: {', '.join(result.unexpected_keys)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prépare le cache safetensors des poids Detectron2")
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE, help="Checkpoint .pth")
+    parser.add_argument("--force", action="store_true", help="Réécrit le cache même s'il est à jour")
+    parser.add_argument("--check", action="store_true", help="Vérifie le cache sans l'écrire")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"❌ Checkpoint introuvable: {args.source}")
+        sys.exit(1)
+    if args.check:
+        reason = check(args.source, verify=True)
+        print(f"❌ {reason}" if reason else f"✅ Cache valide: {cache_path(args.source)}")
+        sys.exit(1 if reason else 0)
+    try:
+        path = prepare(args.source, force=args.force)
+    except Exception as e:
+        print(f"❌ Préparation du cache impossible: {e}")
+        sys.exit(1)
+    print(f"✅ Cache de poids prêt: {path} ({os.path.getsize(path) / 1e6:.0f} Mo)")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -77,14 +77,6 @@ class UserSession(UserSessionBase):
         from_attributes = True
 
 # Schémas pour les réponses API
-class UserProfile(BaseModel):
-    user: User
-    usage_stats: Optional[UsageStats] = None
-    quotas: List[UserQuota] = []
-    
-    class Config:
-        from_attributes = True
-
 class QuotaStatus(BaseModel):
     daily_used: int
     daily_limit: int
@@ -93,6 +85,15 @@ class QuotaStatus(BaseModel):
     can_process: bool
     message: Optional[str] = None
 
+class UserProfile(BaseModel):
+    user: User
+    usage_stats: Optional[UsageStats] = None
+    quotas: List[UserQuota] = []
+    quota_status: Optional[QuotaStatus] = None
+    
+    class Config:
+        from_attributes = True
+
 # Schémas pour la gestion des utilisateurs
 class PasswordChange(BaseModel):
     current_password: str
@@ -126,4 +127,9 @@ class PasswordResetToken(BaseModel):
 
 class UserUpdate(BaseModel):
     username: Optional[str] = None
-    email: Optional[EmailStr] = None 
\ No newline at end of file
+    email: Optional[EmailStr] = None
+
+class FlightRecorderArm(BaseModel):
+    requests: Optional[int] = None  # Nombre de prochaines requêtes à enregistrer
+    slow_ms: Optional[float] = None  # Seuil des requêtes lentes (0 : désactivé)
+    capture_input: Optional[bool] = None  # Conserver le corps des requêtes
@@ -0,0 +1,90 @@
+"""
+Lecture des archives de chapitre (CBZ/ZIP) et écriture du CBZ résultat, en flux.
+
+Les pages sont lues une à une depuis le fichier temporaire de l'envoi (jamais extraites sur
+disque) et chaque page est soumise aux mêmes limites qu'une image envoyée seule. Le CBZ
+résultat est produit morceau par morceau, sans jamais être entièrement en mémoire.
+"""
+import os
+import re
+import zipfile
+
+from processing.ingest import MAX_UPLOAD_BYTES, ImageRejected, check_image_limits, probe_image_header
+
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(200 * 1024 * 1024)))
+MAX_BATCH_PAGES = int(os.getenv("MAX_BATCH_PAGES", "200"))
+# Pages traitées ensemble (détection en un lot, traduction groupée)
+BATCH_PAGE_GROUP = int(os.getenv("BATCH_PAGE_GROUP", "4"))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+def _natural_key(name: str):
+    """Tri naturel : page2 avant page10"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def open_archive(fileobj):
+    """Ouvre l'archive et retourne (zipfile, pages triées) ; lève ImageRejected si elle est invalide"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ImageRejected("Archive CBZ/ZIP invalide")
+
+    pages = [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+        and os.path.splitext(info.filename)[1].lower() in IMAGE_EXTENSIONS
+    ]
+    if not pages:
+        raise ImageRejected("Aucune image dans l'archive")
+    if len(pages) > MAX_BATCH_PAGES:
+        raise ImageRejected(f"Trop de pages dans l'archive ({len(pages)}, maximum {MAX_BATCH_PAGES})", status_code=413)
+    pages.sort(key=lambda info: _natural_key(info.filename))
+    return archive, pages
+
+def read_page(archive, info, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Lit une page de l'archive avec les limites d'une image envoyée seule"""
+    # Taille décompressée annoncée par l'archive, vérifiée avant lecture (archives piégées)
+    if info.file_size > max_bytes:
+        raise ImageRejected(f"Page trop volumineuse ({info.file_size // (1024 * 1024)} Mo)", status_code=413)
+    with archive.open(info) as member:
+        data = member.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ImageRejected("Page trop volumineuse", status_code=413)
+    image_format, width, height = probe_image_header(data)
+    check_image_limits(image_format, width, height)
+    return data
+
+class _ChunkBuffer:
+    """Flux non positionnable pour zipfile : les octets écrits sont récupérés par pop()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class CbzStreamWriter:
+    """Écrit un CBZ page par page ; chaque appel retourne les octets prêts à être envoyés"""
+
+    def __init__(self):
+        self._buffer = _ChunkBuffer()
+        self._archive = zipfile.ZipFile(self._buffer, mode="w", compression=zipfile.ZIP_STORED)
+
+    def add(self, name: str, data: bytes):
+        self._archive.writestr(name, data)
+        return self._buffer.pop()
+
+    def close(self):
+        self._archive.close()
+        return self._buffer.pop()
@@ -0,0 +1,279 @@
+"""
+File d'envoi (outbox) des emails transactionnels.
+
+Les routes n'attendent plus le serveur SMTP : elles insèrent l'email dans la table
+`email_outbox` et répondent immédiatement. Une tâche de fond vide la file par lots
+(EMAIL_OUTBOX_BATCH_SIZE emails sur une seule connexion SMTP), réessaie avec un délai
+exponentiel et passe l'email à l'état 'dead' après EMAIL_MAX_ATTEMPTS échecs (ou
+immédiatement sur un refus définitif 5xx). Les lignes sont réservées avec
+FOR UPDATE SKIP LOCKED : plusieurs workers peuvent vider la file sans doublon.
+
+Envoi manuel / test contre un serveur SMTP local (par exemple `python -m aiosmtpd -n -l localhost:1025`) :
+
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_STARTTLS=false MAIL_USE_CREDENTIALS=false \\
+        python -m services.email_outbox [--requeue-dead]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import aiosmtplib
+from sqlalchemy import and_, func, select, update
+
+from database.database import AsyncSessionLocal
+from models import models
+from services.email_service import MAIL_SSL_TLS, MAIL_STARTTLS, MAIL_USE_CREDENTIALS, MAIL_VALIDATE_CERTS
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", "10"))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_DELAY = float(os.getenv("EMAIL_RETRY_BASE_DELAY", "30"))
+EMAIL_RETRY_MAX_DELAY = float(os.getenv("EMAIL_RETRY_MAX_DELAY", "3600"))
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "20"))
+# Un email réservé mais jamais confirmé (worker arrêté en plein envoi) redevient disponible après ce délai
+EMAIL_CLAIM_TIMEOUT = float(os.getenv("EMAIL_CLAIM_TIMEOUT", "300"))
+
+def retry_delay(attempts: int):
+    """Délai avant la tentative suivante : EMAIL_RETRY_BASE_DELAY * 2^(n-1), plafonné"""
+    return min(EMAIL_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)), EMAIL_RETRY_MAX_DELAY)
+
+async def enqueue_email(db, recipient: str, subject: str, body: str, kind: str):
+    """Ajoute un email à la file (commit inclus) et réveille l'expéditeur"""
+    job = models.EmailOutbox(kind=kind, recipient=recipient, subject=subject, body=body,
+                             status="pending", attempts=0, next_attempt_at=datetime.utcnow())
+    db.add(job)
+    await db.commit()
+    email_outbox.notify()
+    return job
+
+def _build_message(job, sender: str):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = job.recipient
+    message["Subject"] = job.subject
+    message.set_content("Cet email nécessite un client compatible HTML.")
+    message.add_alternative(job.body, subtype="html")
+    return message
+
+def _is_permanent(error: Exception):
+    """Refus définitif du serveur (5xx) : inutile de réessayer"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(_is_permanent(refused) for refused in error.recipients)
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 500 <= code < 600
+
+class EmailOutbox:
+    """Expéditeur de fond : réserve un lot, l'envoie sur une connexion SMTP, enregistre le résultat"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, poll_interval: float = EMAIL_OUTBOX_POLL_INTERVAL,
+                 batch_size: int = EMAIL_OUTBOX_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = None
+        self._task = None
+        # Compteurs exposés pour le suivi
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.last_batch_duration = 0.0
+        self.last_error = None
+
+    def notify(self):
+        """Réveille l'expéditeur après un ajout (sans effet s'il n'est pas démarré)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _smtp_client(self):
+        return aiosmtplib.SMTP(
+            hostname=os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+            port=int(os.getenv("MAIL_PORT", "587")),
+            use_tls=MAIL_SSL_TLS,
+            start_tls=MAIL_STARTTLS if not MAIL_SSL_TLS else False,
+            validate_certs=MAIL_VALIDATE_CERTS,
+            timeout=EMAIL_SMTP_TIMEOUT,
+        )
+
+    async def _claim_batch(self):
+        """Réserve jusqu'à batch_size emails échus (statut 'sending' + échéance de réservation)"""
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            stmt = (
+                select(models.EmailOutbox)
+                .where(
+                    and_(
+                        models.EmailOutbox.status.in_(["pending", "sending"]),
+                        models.EmailOutbox.next_attempt_at <= now
+                    )
+                )
+                .order_by(models.EmailOutbox.next_attempt_at, models.EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            jobs = (await db.execute(stmt)).scalars().all()
+            for job in jobs:
+                job.status = "sending"
+                job.attempts = (job.attempts or 0) + 1
+                job.next_attempt_at = now + timedelta(seconds=EMAIL_CLAIM_TIMEOUT)
+            await db.commit()
+            return jobs
+
+    async def _send_batch(self, jobs):
+        """Envoie le lot sur une seule connexion ; retourne {job_id: exception ou None}"""
+        results = {}
+        sender = os.getenv("MAIL_FROM", "noreply@bubblehack.com")
+        try:
+            smtp = self._smtp_client()
+            await smtp.connect()
+            if MAIL_USE_CREDENTIALS:
+                await smtp.login(os.getenv("MAIL_USERNAME", "your-email@gmail.com"),
+                                 os.getenv("MAIL_PASSWORD", "your-app-password"))
+        except Exception as e:
+            # Serveur injoignable ou authentification refusée : tout le lot sera réessayé
+            error = aiosmtplib.SMTPConnectError(str(e))
+            return {job.id: error for job in jobs}
+
+        try:
+            for job in jobs:
+                try:
+                    await smtp.send_message(_build_message(job, sender))
+                    results[job.id] = None
+                except aiosmtplib.SMTPServerDisconnected as e:
+                    # Connexion perdue : le reste du lot sera réessayé plus tard
+                    for remaining in jobs:
+                        results.setdefault(remaining.id, e)
+                    break
+                except Exception as e:
+                    results[job.id] = e
+        finally:
+            try:
+                await smtp.quit()
+            except Exception:
+                pass
+        return results
+
+    async def _record_results(self, jobs, results):
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            for job in jobs:
+                error = results.get(job.id)
+                if error is None:
+                    values = {"status": "sent", "sent_at": now, "last_error": None}
+                    self.sent += 1
+                elif _is_permanent(error) or job.attempts >= EMAIL_MAX_ATTEMPTS:
+                    values = {"status": "dead", "last_error": str(error)[:1000]}
+                    self.dead += 1
+                    logger.error(f"Email {job.id} ({job.kind}) abandonné après {job.attempts} tentative(s): {error}")
+                else:
+                    values = {"status": "pending", "last_error": str(error)[:1000],
+                              "next_attempt_at": now + timedelta(seconds=retry_delay(job.attempts))}
+                    self.retried += 1
+                    self.last_error = str(error)
+                await db.execute(update(models.EmailOutbox).where(models.EmailOutbox.id == job.id).values(**values))
+            await db.commit()
+
+    async def drain_once(self):
+        """Traite un lot ; retourne le nombre d'emails réservés"""
+        jobs = await self._claim_batch()
+        if not jobs:
+            return 0
+        start = time.perf_counter()
+        results = await self._send_batch(jobs)
+        await self._record_results(jobs, results)
+        self.last_batch_duration = time.perf_counter() - start
+        sent = sum(1 for error in results.values() if error is None)
+        logger.info(f"Outbox email: {sent}/{len(jobs)} envoyé(s) en {self.last_batch_duration * 1000:.0f} ms")
+        return len(jobs)
+
+    async def drain(self):
+        """Vide tout ce qui est échu (lot après lot)"""
+        total = 0
+        while True:
+            claimed = await self.drain_once()
+            total += claimed
+            if claimed < self.batch_size:
+                return total
+
+    async def requeue_dead(self):
+        """Remet les emails 'dead' dans la file (après correction de la configuration SMTP par exemple)"""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(models.EmailOutbox)
+                .where(models.EmailOutbox.status == "dead")
+                .values(status="pending", attempts=0, next_attempt_at=datetime.utcnow())
+            )
+            await db.commit()
+            return result.rowcount
+
+    # === CYCLE DE VIE ===
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Erreur lors de l'envoi des emails en attente: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # Les emails réservés non confirmés seront repris après EMAIL_CLAIM_TIMEOUT
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+
+    async def get_queue_counts(self):
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(models.EmailOutbox.status, func.count()).group_by(models.EmailOutbox.status)
+            )).all()
+            return {status: count for status, count in rows}
+
+    def get_stats(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+            "last_batch_duration_ms": round(self.last_batch_duration * 1000, 1),
+            "last_error": self.last_error,
+        }
+
+email_outbox = EmailOutbox()
+
+def main():
+    parser = argparse.ArgumentParser(description="Envoi des emails en attente dans email_outbox")
+    parser.add_argument("--requeue-dead", action="store_true", help="Remettre les emails abandonnés dans la file avant l'envoi")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    async def run():
+        if args.requeue_dead:
+            print(f"📬 {await email_outbox.requeue_dead()} email(s) remis dans la file")
+        print(f"📤 {await email_outbox.drain()} email(s) traité(s)")
+        print(f"📊 File: {await email_outbox.get_queue_counts()}")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
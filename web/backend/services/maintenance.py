@@ -0,0 +1,173 @@
+"""
+Maintenance périodique des tables qui ne font que grossir.
+
+- user_sessions : suppression des sessions expirées ou désactivées
+- password_resets : suppression des tokens utilisés ou expirés
+- image_retreatments : suppression des compteurs sans retraitement depuis IMAGE_RETREATMENT_RETENTION_DAYS
+- email_outbox : suppression des emails envoyés depuis plus de EMAIL_OUTBOX_RETENTION_DAYS (les 'dead' sont gardés)
+
+Les suppressions se font par lots bornés (MAINTENANCE_BATCH_SIZE lignes par transaction) pour ne
+jamais verrouiller une table longtemps. Exécution dans l'application (toutes les
+MAINTENANCE_INTERVAL secondes, 0 pour désactiver) ou en ligne de commande :
+
+    python -m services.maintenance [--batch-size N] [--retention-days N] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, or_, select, text
+
+from database.database import AsyncSessionLocal
+from models import models
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000"))
+IMAGE_RETREATMENT_RETENTION_DAYS = int(os.getenv("IMAGE_RETREATMENT_RETENTION_DAYS", "30"))
+PASSWORD_RESET_RETENTION_DAYS = int(os.getenv("PASSWORD_RESET_RETENTION_DAYS", "1"))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
+
+# Clé du verrou consultatif PostgreSQL : un seul worker exécute la maintenance à la fois
+_ADVISORY_LOCK_KEY = 4242031
+
+async def _delete_in_batches(session_factory, model, condition, batch_size: int, dry_run: bool = False):
+    """Supprime les lignes correspondant à `condition` par lots de `batch_size`, une transaction par lot"""
+    if dry_run:
+        async with session_factory() as db:
+            return (await db.execute(select(func.count()).select_from(model).where(condition))).scalar_one()
+
+    total = 0
+    while True:
+        async with session_factory() as db:
+            ids = select(model.id).where(condition).limit(batch_size).scalar_subquery()
+            result = await db.execute(delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+            await db.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+        # Laisser la main aux requêtes entre deux lots
+        await asyncio.sleep(0)
+
+async def purge_expired_sessions(session_factory=AsyncSessionLocal, batch_size: int = MAINTENANCE_BATCH_SIZE, dry_run: bool = False):
+    now = datetime.utcnow()
+    condition = or_(models.UserSession.expires_at <= now, models.UserSession.is_active == False)
+    return await _delete_in_batches(session_factory, models.UserSession, condition, batch_size, dry_run)
+
+async def purge_password_resets(session_factory=AsyncSessionLocal, batch_size: int = MAINTENANCE_BATCH_SIZE,
+                                retention_days: int = PASSWORD_RESET_RETENTION_DAYS, dry_run: bool = False):
+    # Les tokens utilisés sont gardés `retention_days` jours pour le support, les expirés sont supprimés
+    now = datetime.utcnow()
+    condition = or_(
+        models.PasswordReset.expires_at <= now,
+        and_(models.PasswordReset.is_used == True, models.PasswordReset.created_at <= now - timedelta(days=retention_days))
+    )
+    return await _delete_in_batches(session_factory, models.PasswordReset, condition, batch_size, dry_run)
+
+async def prune_image_retreatments(session_factory=AsyncSessionLocal, batch_size: int = MAINTENANCE_BATCH_SIZE,
+                                   retention_days: int = IMAGE_RETREATMENT_RETENTION_DAYS, dry_run: bool = False):
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    condition = models.ImageRetreatment.last_retreatment < cutoff
+    return await _delete_in_batches(session_factory, models.ImageRetreatment, condition, batch_size, dry_run)
+
+async def purge_sent_emails(session_factory=AsyncSessionLocal, batch_size: int = MAINTENANCE_BATCH_SIZE,
+                            retention_days: int = EMAIL_OUTBOX_RETENTION_DAYS, dry_run: bool = False):
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    condition = and_(models.EmailOutbox.status == "sent", models.EmailOutbox.sent_at < cutoff)
+    return await _delete_in_batches(session_factory, models.EmailOutbox, condition, batch_size, dry_run)
+
+async def _try_lock(db):
+    """Verrou consultatif (PostgreSQL uniquement) pour éviter deux maintenances concurrentes"""
+    if db.bind.dialect.name != "postgresql":
+        return True
+    return (await db.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})).scalar()
+
+async def _unlock(db):
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+
+async def run_maintenance(session_factory=AsyncSessionLocal, batch_size: int = MAINTENANCE_BATCH_SIZE,
+                          retention_days: int = IMAGE_RETREATMENT_RETENTION_DAYS, dry_run: bool = False):
+    """Exécute toutes les tâches de maintenance et retourne le rapport (lignes affectées, durées)"""
+    report = {"started_at": datetime.utcnow().isoformat(), "dry_run": dry_run, "tasks": {}}
+    start = time.perf_counter()
+
+    async with session_factory() as lock_db:
+        if not await _try_lock(lock_db):
+            logger.info("Maintenance déjà en cours sur un autre worker, ignorée")
+            report["skipped"] = True
+            return report
+        try:
+            tasks = [
+                ("user_sessions", purge_expired_sessions(session_factory, batch_size, dry_run=dry_run)),
+                ("password_resets", purge_password_resets(session_factory, batch_size, dry_run=dry_run)),
+                ("image_retreatments", prune_image_retreatments(session_factory, batch_size, retention_days, dry_run=dry_run)),
+                ("email_outbox", purge_sent_emails(session_factory, batch_size, dry_run=dry_run)),
+            ]
+            for name, coro in tasks:
+                task_start = time.perf_counter()
+                try:
+                    rows = await coro
+                    report["tasks"][name] = {"rows": rows, "duration_ms": round((time.perf_counter() - task_start) * 1000, 1)}
+                except Exception as e:
+                    logger.error(f"Erreur de maintenance sur {name}: {e}")
+                    report["tasks"][name] = {"error": str(e)}
+        finally:
+            await _unlock(lock_db)
+
+    report["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"Maintenance terminée en {report['duration_ms']} ms: {report['tasks']}")
+    return report
+
+class MaintenanceWorker:
+    """Exécute run_maintenance périodiquement dans l'application"""
+
+    def __init__(self, interval: float = MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.last_report = None
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_report = await run_maintenance()
+            except Exception as e:
+                logger.error(f"Erreur lors de la maintenance: {e}")
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+maintenance_worker = MaintenanceWorker()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance des sessions, tokens et compteurs de retraitement")
+    parser.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE, help="Lignes supprimées par transaction")
+    parser.add_argument("--retention-days", type=int, default=IMAGE_RETREATMENT_RETENTION_DAYS, help="Rétention des compteurs de retraitement (jours)")
+    parser.add_argument("--dry-run", action="store_true", help="Compter les lignes concernées sans rien supprimer")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    report = asyncio.run(run_maintenance(batch_size=args.batch_size, retention_days=args.retention_days, dry_run=args.dry_run))
+    for name, result in report["tasks"].items():
+        print(f"{name}: {result}")
+    print(f"Durée totale: {report.get('duration_ms', 0)} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Instrumentation : latence par étape, requêtes HTTP et SQL, files d'attente, caches.
+
+- Les étapes du pipeline (decode, resize, detect, clean, ocr, translate, render, encode_*) sont
+  mesurées par les spans de processing/stage_graph.py ; les routes y ajoutent les leurs (upload,
+  quota, queue). Un calcul partagé par plusieurs requêtes (single-flight) n'est observé qu'une fois.
+- GET /metrics expose le tout au format texte Prometheus ; les compteurs des autres services
+  (cache du profil, admission, single-flight, pool SQL, outbox) y sont lus à chaque collecte.
+- Les réponses de traitement portent un en-tête Server-Timing avec la durée de chaque étape.
+- Les mêmes mesures (étapes de la route, requêtes SQL) sont des spans de la trace de la requête
+  (processing/tracing.py), dont la racine est ouverte par TracingMiddleware.
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from starlette.concurrency import run_in_threadpool
+
+from processing.flight_recorder import recorder as flight_recorder
+from processing.tracing import begin_span, current_span, start_span, start_trace, tracing_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_sample(name, labels, value):
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Labels attendus pour {self.name}: {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state["counts"]), state["sum"], state["count"]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """
+        Ajoute une source lue à chaque collecte : `collect()` retourne des tuples
+        (nom, type, description, [(labels, valeur), ...]).
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """Texte d'exposition Prometheus (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(*sample) for sample in metric.samples())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.error(f"Erreur lors de la collecte des métriques: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_format_sample(name, labels, value) for labels, value in samples if value is not None)
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+stage_duration = metrics.histogram(
+    "bubble_stage_duration_seconds", "Durée des étapes de traitement (pipeline, lecture, quota, attente)", ["stage"]
+)
+http_request_duration = metrics.histogram(
+    "bubble_http_request_duration_seconds", "Durée des requêtes HTTP", ["method", "route", "status"]
+)
+db_query_duration = metrics.histogram(
+    "bubble_db_query_duration_seconds", "Durée des requêtes SQL", ["operation"], buckets=DB_BUCKETS
+)
+
+def observe_spans(spans):
+    """Enregistre la durée de chaque span dans l'histogramme des étapes"""
+    for span in spans:
+        stage_duration.observe(span["duration_ms"] / 1000, stage=span["name"])
+
+def server_timing(spans, total_ms=None):
+    """En-tête Server-Timing : durée cumulée par étape, dans l'ordre de première apparition"""
+    durations = {}
+    for span in spans:
+        durations[span["name"]] = durations.get(span["name"], 0.0) + span["duration_ms"]
+    entries = [f"{name};dur={duration:.1f}" for name, duration in durations.items()]
+    if total_ms is not None:
+        entries.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(entries)
+
+class RequestTiming:
+    """Spans d'une requête de traitement (étapes de la route + spans du pipeline) pour Server-Timing"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Mesure un bloc de la route ; la durée est aussi observée dans l'histogramme des étapes"""
+        started = time.perf_counter()
+        try:
+            with start_span(name, **attributes) as trace_span:
+                yield trace_span
+        finally:
+            ended = time.perf_counter()
+            self.spans.append({
+                "name": name,
+                "start_ms": round((started - self.origin) * 1000, 1),
+                "duration_ms": round((ended - started) * 1000, 1),
+            })
+            stage_duration.observe(ended - started, stage=name)
+
+    def add(self, spans):
+        """Ajoute les spans d'un calcul (déjà observés par celui qui l'a exécuté)"""
+        self.spans.extend(spans)
+
+    def header(self):
+        return {"Server-Timing": server_timing(self.spans, (time.perf_counter() - self.origin) * 1000)}
+
+# === REQUÊTES SQL ===
+def instrument_engine(engine):
+    """Mesure la durée de chaque requête SQL exécutée par le moteur (sync ou async)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    def _operation(statement):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        return operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        # Span de la trace de la requête : le texte SQL seul, jamais les paramètres
+        span = begin_span(f"db.{_operation(statement)}", statement=statement[:500], executemany=executemany)
+        conn.info.setdefault("query_started", []).append((time.perf_counter(), span))
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started, span = conn.info["query_started"].pop()
+        span.end()
+        db_query_duration.observe(time.perf_counter() - started, operation=_operation(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            _, span = started.pop()
+            span.end(error=context.original_exception)
+
+# === REQUÊTES HTTP ===
+class _RouteMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    def _route_label(self, scope):
+        # Seules les routes de l'application ont leur propre label (les chemins inconnus sont regroupés)
+        if self.routes is None:
+            self.routes = {getattr(route, "path", None) for route in getattr(scope.get("app"), "routes", [])}
+        return scope["path"] if scope["path"] in self.routes else "other"
+
+class MetricsMiddleware(_RouteMiddleware):
+    """Middleware ASGI : durée et statut de chaque requête HTTP, par route"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.observe(time.perf_counter() - started, method=scope["method"],
+                                          route=self._route_label(scope), status=str(status_code))
+
+class TracingMiddleware(_RouteMiddleware):
+    """
+    Middleware ASGI : racine de la trace de chaque requête HTTP (prolonge un en-tête traceparent
+    entrant). L'identifiant de trace est renvoyé dans l'en-tête X-Trace-Id.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        route = self._route_label(scope)
+        with start_trace(f"{scope['method']} {route}", traceparent, method=scope["method"], route=route) as root:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("status", message["status"])
+                    if root.trace_id:
+                        message = {**message, "headers": [*message.get("headers", []),
+                                                          (b"x-trace-id", root.trace_id.encode("latin-1"))]}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+class FlightRecorderMiddleware(_RouteMiddleware):
+    """
+    Middleware ASGI : enregistre les requêtes sélectionnées par l'enregistreur de vol (processing/flight_recorder.py)
+    avec leur statut, leur en-tête Server-Timing et, si configuré, le corps de la requête
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not flight_recorder.wants(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers") or []}
+        with flight_recorder.record(scope["method"], self._route_label(scope), headers, current_span().trace_id) as recording:
+            if recording is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def receive_wrapper():
+                message = await receive()
+                if message["type"] == "http.request":
+                    recording.add_body(message.get("body", b""))
+                return message
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    recording.status = message["status"]
+                    for key, value in message.get("headers", []):
+                        if key.lower() == b"server-timing":
+                            recording.server_timing = value.decode("latin-1")
+                await send(message)
+
+            try:
+                await self.app(scope, receive_wrapper if recording.body is not None else receive, send_wrapper)
+            finally:
+                recording.status = recording.status or 500
+        # Écriture sur disque hors de la boucle d'événements
+        await run_in_threadpool(flight_recorder.finish, recording)
+
@@ -0,0 +1,56 @@
+"""
+Cache court, par utilisateur, des réponses /profile et /quotas.
+
+Le frontend interroge ces routes après chaque page : la réponse est gardée PROFILE_CACHE_TTL
+secondes et invalidée dès que les quotas ou le profil de l'utilisateur changent dans ce processus.
+Avec plusieurs workers, un autre worker peut servir une valeur périmée au plus pendant le TTL.
+"""
+import os
+import threading
+import time
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "5"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+
+class ProfileCache:
+    """Cache TTL en mémoire indexé par user_id"""
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id: int, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Purger les entrées expirées, puis les plus anciennes si nécessaire
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                while len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[user_id] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {"entries": size, "hits": self.hits, "misses": self.misses, "ttl_s": self.ttl}
+
+profile_cache = ProfileCache()
@@ -0,0 +1,424 @@
+"""
+Couche d'admission en mémoire devant les quotas stockés en base.
+
+Deux mécanismes par utilisateur :
+- un seau à jetons (RATE_LIMIT_BURST requêtes, rechargé à RATE_LIMIT_PER_MINUTE) qui écarte
+  les rafales abusives sur les routes de traitement et /quotas ;
+- un bail de crédits de quota : lors d'une synchronisation, le worker réserve jusqu'à
+  QUOTA_LEASE_SIZE crédits en base (UPDATE atomique, lignes verrouillées) puis les consomme
+  localement, sans aucune requête, jusqu'à épuisement ou expiration du bail (QUOTA_LEASE_TTL).
+
+Modèle de cohérence entre workers : un crédit n'est consommé localement que s'il a été
+réservé en base au préalable, la limite ne peut donc jamais être dépassée, quel que soit le
+nombre de workers. En contrepartie, les crédits réservés et non consommés apparaissent comme
+utilisés pour les autres workers jusqu'à leur restitution (fin du bail ou arrêt propre du
+worker). Près de la limite (marge < 2 × QUOTA_LEASE_SIZE), la réservation se fait crédit par
+crédit : chaque requête est alors vérifiée en base. Un refus est mémorisé (jusqu'au reset du
+quota, au plus QUOTA_DENY_TTL secondes) pour rejeter les requêtes suivantes avant la lecture
+du fichier envoyé.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import jwt
+
+from database.database import AsyncSessionLocal
+from crud import async_crud
+from services.profile_cache import profile_cache
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+QUOTA_LEASE_SIZE = int(os.getenv("QUOTA_LEASE_SIZE", "3"))
+QUOTA_LEASE_TTL = float(os.getenv("QUOTA_LEASE_TTL", "60"))
+QUOTA_DENY_TTL = float(os.getenv("QUOTA_DENY_TTL", "300"))
+# Coût des routes par étape (/stages/*) en centièmes de crédit : détection + nettoyage = 0,4 image
+STAGE_COSTS = {
+    "detect": int(os.getenv("STAGE_COST_DETECT", "30")),
+    "clean": int(os.getenv("STAGE_COST_CLEAN", "10")),
+    "ocr": int(os.getenv("STAGE_COST_OCR", "30")),
+    "translate": int(os.getenv("STAGE_COST_TRANSLATE", "30")),
+    "render": int(os.getenv("STAGE_COST_RENDER", "0")),
+}
+
+class TokenBucket:
+    """Seau à jetons classique : `capacity` jetons, rechargés à `rate` jetons par seconde"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def take(self, n: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def retry_after(self, n: float = 1) -> float:
+        """Secondes avant que `n` jetons soient disponibles"""
+        self._refill(time.monotonic())
+        if self.tokens >= n or self.rate <= 0:
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+@dataclass
+class QuotaLease:
+    """Crédits réservés en base par ce worker pour un utilisateur"""
+    granted: int
+    consumed: int
+    status: dict
+    daily_reset_date: datetime
+    monthly_reset_date: datetime
+    expires_at: float
+
+    @property
+    def remaining(self) -> int:
+        return self.granted - self.consumed
+
+    def is_usable(self) -> bool:
+        if self.remaining <= 0 or time.monotonic() > self.expires_at:
+            return False
+        # Une fenêtre de quota remise à zéro invalide le bail
+        now = datetime.utcnow()
+        return now < self.daily_reset_date.replace(tzinfo=None) and now < self.monthly_reset_date.replace(tzinfo=None)
+
+    def current_status(self) -> dict:
+        """Statut des quotas vu par l'utilisateur (crédits réservés non consommés exclus)"""
+        status = dict(self.status)
+        status["daily_used"] -= self.remaining
+        status["monthly_used"] -= self.remaining
+        status["can_process"] = True
+        status["message"] = None
+        status.pop("daily_reset_date", None)
+        status.pop("monthly_reset_date", None)
+        return status
+
+@dataclass
+class UserAdmission:
+    bucket: TokenBucket
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    lease: QuotaLease = None
+    denied_until: float = 0.0
+    denied_status: dict = None
+    partial: int = 0  # centièmes de crédit cumulés par les routes par étape, pas encore débités
+
+class QuotaAdmission:
+    """Admission par utilisateur : seau à jetons + bail de crédits de quota"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, burst: int = RATE_LIMIT_BURST,
+                 per_minute: float = RATE_LIMIT_PER_MINUTE, lease_size: int = QUOTA_LEASE_SIZE,
+                 lease_ttl: float = QUOTA_LEASE_TTL, deny_ttl: float = QUOTA_DENY_TTL):
+        self.session_factory = session_factory
+        self.burst = burst
+        self.per_minute = per_minute
+        self.lease_size = max(1, lease_size)
+        self.lease_ttl = lease_ttl
+        self.deny_ttl = deny_ttl
+        self._users = {}
+        self._emails = {}
+        self._task = None
+        # Compteurs exposés pour le suivi
+        self.local_admissions = 0
+        self.db_syncs = 0
+        self.rejected_rate = 0
+        self.rejected_quota = 0
+
+    def _state(self, user_id: int) -> UserAdmission:
+        state = self._users.get(user_id)
+        if state is None:
+            state = UserAdmission(bucket=TokenBucket(self.burst, self.per_minute / 60.0))
+            self._users[user_id] = state
+        return state
+
+    def remember(self, email: str, user_id: int):
+        """Associe l'email du token JWT à l'utilisateur (utilisé par le middleware)"""
+        self._emails[email] = user_id
+
+    # === PRÉ-ADMISSION (avant la lecture du corps de la requête, aucune requête SQL) ===
+    def precheck(self, email: str, check_quota: bool = True):
+        """Retourne None si la requête peut continuer, sinon (message, retry_after)"""
+        user_id = self._emails.get(email)
+        if user_id is None:
+            return None
+        state = self._state(user_id)
+        if check_quota and state.denied_until > time.monotonic():
+            self.rejected_quota += 1
+            return state.denied_status["message"], state.denied_until - time.monotonic()
+        if not state.bucket.take():
+            self.rejected_rate += 1
+            return "Trop de requêtes, réessayez dans quelques secondes.", state.bucket.retry_after()
+        return None
+
+    # === QUOTAS ===
+    async def charge(self, db, user_id: int) -> dict:
+        """Consomme un crédit de quota : localement si un bail est actif, sinon en réservant en base"""
+        state = self._state(user_id)
+        async with state.lock:
+            lease = state.lease
+            if lease is not None and lease.is_usable():
+                lease.consumed += 1
+                self.local_admissions += 1
+                return lease.current_status()
+
+            # Rendre le reste d'un bail expiré avant d'en demander un nouveau
+            if lease is not None and lease.remaining > 0:
+                await async_crud.release_quota_tokens(db, user_id, lease.remaining, lease.daily_reset_date, lease.monthly_reset_date)
+            state.lease = None
+
+            granted, status = await async_crud.reserve_quota_tokens(db, user_id, self.lease_size)
+            self.db_syncs += 1
+            profile_cache.invalidate(user_id)
+
+            if granted == 0:
+                self._deny(state, status)
+                status.pop("daily_reset_date", None)
+                status.pop("monthly_reset_date", None)
+                return status
+
+            state.denied_until = 0.0
+            lease = QuotaLease(
+                granted=granted,
+                consumed=1,
+                status=status,
+                daily_reset_date=status["daily_reset_date"],
+                monthly_reset_date=status["monthly_reset_date"],
+                expires_at=time.monotonic() + self.lease_ttl
+            )
+            if lease.remaining > 0:
+                state.lease = lease
+            return lease.current_status()
+
+    async def charge_partial(self, db, user_id: int, cost: int) -> dict:
+        """
+        Débite `cost` centièmes de crédit (routes par étape). Les fractions sont cumulées par
+        utilisateur dans ce worker : un crédit entier est consommé chaque fois que le cumul atteint
+        100, sinon le quota est seulement vérifié. Le reliquat (moins d'un crédit) est perdu à l'arrêt.
+        """
+        state = self._state(user_id)
+        if state.partial + cost < 100:
+            status = await self.check(db, user_id)
+        else:
+            status = await self.charge(db, user_id)
+            if status["can_process"]:
+                state.partial -= 100
+        if status["can_process"]:
+            state.partial += cost
+        return status
+
+    async def refund(self, db, user_id: int, credits: int):
+        """
+        Rend `credits` crédits débités par charge() pour des traitements qui ont échoué : remis dans le
+        bail s'il est encore actif, sinon rendus en base
+        """
+        if credits <= 0:
+            return
+        state = self._state(user_id)
+        async with state.lock:
+            lease = state.lease
+            if lease is not None and lease.is_usable():
+                back = min(credits, lease.consumed)
+                lease.consumed -= back
+                credits -= back
+            if credits > 0:
+                await async_crud.refund_quota_tokens(db, user_id, credits)
+                self.db_syncs += 1
+            state.denied_until = 0.0
+            profile_cache.invalidate(user_id)
+
+    async def check(self, db, user_id: int) -> dict:
+        """Vérifie les quotas sans consommer de crédit (retraitement)"""
+        state = self._state(user_id)
+        lease = state.lease
+        if lease is not None and lease.is_usable():
+            self.local_admissions += 1
+            return lease.current_status()
+        if state.denied_until > time.monotonic():
+            return dict(state.denied_status)
+
+        snapshot = await async_crud.get_profile_snapshot(db, user_id)
+        self.db_syncs += 1
+        status = self.adjust_status(user_id, snapshot["quota_status"])
+        if not status["can_process"]:
+            self._deny(state, status)
+        return status
+
+    def reserved(self, user_id: int) -> int:
+        """Crédits réservés en base par ce worker pour l'utilisateur et pas encore consommés"""
+        state = self._users.get(user_id)
+        lease = state.lease if state else None
+        if lease is None or not lease.is_usable():
+            return 0
+        return lease.remaining
+
+    def adjust_status(self, user_id: int, status: dict) -> dict:
+        """Retire d'un statut lu en base les crédits réservés par ce worker et non consommés"""
+        reserved = self.reserved(user_id)
+        if not reserved:
+            return status
+        status = dict(status)
+        status["daily_used"] = max(0, status["daily_used"] - reserved)
+        status["monthly_used"] = max(0, status["monthly_used"] - reserved)
+        status["can_process"] = True
+        status["message"] = None
+        return status
+
+    def adjust_profile(self, user_id: int, profile):
+        """Même correction sur un profil (schemas.UserProfile) : statut des quotas et compteurs `quotas[]`"""
+        reserved = self.reserved(user_id)
+        if not reserved:
+            return profile
+        update = {"quotas": [quota.model_copy(update={"used_value": max(0, quota.used_value - reserved)})
+                             for quota in profile.quotas]}
+        if profile.quota_status is not None:
+            update["quota_status"] = profile.quota_status.model_copy(
+                update=self.adjust_status(user_id, profile.quota_status.model_dump()))
+        return profile.model_copy(update=update)
+
+    def _deny(self, state: UserAdmission, status: dict):
+        """Mémorise un refus jusqu'au prochain reset du quota épuisé (au plus deny_ttl secondes)"""
+        until = self.deny_ttl
+        reset_date = None
+        if status["daily_used"] >= status["daily_limit"]:
+            reset_date = status.get("daily_reset_date")
+        elif status["monthly_used"] >= status["monthly_limit"]:
+            reset_date = status.get("monthly_reset_date")
+        if reset_date is not None:
+            until = min(until, max(0.0, (reset_date.replace(tzinfo=None) - datetime.utcnow()).total_seconds()))
+        state.denied_until = time.monotonic() + until
+        state.denied_status = {k: v for k, v in status.items() if not k.endswith("_reset_date")}
+        self.rejected_quota += 1
+
+    # === RESTITUTION DES BAUX ===
+    async def release_expired(self, release_all: bool = False):
+        """Rend à la base les crédits des baux expirés (ou de tous les baux à l'arrêt)"""
+        released = 0
+        for user_id, state in list(self._users.items()):
+            lease = state.lease
+            if lease is None or (not release_all and lease.is_usable()):
+                continue
+            state.lease = None
+            if lease.remaining <= 0:
+                continue
+            try:
+                async with self.session_factory() as db:
+                    await async_crud.release_quota_tokens(db, user_id, lease.remaining, lease.daily_reset_date, lease.monthly_reset_date)
+                released += lease.remaining
+                profile_cache.invalidate(user_id)
+            except Exception as e:
+                logger.error(f"Erreur lors de la restitution des crédits de l'utilisateur {user_id}: {e}")
+        self._evict_idle()
+        return released
+
+    def _evict_idle(self):
+        """
+        Oublie les utilisateurs inactifs : sans bail, seau plein, sans refus en cours ni fraction de
+        crédit en attente (routes par étape). Leur état serait recréé à l'identique à la prochaine requête.
+        """
+        now = time.monotonic()
+        idle = {user_id for user_id, state in self._users.items()
+                if state.lease is None and state.denied_until <= now and state.partial == 0
+                and not state.lock.locked() and state.bucket.is_full()}
+        for user_id in idle:
+            del self._users[user_id]
+        if idle:
+            self._emails = {email: user_id for email, user_id in self._emails.items() if user_id not in idle}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.lease_ttl / 4))
+            await self.release_expired()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.release_expired(release_all=True)
+
+    def get_stats(self):
+        return {
+            "tracked_users": len(self._users),
+            "active_leases": sum(1 for s in self._users.values() if s.lease is not None and s.lease.is_usable()),
+            "local_admissions": self.local_admissions,
+            "db_syncs": self.db_syncs,
+            "rejected_rate": self.rejected_rate,
+            "rejected_quota": self.rejected_quota,
+        }
+
+quota_admission = QuotaAdmission()
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI : rejette les requêtes manifestement hors limite avant que FastAPI
+    ne lise et ne décode le fichier envoyé (le corps est lu avant la résolution des dépendances).
+    """
+
+    def __init__(self, app, admission: QuotaAdmission, secret_key: str, algorithm: str,
+                 quota_paths=(), rate_paths=()):
+        self.app = app
+        self.admission = admission
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.quota_paths = set(quota_paths)
+        self.rate_paths = set(rate_paths) | self.quota_paths
+
+    def _email_from_scope(self, scope):
+        for name, value in scope.get("headers", []):
+            if name == b"authorization":
+                token = value.decode("latin-1")
+                if not token.lower().startswith("bearer "):
+                    return None
+                try:
+                    payload = jwt.decode(token[7:], self.secret_key, algorithms=[self.algorithm])
+                except jwt.PyJWTError:
+                    return None
+                return payload.get("sub")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.rate_paths or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        email = self._email_from_scope(scope)
+        rejection = self.admission.precheck(email, check_quota=scope["path"] in self.quota_paths) if email else None
+        if rejection is None:
+            await self.app(scope, receive, send)
+            return
+
+        message, retry_after = rejection
+        body = json.dumps({"detail": message}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, int(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
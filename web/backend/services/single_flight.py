@@ -0,0 +1,145 @@
+"""
+Déduplication (single-flight) des soumissions identiques.
+
+Un double-clic ou une nouvelle tentative du frontend envoie les mêmes octets à /process ou
+/retreat-with-polygons pendant que le premier calcul tourne encore. Les requêtes portant la
+même clé (hash du contenu + paramètres) s'attachent au calcul en cours et reçoivent son résultat.
+
+Débit des quotas : une seule fois par utilisateur et par calcul. Une requête identique d'un
+même utilisateur est « coalescée » (aucun débit, aucune statistique) et n'obtient le résultat que
+si le débit de la première a abouti ; un autre utilisateur qui envoie la même page partage le
+calcul mais est débité normalement (un débit refusé lui renvoie l'erreur, pas le résultat).
+
+Le résultat d'un calcul réussi reste disponible SINGLE_FLIGHT_RESULT_TTL secondes pour absorber
+les nouvelles tentatives qui arrivent juste après la fin (0 pour désactiver).
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "10"))
+SINGLE_FLIGHT_MAX_RESULTS = int(os.getenv("SINGLE_FLIGHT_MAX_RESULTS", "16"))
+
+class _Flight:
+    """Calcul en cours (ou récemment terminé) pour une clé"""
+
+    def __init__(self, future):
+        self.future = future
+        self.task = None
+        self.charges = {}  # user_id -> future du débit (résultat de charge(), ou son erreur)
+        self.expires_at = None
+
+class SingleFlight:
+    def __init__(self, result_ttl: float = SINGLE_FLIGHT_RESULT_TTL, max_results: int = SINGLE_FLIGHT_MAX_RESULTS):
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self._flights = {}
+        self._completed = OrderedDict()  # clés des calculs terminés gardés en mémoire, du plus ancien au plus récent
+        # Compteurs exposés pour le suivi
+        self.computations = 0
+        self.coalesced = 0
+        self.shared = 0
+
+    @staticmethod
+    def make_key(endpoint: str, content: bytes, *params):
+        digest = hashlib.sha256(content)
+        for param in params:
+            digest.update(b"\0" + str(param).encode("utf-8"))
+        return f"{endpoint}:{digest.hexdigest()}"
+
+    def _get_flight(self, key):
+        flight = self._flights.get(key)
+        if flight is not None and flight.expires_at is not None and flight.expires_at < time.monotonic():
+            self._forget(key, flight)
+            return None
+        return flight
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        self._completed.pop(key, None)
+
+    def _fail(self, key, flight, error):
+        if not flight.future.done():
+            flight.future.set_exception(error)
+            # Marquer l'exception comme lue si personne d'autre n'attend
+            flight.future.exception()
+        self._forget(key, flight)
+
+    async def _compute(self, key, flight, compute):
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            return
+        flight.future.set_result(result)
+        if self.result_ttl <= 0:
+            self._forget(key, flight)
+            return
+        flight.expires_at = time.monotonic() + self.result_ttl
+        self._completed[key] = flight
+        while len(self._completed) > self.max_results:
+            old_key, old_flight = self._completed.popitem(last=False)
+            self._forget(old_key, old_flight)
+
+    async def run(self, key: str, user_id: int, compute, charge=None, refund=None):
+        """
+        Exécute `compute()` une seule fois pour toutes les requêtes concurrentes portant `key`.
+
+        `charge()` débite l'utilisateur (peut lever une HTTPException) et n'est appelé qu'une fois par
+        utilisateur et par calcul ; `refund()` est appelé si le calcul échoue après un débit.
+        Retourne (résultat, résultat du débit, coalescée).
+        """
+        flight = self._get_flight(key)
+        if flight is not None and user_id in flight.charges:
+            self.coalesced += 1
+            # Le résultat n'est remis que si le débit de la requête d'origine a abouti : un débit
+            # refusé (429) ou en échec est renvoyé aussi à cette requête
+            charged = await asyncio.shield(flight.charges[user_id])
+            result = await asyncio.shield(flight.future)
+            return result, charged, True
+
+        if flight is None:
+            flight = _Flight(asyncio.get_running_loop().create_future())
+            self._flights[key] = flight
+        else:
+            self.shared += 1
+
+        charged = asyncio.get_running_loop().create_future()
+        flight.charges[user_id] = charged
+        try:
+            charged.set_result(await charge() if charge is not None else None)
+        except BaseException as e:
+            del flight.charges[user_id]
+            charged.set_exception(e if isinstance(e, Exception) else RuntimeError("Débit interrompu"))
+            # Marquer l'exception comme lue si aucune requête coalescée n'attend ce débit
+            charged.exception()
+            # Personne n'a été débité pour ce calcul : on l'abandonne (les requêtes attachées reçoivent l'erreur)
+            if flight.task is None and not flight.charges:
+                self._fail(key, flight, e)
+            raise
+
+        if flight.task is None and not flight.future.done():
+            self.computations += 1
+            flight.task = asyncio.get_running_loop().create_task(self._compute(key, flight, compute))
+
+        try:
+            result = await asyncio.shield(flight.future)
+        except Exception:
+            if refund is not None:
+                await refund()
+            raise
+        return result, charged.result(), False
+
+    def get_stats(self):
+        return {
+            "in_flight": sum(1 for flight in self._flights.values() if not flight.future.done()),
+            "cached_results": len(self._completed),
+            "computations": self.computations,
+            "coalesced_requests": self.coalesced,
+            "shared_requests": self.shared,
+        }
+
+single_flight = SingleFlight()
@@ -0,0 +1,91 @@
+"""
+Réception bornée des fichiers envoyés.
+
+- UploadLimitMiddleware refuse (413) les corps multipart plus gros que MAX_UPLOAD_BYTES avant
+  leur lecture, d'après Content-Length, et coupe la lecture si un corps sans Content-Length dépasse.
+- read_image_upload vérifie l'en-tête de l'image (format, dimensions) sur le fichier temporaire
+  déjà reçu, avant de le charger en mémoire et bien avant tout décodage.
+"""
+import json
+
+from fastapi import UploadFile
+
+from processing.ingest import MAX_UPLOAD_BYTES, ImageRejected, check_image_limits, probe_image_header
+
+# Marge pour les en-têtes multipart et les autres champs du formulaire (polygones, bulles)
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+_READ_CHUNK_SIZE = 1024 * 1024
+
+class UploadLimitMiddleware:
+    """Middleware ASGI : limite la taille des corps multipart/form-data"""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, path_limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        # Limites propres à certaines routes (archives de chapitre par exemple)
+        self.path_limits = dict(path_limits or {})
+
+    async def _reject(self, send, max_bytes: int):
+        body = json.dumps({"detail": f"Fichier trop volumineux (maximum {max_bytes // (1024 * 1024)} Mo)"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        max_body = max_bytes + MULTIPART_OVERHEAD_BYTES
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+            await self._reject(send, max_bytes)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # Corps sans Content-Length trop long : on interrompt la lecture
+                    return {"type": "http.disconnect"}
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+async def read_image_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Vérifie taille, format et dimensions de l'image envoyée puis retourne ses octets.
+    Lève ImageRejected (avec le code HTTP 400, 413 ou 415) si l'image est refusée.
+    """
+    too_large = f"Fichier trop volumineux (maximum {max_bytes // (1024 * 1024)} Mo)"
+    if file.size is not None and file.size > max_bytes:
+        raise ImageRejected(too_large, status_code=413)
+
+    # Lecture de l'en-tête seulement, sur le fichier temporaire (mémoire ou disque)
+    await file.seek(0)
+    image_format, width, height = probe_image_header(file.file)
+    check_image_limits(image_format, width, height)
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImageRejected(too_large, status_code=413)
+        chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,186 @@
+"""
+Comptabilisation différée (write-behind) des statistiques d'utilisation.
+
+Les routes n'écrivent plus dans `usage_stats` : elles enregistrent des incréments
+en mémoire, qui sont agrégés par utilisateur puis écrits en lot par une tâche de fond
+(toutes les USAGE_FLUSH_INTERVAL secondes, ou dès que USAGE_FLUSH_MAX_PENDING
+utilisateurs sont en attente) et une dernière fois à l'arrêt de l'application.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.database import AsyncSessionLocal
+from models import models
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "30"))
+USAGE_FLUSH_MAX_PENDING = int(os.getenv("USAGE_FLUSH_MAX_PENDING", "500"))
+
+@dataclass
+class UsageDelta:
+    """Incréments en attente pour un utilisateur"""
+    images_processed: int = 0
+    processing_time: float = 0.0
+    last_activity: datetime = field(default_factory=datetime.utcnow)
+
+    def merge(self, other: "UsageDelta"):
+        self.images_processed += other.images_processed
+        self.processing_time += other.processing_time
+        self.last_activity = max(self.last_activity, other.last_activity)
+
+class UsageAccumulator:
+    """Tampon en mémoire des statistiques d'utilisation, vidé en lot vers la base"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, flush_interval: float = USAGE_FLUSH_INTERVAL,
+                 max_pending: int = USAGE_FLUSH_MAX_PENDING):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._loop = None
+        # Compteurs exposés pour le suivi
+        self.flush_count = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.last_flush_duration = 0.0
+
+    # === ENREGISTREMENT (chemin des requêtes, aucune écriture en base) ===
+    def record_processing(self, user_id: int, images_processed: int = 1, processing_time: float = 0.0):
+        """Enregistre un traitement d'image"""
+        self._add(user_id, UsageDelta(images_processed=images_processed, processing_time=processing_time))
+
+    def record_retreatment(self, user_id: int, processing_time: float = 0.0):
+        """Enregistre un retraitement : compté comme une image traitée (usage_stats.retreatment_count inchangé)"""
+        self._add(user_id, UsageDelta(images_processed=1, processing_time=processing_time))
+
+    def pending_for(self, user_id: int):
+        """Incréments pas encore écrits pour un utilisateur (None s'il n'y en a pas)"""
+        with self._lock:
+            delta = self._pending.get(user_id)
+            return UsageDelta(delta.images_processed, delta.processing_time, delta.last_activity) if delta else None
+
+    def _add(self, user_id: int, delta: UsageDelta):
+        with self._lock:
+            if user_id in self._pending:
+                self._pending[user_id].merge(delta)
+            else:
+                self._pending[user_id] = delta
+            should_flush = len(self._pending) >= self.max_pending
+        if should_flush:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Déclenche un vidage anticipé depuis n'importe quel thread"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._loop.create_task(self.flush())
+        else:
+            asyncio.run_coroutine_threadsafe(self.flush(), self._loop)
+
+    # === ÉCRITURE EN LOT ===
+    async def flush(self):
+        """Écrit tous les incréments en attente en une seule requête"""
+        async with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                async with self.session_factory() as db:
+                    # Un seul INSERT ... ON CONFLICT (user_id) DO UPDATE en lot grâce à l'index unique
+                    # uq_usage_stats_user_id : crée la ligne des nouveaux utilisateurs, incrémente les autres
+                    dialect_insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+                    table = models.UsageStats.__table__
+                    stmt = dialect_insert(table)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.user_id],
+                        set_={
+                            "images_processed": func.coalesce(table.c.images_processed, 0) + stmt.excluded.images_processed,
+                            "total_processing_time": func.coalesce(table.c.total_processing_time, 0.0) + stmt.excluded.total_processing_time,
+                            "last_activity": stmt.excluded.last_activity,
+                        },
+                    )
+                    await db.execute(stmt, [
+                        {
+                            "user_id": user_id,
+                            "images_processed": delta.images_processed,
+                            "total_processing_time": delta.processing_time,
+                            "retreatment_count": 0,
+                            "last_activity": delta.last_activity,
+                        }
+                        for user_id, delta in batch.items()
+                    ])
+                    await db.commit()
+            except Exception as e:
+                # Remettre les incréments dans le tampon pour le prochain essai
+                with self._lock:
+                    for user_id, delta in batch.items():
+                        if user_id in self._pending:
+                            delta.merge(self._pending[user_id])
+                        self._pending[user_id] = delta
+                self.failed_flushes += 1
+                logger.error(f"Erreur lors de l'écriture des statistiques d'utilisation: {e}")
+                return 0
+
+            self.flush_count += 1
+            self.rows_written += len(batch)
+            self.last_flush_duration = time.perf_counter() - start
+            logger.info(f"Statistiques d'utilisation écrites: {len(batch)} utilisateurs en {self.last_flush_duration * 1000:.1f} ms")
+            return len(batch)
+
+    # === CYCLE DE VIE ===
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Démarre la tâche de vidage périodique (à appeler au démarrage de l'application)"""
+        self._loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """Arrête la tâche périodique et écrit tout ce qui reste en attente"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get_stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_users": pending,
+            "flush_count": self.flush_count,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_duration_ms": round(self.last_flush_duration * 1000, 3),
+            "flush_interval_s": self.flush_interval,
+        }
+
+usage_accumulator = UsageAccumulator()
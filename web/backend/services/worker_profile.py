@@ -0,0 +1,53 @@
+"""
+Routes servies selon le profil du worker (WORKER_PROFILE, processing/model_loader.py).
+
+Un worker « clean » ne charge que Detectron2, un worker « translate » qu'EasyOCR et OpenAI : le
+répartiteur de charge envoie chaque route vers les workers qui la servent. Une requête arrivée sur
+un worker dont le profil n'a pas les modèles de la route est refusée (503) avant l'admission de
+quota et la lecture du fichier, avec l'en-tête X-Worker-Profile.
+
+- clean : /get-bubble-polygons, /stages/detect, /stages/clean, /stages/render, /reinsert
+- translate : /retreat-with-polygons, /stages/ocr et /stages/clean (avec `detections`), /stages/translate
+- full : toutes les routes
+"""
+import json
+
+from processing import model_loader
+
+# Modèles nécessaires à chaque route (les routes absentes n'en demandent aucun). /stages/clean et
+# /stages/ocr n'ont besoin de Detectron2 que sans `detections` : vérifié par la route (require_models).
+ROUTE_MODELS = {
+    "/process": ("detectron2", "easyocr", "openai"),
+    "/process-stream": ("detectron2", "easyocr", "openai"),
+    "/process-batch": ("detectron2", "easyocr", "openai"),
+    "/get-bubble-polygons": ("detectron2",),
+    "/retreat-with-polygons": ("easyocr", "openai"),
+    "/stages/detect": ("detectron2",),
+    "/stages/ocr": ("easyocr",),
+    "/stages/translate": ("openai",),
+}
+
+def unavailable_message(*models):
+    return (f"Ce worker (profil {model_loader.get_profile()}) ne sert pas cette route : "
+            f"modèles requis {', '.join(models)}")
+
+class WorkerProfileMiddleware:
+    """Middleware ASGI : 503 pour les routes dont les modèles sont exclus par le profil du worker"""
+
+    def __init__(self, app, route_models=None):
+        self.app = app
+        self.route_models = dict(ROUTE_MODELS if route_models is None else route_models)
+
+    async def __call__(self, scope, receive, send):
+        models = self.route_models.get(scope["path"]) if scope["type"] == "http" else None
+        if not models or model_loader.allows(*models):
+            await self.app(scope, receive, send)
+            return
+        body = json.dumps({"detail": unavailable_message(*models)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"x-worker-profile", model_loader.get_profile().encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
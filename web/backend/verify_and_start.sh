@@ -40,6 +40,14 @@ python -c "import detectron2; print(f'✅ Detectron2 installé')" || {
     python -m pip install git+https://github.com/facebookresearch/detectron2.git@b15f64ec4429e23a148972175a0207c5a9ab84cf
 }
 
+# Cache safetensors des poids (projeté en mémoire et partagé par les workers), s'il manque ou est périmé
+if [ -f "models_ai/model_final.pth" ]; then
+    python -m processing.weights_cache || echo "⚠️  Cache de poids non préparé, chargement depuis model_final.pth"
+fi
+
+# Charger les modèles dès le démarrage (en tâche de fond) plutôt qu'à la première requête
+export PRELOAD_MODELS="${PRELOAD_MODELS:-1}"
+
 # Démarrer l'application
 echo "🎯 Démarrage de l'API..."
 echo "🔧 Port utilisé: $PORT"